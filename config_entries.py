@@ -388,37 +388,45 @@ class ConfigEntries:
         )
         self.options = OptionsFlowManager(hass)
         self._hass_config = hass_config
-        self._entries: List[ConfigEntry] = []
+        self._entries: Dict[str, ConfigEntry] = {}
+        # Entry ids per domain, as insertion-ordered dicts for O(1) removal.
+        self._domain_index: Dict[str, Dict[str, None]] = {}
         self._store = hass.helpers.storage.Store(STORAGE_VERSION, STORAGE_KEY)
         EntityRegistryDisabledHandler(hass).async_setup()
 
     @callback
     def async_domains(self) -> List[str]:
         """Return domains for which we have entries."""
-        seen: Set[str] = set()
-        result = []
-
-        for entry in self._entries:
-            if entry.domain not in seen:
-                seen.add(entry.domain)
-                result.append(entry.domain)
-
-        return result
+        return list(self._domain_index)
 
     @callback
     def async_get_entry(self, entry_id: str) -> Optional[ConfigEntry]:
         """Return entry with matching entry_id."""
-        for entry in self._entries:
-            if entry_id == entry.entry_id:
-                return entry
-        return None
+        return self._entries.get(entry_id)
 
     @callback
     def async_entries(self, domain: Optional[str] = None) -> List[ConfigEntry]:
         """Return all entries or entries for a specific domain."""
         if domain is None:
-            return list(self._entries)
-        return [entry for entry in self._entries if entry.domain == domain]
+            return list(self._entries.values())
+        return [
+            self._entries[entry_id] for entry_id in self._domain_index.get(domain, ())
+        ]
+
+    @callback
+    def _async_add_entry(self, entry: ConfigEntry) -> None:
+        """Add an entry to the entries and to the domain index."""
+        self._entries[entry.entry_id] = entry
+        self._domain_index.setdefault(entry.domain, {})[entry.entry_id] = None
+
+    @callback
+    def _async_remove_entry(self, entry: ConfigEntry) -> None:
+        """Remove an entry from the entries and from the domain index."""
+        del self._entries[entry.entry_id]
+        entry_ids = self._domain_index[entry.domain]
+        del entry_ids[entry.entry_id]
+        if not entry_ids:
+            del self._domain_index[entry.domain]
 
     async def async_remove(self, entry_id: str) -> Dict[str, Any]:
         """Remove an entry."""
@@ -434,7 +442,7 @@ class ConfigEntries:
 
         await entry.async_remove(self.hass)
 
-        self._entries.remove(entry)
+        self._async_remove_entry(entry)
         self._async_schedule_save()
 
         dev_reg, ent_reg = await asyncio.gather(
@@ -456,27 +464,29 @@ class ConfigEntries:
             old_conf_migrate_func=_old_conf_migrator,
         )
 
+        self._entries = {}
+        self._domain_index = {}
+
         if config is None:
-            self._entries = []
             return
 
-        self._entries = [
-            ConfigEntry(
-                version=entry["version"],
-                domain=entry["domain"],
-                entry_id=entry["entry_id"],
-                data=entry["data"],
-                source=entry["source"],
-                title=entry["title"],
-                # New in 0.79
-                connection_class=entry.get("connection_class", CONN_CLASS_UNKNOWN),
-                # New in 0.89
-                options=entry.get("options"),
-                # New in 0.98
-                system_options=entry.get("system_options", {}),
+        for entry in config["entries"]:
+            self._async_add_entry(
+                ConfigEntry(
+                    version=entry["version"],
+                    domain=entry["domain"],
+                    entry_id=entry["entry_id"],
+                    data=entry["data"],
+                    source=entry["source"],
+                    title=entry["title"],
+                    # New in 0.79
+                    connection_class=entry.get("connection_class", CONN_CLASS_UNKNOWN),
+                    # New in 0.89
+                    options=entry.get("options"),
+                    # New in 0.98
+                    system_options=entry.get("system_options", {}),
+                )
             )
-            for entry in config["entries"]
-        ]
 
     async def async_setup(self, entry_id: str) -> bool:
         """Set up a config entry.
@@ -613,7 +623,7 @@ class ConfigEntries:
             source=flow.context["source"],
             connection_class=flow.CONNECTION_CLASS,
         )
-        self._entries.append(entry)
+        self._async_add_entry(entry)
         self._async_schedule_save()
 
         await self.async_setup(entry.entry_id)
@@ -677,7 +687,7 @@ class ConfigEntries:
     @callback
     def _data_to_save(self) -> Dict[str, List[Dict[str, Any]]]:
         """Return data to save."""
-        return {"entries": [entry.as_dict() for entry in self._entries]}
+        return {"entries": [entry.as_dict() for entry in self._entries.values()]}
 
 
 async def _old_conf_migrator(old_config: Dict[str, Any]) -> Dict[str, Any]:
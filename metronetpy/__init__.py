@@ -1,5 +1,35 @@
 """The Metronet IESS Online bridge."""
+import importlib
+from typing import TYPE_CHECKING
+
 from .__version__ import __version__
-from .bridge import MetronetBridge
 
-__all__ = ["MetronetBridge", "__version__"]
+if TYPE_CHECKING:  # pragma: no cover
+    from .aiobridge import AsyncMetronetBridge
+    from .bridge import MetronetBridge
+    from .hub import MetronetHub
+
+# The bridges import the http clients, they are loaded on first access so
+# that importing the package, or a light module of it, stays fast.
+_EXPORTS = {
+    "AsyncMetronetBridge": ".aiobridge",
+    "MetronetBridge": ".bridge",
+    "MetronetHub": ".hub",
+}
+
+__all__ = ["AsyncMetronetBridge", "MetronetBridge", "MetronetHub", "__version__"]
+
+
+def __getattr__(name):
+    """Import an exported class on first access."""
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    """Return the names of the module, with the lazy exports."""
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,146 @@
+"""The Metronet IESS Online bridge."""
+import asyncio
+import logging
+
+from .aioiess import AsyncController
+from .bridge import MetronetBridge
+from .iess import METRONET_URL
+from .waiters import FutureWaiter
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncMetronetBridge(MetronetBridge):
+    """The Metronet asyncio Bridge class.
+
+    The class is the public interface exposed to asyncio clients.
+    The main loop runs as a task of the running event loop, wait and
+    stop are coroutines.
+    """
+
+    # The coroutines override the blocking methods of the MetronetBridge.
+    # pylint: disable=invalid-overridden-method
+
+    def __init__(
+        self,
+        username,
+        password,
+        connector=None,
+        base_url=METRONET_URL,
+        transport=None,
+    ):
+        """Init for data."""
+        super().__init__(
+            username,
+            password,
+            AsyncController(username, password, connector, base_url, transport),
+        )
+        self._task = None
+        self._event_loop = None
+        self._stopped = None
+
+    async def connect(self):
+        """Connect to metronet."""
+        _LOGGER.debug("Connect")
+
+        if await self.controller.resume():
+            _LOGGER.debug("Resumed cached session")
+            return True
+
+        await self.controller.init_session()
+
+        _LOGGER.debug("Logging in")
+        logged_in = await self.controller.login()
+        if logged_in:
+            self.controller.save_session()
+        return logged_in
+
+    async def get_sensors(self):
+        """Get sensor list and initial value.
+
+        With a catalog cache the sensor list is read from the cache and
+        refreshed when the main loop starts.
+        """
+        if not self.controller.load_catalog():
+            await self.controller.get_strings()
+
+        await self.controller.get_inputs()
+
+        return self.controller.get_sensors()
+
+    async def wait_for_change(self, sensor_ids=None, predicate=None, timeout=None):
+        """Wait until a poll changes one of the sensors.
+
+        Like MetronetBridge.wait_for_change, the future of the wait is
+        resolved by the main loop task.
+        """
+        waiter = FutureWaiter(asyncio.get_running_loop(), sensor_ids, predicate)
+        self.controller.add_waiter(waiter)
+        try:
+            return await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.controller.remove_waiter(waiter)
+
+    def main_loop(self):
+        """Start main loop as a task of the running event loop."""
+        if self.controller.dispatcher is not None:
+            self.controller.dispatcher.start()
+        self.controller.run = True
+        self.shutdown.clear()
+        self._event_loop = asyncio.get_running_loop()
+        if self._stopped is None:
+            self._stopped = asyncio.Event()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self.controller.message_loop())
+        self._task.add_done_callback(lambda task: self._set_shutdown())
+
+    def _set_shutdown(self):
+        """Set shutdown and wake the waiters of the event loop."""
+        self.shutdown.set()
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def request_stop(self):
+        """Ask the waiters of the main loop to stop it.
+
+        Safe in a signal handler and from other threads.
+        """
+        self.shutdown.set()
+        if self._event_loop is not None and not self._event_loop.is_closed():
+            self._event_loop.call_soon_threadsafe(self._set_shutdown)
+
+    async def wait(self, timeout=None):
+        """Wait until the main loop ends or a stop is requested.
+
+        Returns False when timeout expires first.
+        """
+        if self.shutdown.is_set():
+            return True
+        self._event_loop = asyncio.get_running_loop()
+        if self._stopped is None:
+            self._stopped = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout)
+        except asyncio.TimeoutError:
+            return self.shutdown.is_set()
+        return True
+
+    async def stop(self):
+        """Stop main loop, close the session and the journal."""
+        self.controller.cancel_waiters()
+        if self.controller.run:
+            self.controller.stop_loop()
+            # The loop is most likely waiting on the updates long-poll.
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            if self.controller.dispatcher is not None:
+                await self.controller.dispatcher.stop()
+        self.controller.save_session()
+        await self.controller.close()
+        self.close_journal()
+        self._set_shutdown()
@@ -0,0 +1,373 @@
+"""The Metronet IESS Online bridge."""
+import asyncio
+import logging
+import time
+
+from .aiotransport import AiohttpTransport
+from .decoder import InputsDecoder, StatusPageDecoder, StringsDecoder
+from .iess import (
+    METRONET_URL,
+    VALIDATE_TIMEOUT,
+    Controller,
+    login_headers,
+    session_headers,
+)
+from .transport import TransportConnectTimeout, TransportTimeout
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def decode(decoder, resp):
+    """Stream the body of a response to a decoder and return all the records."""
+    records = []
+    async for chunk in resp.iter_chunks():
+        records.extend(decoder.feed(chunk))
+    records.extend(decoder.close())
+    return records
+
+
+async def read_status_page(resp):
+    """Read the variables of a Status page response.
+
+    Stops reading at the last variable needed.
+    """
+    decoder = StatusPageDecoder()
+    async for chunk in resp.iter_chunks():
+        if decoder.feed(chunk):
+            break
+    return decoder.close()
+
+
+class AsyncController(Controller):
+    """The Metronet asyncio Controller class.
+
+    Same flow of the Controller class, but every network call is a
+    coroutine so that many sessions can long-poll on a single event loop.
+    """
+
+    # The coroutines override the blocking methods of the Controller. The
+    # handlers raising CancelledError again come before those of Exception,
+    # which catch it too before Python 3.8.
+    # pylint: disable=invalid-overridden-method,try-except-raise
+
+    def __init__(
+        self,
+        username,
+        password,
+        connector=None,
+        base_url=METRONET_URL,
+        transport=None,
+    ):
+        """Init for data.
+
+        When a connector is given it is shared with the other controllers
+        and is not closed by this one. transport defaults to an
+        AiohttpTransport on the connector.
+        """
+        super().__init__(
+            username, password, base_url, transport or AiohttpTransport(connector)
+        )
+
+    async def init_session(self):
+        """Initialize the metronet session."""
+        self.transport.open()
+
+        await self.throttle("home")
+        async with self.transport.request("GET", "home", self.base_url) as resp:
+            _LOGGER.debug("Init Session Cookie -> response code: %d", resp.status)
+
+        self.transport.update_headers(session_headers(self.base_url))
+
+    async def resume(self):
+        """Resume the cached session, returns False if it is not valid."""
+        if self.session_cache is None:
+            return False
+        state = self.session_cache.load(self.username, self.base_url)
+        if state is None:
+            return False
+        self.restore_session(state)
+        try:
+            valid = await self.validate_session()
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            _LOGGER.error("Resume -> Exception!")
+            valid = False
+        _LOGGER.debug("Resume -> valid: %s", valid)
+        return valid
+
+    async def validate_session(self):
+        """Check the session with a single updates request.
+
+        Asks for the changes since the first input, so that the server
+        replies at once; a request still held by the long-poll means
+        anyway that the session has been accepted. A connect timeout
+        tells nothing of the session, it is reported as not valid so
+        that a full login follows.
+        """
+        data = dict(self.updates_data(), Inputs=0)
+        await self.throttle("updates")
+        try:
+            async with self.transport.request(
+                "POST",
+                "updates",
+                self.api_url("updates"),
+                data=data,
+                read=VALIDATE_TIMEOUT,
+            ) as resp:
+                _LOGGER.debug("Validate -> response code: %d", resp.status)
+                return resp.status == 200
+        except TransportConnectTimeout:
+            _LOGGER.debug("Validate -> connect timeout")
+            return False
+        except TransportTimeout:
+            return True
+
+    async def login(self):
+        """Login to metronet, unless the login circuit breaker is open."""
+        if not self.allow_login():
+            return False
+        logged_in = False
+        try:
+            logged_in = await self.send_login()
+        finally:
+            self.breaker.record(logged_in)
+        return logged_in
+
+    async def send_login(self):
+        """Send the login form, returns True when logged in."""
+        self.transport.update_headers(login_headers(self.base_url))
+
+        await self.throttle("login")
+        async with self.transport.request(
+            "POST", "login", self.base_url, data=self.login_data(), stream=True
+        ) as resp:
+            _LOGGER.debug("Login -> response code: %d", resp.status)
+
+            logged_in = resp.url == self.status_url
+            if logged_in:
+                logged_in = self.set_status(await read_status_page(resp))
+            _LOGGER.debug("Login -> logged in: %s", logged_in)
+        if not logged_in:
+            self.metrics.failed_logins.inc()
+        return logged_in
+
+    async def read_strings(self, wanted=None):
+        """Read the (idx, description) of the inputs from metronet.
+
+        wanted is a container of the indices to keep, None to keep all.
+        """
+        data = {"sessionId": self.session_id}
+
+        await self.throttle("strings")
+        async with self.transport.request(
+            "POST", "strings", self.api_url("strings"), data=data, stream=True
+        ) as resp:
+            _LOGGER.debug("Strings-> response code: %d", resp.status)
+
+            return await decode(StringsDecoder(wanted), resp)
+
+    async def get_strings(self):
+        """Read sensor list from metronet.
+
+        With a catalog cache the whole catalog is read and stored.
+        """
+        if self.catalog_cache is None:
+            self.process_strings(await self.read_strings(self.sensors or None))
+            return
+        catalog = await self.read_strings()
+        self.catalog_cache.save(self.username, self.base_url, catalog)
+        self.process_strings(catalog)
+
+    async def refresh_catalog(self):
+        """Read the catalog from metronet and update the cache if changed.
+
+        Sensors without a name get it now, new inputs are added to the
+        sensor list at the next start.
+        """
+        self.refresh_pending = False
+        try:
+            catalog = await self.read_strings()
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            _LOGGER.error("Refresh Catalog -> Exception!")
+            return
+        if self.catalog_cache.save(self.username, self.base_url, catalog):
+            _LOGGER.info("Refresh Catalog -> sensor catalog changed")
+            self.process_strings(catalog)
+
+    async def read_inputs(self):
+        """Read sensor values from metronet, return False on errors."""
+        data = {"sessionId": self.session_id}
+
+        decoder = InputsDecoder(self.sensors)
+        await self.throttle("inputs")
+        start = time.monotonic()
+        self.recorder.record("inputs.start")
+        try:
+            async with self.transport.request(
+                "POST", "inputs", self.api_url("inputs"), data=data, stream=True
+            ) as resp:
+                if resp.status != 200:
+                    self.recorder.record("inputs.end", status=resp.status)
+                    return False
+                states = await decode(decoder, resp)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            self.recorder.record("inputs.error", error=repr(err))
+            _LOGGER.error("Get Inputs -> Exception!")
+            return False
+        changes = self.process_inputs(states, decoder.last_id)
+        elapsed = time.monotonic() - start
+        self.metrics.inputs.observe(elapsed)
+        self.recorder.record(
+            "inputs.end", status=200, changes=len(changes), elapsed=elapsed
+        )
+        if self.dispatcher is not None:
+            await self.dispatcher.wait_space()
+        return True
+
+    async def get_inputs(self):
+        """Read sensor values from metronet.
+
+        On errors relogins and tries again, waiting the scheduler backoff
+        after the first retry, until the retry budget is spent.
+        Returns False when giving up.
+        """
+        retries = 0
+        while not await self.read_inputs():
+            if retries >= self.scheduler.retry_budget:
+                _LOGGER.error("Get Inputs -> Retry budget exhausted")
+                return False
+            retries += 1
+            if retries > 1:
+                _LOGGER.warning("Get Inputs -> Error after relogin")
+                await self.wait(self.scheduler.backoff(retries - 1))
+            _LOGGER.info("Get Inputs -> Relogin")
+            await self.relogin("inputs failed")
+        return True
+
+    async def get_updates(self):
+        """Ask metronet for updaes.
+
+        The long-poll timeout is given by the scheduler, which learns the
+        hold time of the server from the replies without changes.
+        """
+        data = self.updates_data()
+        timeout = self.scheduler.updates_timeout()
+        await self.throttle("updates")
+        start = time.monotonic()
+        self.recorder.record(
+            "updates.start", last_input=self.last_input, timeout=timeout
+        )
+        try:
+            async with self.transport.request(
+                "POST", "updates", self.api_url("updates"), data=data, read=timeout
+            ) as resp:
+                status = resp.status
+                page = await resp.json() if resp.status == 200 else None
+        except asyncio.CancelledError:
+            raise
+        except TransportTimeout:
+            self.recorder.record("updates.timeout", timeout=timeout)
+            self.metrics.timeouts.inc()
+            self.scheduler.observe_timeout()
+            return False
+        except Exception as err:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            self.recorder.record("updates.error", error=repr(err))
+            _LOGGER.error("Updates -> Exception!")
+            await self.failed()
+            return False
+        # A reply without HasChanges is an error reply, like a bad status.
+        changes = page.get("HasChanges") if isinstance(page, dict) else None
+        if changes is not None:
+            elapsed = time.monotonic() - start
+            self.observe_updates(changes, elapsed)
+            self.recorder.record(
+                "updates.end", status=status, changes=changes, elapsed=elapsed
+            )
+            self.failures = 0
+            return changes
+        reason = f"updates status {status}"
+        if page is not None:
+            reason = "updates reply without HasChanges"
+        _LOGGER.info("Updates -> Relogin")
+        self.recorder.record("updates.end", status=status)
+        logged_in = await self.relogin(reason)
+        if not logged_in:
+            _LOGGER.error("Updates -> Failed to login")
+            await self.failed()
+            return False
+        self.failures = 0
+        return True
+
+    async def relogin(self, reason=None):
+        """Login again, returns False also on connection errors.
+
+        reason tells why, for the flight recorder.
+        """
+        self.metrics.relogins.inc()
+        self.recorder.record("relogin", reason=reason)
+        try:
+            logged_in = await self.login()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            self.metrics.failed_logins.inc()
+            self.recorder.record("relogin.error", error=repr(err))
+            _LOGGER.error("Relogin -> Exception!")
+            return False
+        self.recorder.record("relogin.end", logged_in=logged_in)
+        if logged_in:
+            self.save_session()
+        return logged_in
+
+    async def failed(self):
+        """Wait the scheduler backoff after a failure of the loop.
+
+        While the login breaker is open waits at least until its next probe.
+        """
+        self.failures += 1
+        delay = max(self.scheduler.backoff(self.failures), self.breaker.retry_in())
+        self.recorder.record("failure", failures=self.failures, delay=delay)
+        await self.wait(delay)
+
+    async def throttle(self, endpoint):
+        """Wait for the request budget before a request to endpoint."""
+        delay = self.reserve(endpoint)
+        if delay:
+            await self.wait(delay)
+
+    async def wait(self, delay):
+        """Wait for delay seconds, the task is cancelled to stop the loop."""
+        await asyncio.sleep(delay)
+
+    async def message_loop(self):
+        """Message loop.
+
+        Asks for sensor updates,
+        if the metronet cloud replies that something has changed,
+        asks or updated sensor values and repeat the process.
+        """
+        _LOGGER.info("Mainloop: Started")
+        if self.refresh_pending:
+            await self.refresh_catalog()
+        while self.run:
+            # Loop forever
+            update = await self.get_updates()
+            # Ask for update
+            if update:
+                # Get inputs
+                await self.get_inputs()
+        _LOGGER.info("Mainloop: ended")
+
+    async def close(self):
+        """Close the http session."""
+        await self.transport.close()
@@ -0,0 +1,286 @@
+"""The Metronet IESS Online bridge.
+
+Transports of the AsyncController. request is an async context manager
+and the methods of the responses reading the body are coroutines.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+import json
+import time
+
+import aiohttp
+from yarl import URL
+
+from .decoder import CHUNK_SIZE
+from .replay import RecordingResponse, RecordingTransport, ReplayTransport
+from .transport import (
+    KEEPALIVE,
+    MemoryResponse,
+    MemoryTransport,
+    Transport,
+    TransportConnectTimeout,
+    TransportTimeout,
+)
+
+# The connect timeout error of aiohttp 3.10 and later, older versions
+# raise a ServerTimeoutError for both timeouts.
+_CONNECT_TIMEOUT = getattr(  # pylint: disable=invalid-name
+    aiohttp, "ConnectionTimeoutError", ()
+)
+
+# The coroutines of the transports and of the responses override the
+# blocking methods of the same name.
+# pylint: disable=invalid-overridden-method
+
+
+class AiohttpResponse:
+    """Response of the aiohttp transport."""
+
+    __slots__ = ("response",)
+
+    def __init__(self, response):
+        """Init for data."""
+        self.response = response
+
+    @property
+    def status(self):
+        """Return the status code."""
+        return self.response.status
+
+    @property
+    def url(self):
+        """Return the url, after the redirects."""
+        return str(self.response.url)
+
+    async def text(self):
+        """Return the body as text."""
+        return await self.response.text()
+
+    async def json(self):
+        """Return the body decoded from json."""
+        return await self.response.json(content_type=None)
+
+    async def iter_chunks(self):
+        """Iterate on the chunks of the body."""
+        async for chunk in self.response.content.iter_chunked(CHUNK_SIZE):
+            yield chunk
+
+
+class AiohttpTransport(Transport):
+    """Transport on an aiohttp session.
+
+    When a connector is given it is shared with other transports and is
+    not closed by this one, otherwise a connector with pool_size
+    connections is created. Connection reuse is counted by tracing the
+    session.
+    """
+
+    def __init__(self, connector=None, timeouts=None, pool_size=2):
+        """Init for data."""
+        super().__init__(timeouts)
+        self.connector = connector
+        self.pool_size = pool_size
+        self.session = None
+        self.created = 0
+        self._owner = connector is None
+
+    def connections(self):
+        """Return the number of connections opened so far."""
+        return self.created
+
+    def set_connector(self, connector):
+        """Share a connector, which is not closed by this transport.
+
+        Must be called before the session is opened.
+        """
+        if self.session is not None:
+            raise RuntimeError("The session of the transport is already open")
+        self.connector = connector
+        self._owner = False
+
+    async def _on_request(self, session, context, params):
+        """Count a request."""
+        self.requests += 1
+
+    async def _on_connection(self, session, context, params):
+        """Count a new connection."""
+        self.created += 1
+
+    def open(self):
+        """Start a new session, with no cookies and the default headers."""
+        if self.session is None:
+            if self.connector is None:
+                self.connector = aiohttp.TCPConnector(
+                    limit=self.pool_size, keepalive_timeout=KEEPALIVE
+                )
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_request)
+            trace.on_connection_create_end.append(self._on_connection)
+            # The jar belongs to this session only, accept also cookies of
+            # base urls given as ip address (a local stand-in).
+            self.session = aiohttp.ClientSession(
+                connector=self.connector,
+                connector_owner=False,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                trace_configs=[trace],
+            )
+        self.session.cookie_jar.clear()
+        self.session.headers.clear()
+
+    def update_headers(self, headers):
+        """Add headers to every request of the session."""
+        self.session.headers.update(headers)
+
+    def get_cookies(self):
+        """Return the cookies of the session as a list of dicts."""
+        if self.session is None:
+            return []
+        return [
+            {
+                "name": morsel.key,
+                "value": morsel.value,
+                "domain": morsel["domain"],
+                "path": morsel["path"],
+            }
+            for morsel in self.session.cookie_jar
+        ]
+
+    def set_cookies(self, cookies, url):
+        """Add cookies, as returned by get_cookies, to the session."""
+        self.session.cookie_jar.update_cookies(
+            {cookie["name"]: cookie["value"] for cookie in cookies}, URL(url)
+        )
+
+    @asynccontextmanager
+    async def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Send a request and return the response in an async with block."""
+        connect, read = self.timeout(endpoint, read)
+        timeout = aiohttp.ClientTimeout(total=None, connect=connect, sock_read=read)
+        try:
+            async with self.session.request(
+                method, url, data=data, timeout=timeout
+            ) as resp:
+                yield AiohttpResponse(resp)
+        except _CONNECT_TIMEOUT as err:
+            raise TransportConnectTimeout(f"{endpoint} connect timed out") from err
+        except asyncio.TimeoutError as err:
+            raise TransportTimeout(f"{endpoint} timed out") from err
+
+    async def close(self):
+        """Close the session and the pooled connections."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self._owner and self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+
+
+class AsyncMemoryResponse(MemoryResponse):
+    """Response of the asyncio in-memory transport."""
+
+    __slots__ = ()
+
+    async def text(self):
+        """Return the body as text."""
+        return self.body.decode()
+
+    async def json(self):
+        """Return the body decoded from json."""
+        return json.loads(self.body)
+
+    async def iter_chunks(self):
+        """Iterate on the chunks of the body."""
+        for start in range(0, len(self.body), CHUNK_SIZE):
+            yield self.body[start : start + CHUNK_SIZE]
+
+
+class AsyncMemoryTransport(MemoryTransport):
+    """Asyncio transport calling a metronet application in the same process.
+
+    The application runs in the worker threads, so that its long-polls do
+    not block the event loop.
+    """
+
+    @asynccontextmanager
+    async def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Send a request and return the response in an async with block."""
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(self._executor, self.call, method, url, data)
+        try:
+            resp = await asyncio.wait_for(call, self.timeout(endpoint, read)[1])
+        except asyncio.TimeoutError as err:
+            raise TransportTimeout(f"{endpoint} timed out") from err
+        yield AsyncMemoryResponse(resp.status, resp.url, resp.body)
+
+    async def close(self):
+        """Forget the session, a request still waiting is abandoned."""
+        self.open()
+
+
+class AsyncRecordingResponse(RecordingResponse):
+    """Response recording the body read from the async response it wraps."""
+
+    async def text(self):
+        """Return the body as text."""
+        text = await self.response.text()
+        self._body.append(text.encode())
+        return text
+
+    async def json(self):
+        """Return the body decoded from json."""
+        return json.loads(await self.text())
+
+    async def iter_chunks(self):
+        """Iterate on the chunks of the body."""
+        async for chunk in self.response.iter_chunks():
+            self._body.append(chunk)
+            yield chunk
+
+
+class AsyncRecordingTransport(RecordingTransport):
+    """Transport recording the responses of an async transport to a capture."""
+
+    @asynccontextmanager
+    async def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Send a request through the wrapped transport and record it."""
+        start = time.monotonic()
+        try:
+            async with self.transport.request(
+                method, endpoint, url, data, stream, read
+            ) as resp:
+                recording = AsyncRecordingResponse(
+                    resp, self.capture, start, method, endpoint
+                )
+                try:
+                    yield recording
+                finally:
+                    recording.record()
+        except TransportTimeout:
+            self.capture.add(start, method, endpoint)
+            raise
+
+    async def close(self):
+        """Close the wrapped transport and the capture."""
+        await self.transport.close()
+        self.capture.close()
+
+
+class AsyncReplayTransport(ReplayTransport):
+    """Asyncio transport answering the requests with a capture."""
+
+    @asynccontextmanager
+    async def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Return the next recorded response of the endpoint."""
+        self.requests += 1
+        entry = self.next_entry(endpoint)
+        delay, timeout = self.delay(entry, self.timeout(endpoint, read)[1])
+        if delay:
+            await asyncio.sleep(delay)
+        if timeout:
+            raise TransportTimeout(f"{endpoint} timed out")
+        yield self.response(entry, url, AsyncMemoryResponse)
+
+    async def close(self):
+        """Nothing to close."""
@@ -0,0 +1,42 @@
+"""The Metronet IESS Online bridge.
+
+Benchmarks of the poll, parse and notify path against a local stand-in.
+"""
+import json
+import logging
+import platform
+import time
+
+from ..__version__ import __version__
+from .cases import bench_get_inputs, bench_notify_latency, bench_relogin
+
+_LOGGER = logging.getLogger(__name__)
+
+SIZES = (100, 1000, 10000)
+
+
+def run_benchmarks(sizes=SIZES, rounds=50, samples=20, output=None):
+    """Run every benchmark and return the results.
+
+    When output is given the results are also written there as json.
+    """
+    results = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "get_inputs": [],
+    }
+    for size in sizes:
+        _LOGGER.info("Bench: get_inputs with %d inputs", size)
+        results["get_inputs"].append(bench_get_inputs(size, rounds))
+    _LOGGER.info("Bench: notify latency")
+    results["notify_latency"] = bench_notify_latency(samples)
+    _LOGGER.info("Bench: relogin recovery")
+    results["relogin"] = bench_relogin(samples)
+
+    if output is not None:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        _LOGGER.info("Bench: results written to %s", output)
+    return results
@@ -0,0 +1,126 @@
+"""The Metronet IESS Online bridge."""
+import random
+import threading
+import time
+
+from ..bridge import MetronetBridge
+from ..decoder import InputsDecoder, decode
+from ..standin import StandInApp, StandInServer
+
+USERNAME = "bench"
+PASSWORD = "bench"
+
+
+def summary(values):
+    """Return mean and percentiles, in milliseconds, of a list of seconds."""
+    values = sorted(values)
+    count = len(values)
+    return {
+        "count": count,
+        "mean_ms": sum(values) / count * 1000,
+        "p50_ms": values[count // 2] * 1000,
+        "p95_ms": values[min(count - 1, int(count * 0.95))] * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def connect(server):
+    """Return a bridge logged in to the stand-in, with every sensor loaded."""
+    bridge = MetronetBridge(USERNAME, PASSWORD, base_url=server.url)
+    if not bridge.connect():
+        raise RuntimeError("Could not login to the stand-in")
+    bridge.get_sensors()
+    return bridge
+
+
+def bench_get_inputs(size, rounds):
+    """Measure get_inputs with size inputs.
+
+    The round trip includes http, parse_and_diff only the decoding and
+    the Controller processing of an already received body.
+    """
+    app = StandInApp(inputs=size)
+    with StandInServer(app) as server:
+        controller = connect(server).controller
+        flips = max(1, size // 100)
+
+        round_trip = []
+        for _ in range(rounds):
+            for _ in range(flips):
+                app.flip(random.randrange(size))
+            start = time.perf_counter()
+            controller.get_inputs()
+            round_trip.append(time.perf_counter() - start)
+
+        pages = []
+        form = {"sessionId": controller.session_id}
+        for _ in range(2):
+            for _ in range(flips):
+                app.flip(random.randrange(size))
+            pages.append(app.handle("POST", "/api/inputs", form, None)[2])
+        parse = []
+        for idx in range(rounds):
+            start = time.perf_counter()
+            decoder = InputsDecoder(controller.sensors)
+            states = decode(decoder, [pages[idx % 2]])
+            controller.process_inputs(states, decoder.last_id)
+            parse.append(time.perf_counter() - start)
+
+    parse_summary = summary(parse)
+    return {
+        "inputs": size,
+        "round_trip": summary(round_trip),
+        "parse_and_diff": parse_summary,
+        "inputs_per_second": size / (parse_summary["mean_ms"] / 1000),
+    }
+
+
+class CallbackTimer:
+    """Callback recording when it has been called."""
+
+    def __init__(self, bridge, index):
+        """Init for data and register the callback."""
+        self.fired = None
+        self.event = threading.Event()
+        bridge.register_callback(index, self)
+
+    def __call__(self, idx, active):
+        """Record the callback time."""
+        self.fired = time.perf_counter()
+        self.event.set()
+
+    def flip(self, app, index):
+        """Flip an input and return the seconds until the callback fires."""
+        self.event.clear()
+        start = time.perf_counter()
+        app.flip(index)
+        if not self.event.wait(30):
+            raise RuntimeError("Callback not called")
+        return self.fired - start
+
+
+def bench_notify_latency(samples):
+    """Measure the latency from an input change to its callback."""
+    app = StandInApp(inputs=32, hold=1)
+    with StandInServer(app) as server:
+        bridge = connect(server)
+        timer = CallbackTimer(bridge, 0)
+        bridge.main_loop()
+        latency = [timer.flip(app, 0) for _ in range(samples)]
+        bridge.stop()
+    return summary(latency)
+
+
+def bench_relogin(samples):
+    """Measure the latency of an input change right after a session expiry."""
+    app = StandInApp(inputs=32, hold=1)
+    with StandInServer(app) as server:
+        bridge = connect(server)
+        timer = CallbackTimer(bridge, 0)
+        bridge.main_loop()
+        latency = []
+        for _ in range(samples):
+            app.expire_sessions()
+            latency.append(timer.flip(app, 0))
+        bridge.stop()
+    return summary(latency)
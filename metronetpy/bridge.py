@@ -1,8 +1,11 @@
 """The Metronet IESS Online bridge."""
 import logging
+import signal
+import sys
 import threading
 
-from .iess import Controller
+from .iess import METRONET_URL, Controller
+from .waiters import ThreadWaiter
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -13,9 +16,19 @@ class MetronetBridge:
     The class is the public interface exposed to client.
     """
 
-    def __init__(self, username, password):
+    def __init__(
+        self,
+        username,
+        password,
+        controller=None,
+        base_url=METRONET_URL,
+        transport=None,
+    ):
         """Init for data."""
-        self.controller = Controller(username, password)
+        if controller is None:
+            controller = Controller(username, password, base_url, transport)
+        self.controller = controller
+        self.shutdown = threading.Event()
         self._thread = None
 
     def register_callback(self, sensor_id, func):
@@ -30,6 +43,106 @@ class MetronetBridge:
             self.controller.callbacks[sensor_id] = []
         self.controller.callbacks[sensor_id].append(func)
 
+    def register_batch_callback(self, func):
+        """Store a batch callback.
+
+        The callback is called once per poll with a ChangeBatch holding the
+        timestamp, the last input cursor and every (idx, active) change.
+        """
+        self.controller.batch_callbacks.append(func)
+
+    def set_dispatcher(self, dispatcher):
+        """Run callbacks through a dispatcher instead of the polling thread.
+
+        The dispatcher is started and stopped with the main loop.
+        """
+        dispatcher.metrics = self.controller.metrics
+        self.controller.dispatcher = dispatcher
+
+    def set_session_cache(self, cache):
+        """Cache the login session on disk, so restarts skip the login."""
+        self.controller.session_cache = cache
+
+    def set_catalog_cache(self, cache):
+        """Cache the sensor catalog on disk, so restarts skip get_strings."""
+        self.controller.catalog_cache = cache
+
+    def set_journal(self, journal):
+        """Append every sensor transition to a Journal, closed by stop."""
+        self.controller.journal = journal
+
+    def close_journal(self):
+        """Close the Journal, stop closes it too."""
+        if self.controller.journal is not None:
+            self.controller.journal.close()
+            self.controller.journal = None
+
+    def set_budget(self, budget):
+        """Delay the requests to metronet to fit a RequestBudget."""
+        self.controller.budget = budget
+
+    def set_breaker(self, breaker):
+        """Replace the circuit breaker of the logins."""
+        self.controller.breaker = breaker
+
+    def set_scheduler(self, scheduler):
+        """Replace the scheduler of retries and long-poll timeouts."""
+        self.controller.scheduler = scheduler
+
+    def stats(self):
+        """Return the metrics of the polling loop.
+
+        The polling metrics are keyed by name, with the transport, login
+        breaker, request budget and dispatcher statistics under their keys.
+        """
+        stats = self.controller.metrics.collect()
+        stats.update(self.gauges())
+        return stats
+
+    def gauges(self):
+        """Return the statistics of the parts of the controller."""
+        gauges = {
+            "transport": self.controller.transport.stats(),
+            "breaker": self.controller.breaker.stats(),
+        }
+        if self.controller.budget is not None:
+            gauges["budget"] = self.controller.budget.stats()
+        if self.controller.dispatcher is not None:
+            gauges["dispatcher"] = self.controller.dispatcher.stats()
+        return gauges
+
+    def prometheus(self):
+        """Return the metrics of the polling loop as Prometheus text."""
+        gauges = {f"metronet_{name}": values for name, values in self.gauges().items()}
+        return self.controller.metrics.prometheus(
+            {"account": self.controller.username}, gauges
+        )
+
+    def dump_events(self, file=None):
+        """Return the recent events of the polling loop, oldest first.
+
+        When file is given the events are also written to it as json lines.
+        """
+        if file is not None:
+            self.controller.recorder.write(file)
+        return self.controller.recorder.dump()
+
+    def install_dump_signal(self, signum=getattr(signal, "SIGUSR1", None), path=None):
+        """Dump the recent events of the polling loop on a signal.
+
+        The events are appended to path, or written to stderr. Must be
+        called from the main thread.
+        """
+
+        def handler(signum, frame):
+            if path is None:
+                self.dump_events(sys.stderr)
+                return
+            with open(path, "a", encoding="utf-8") as file:
+                self.dump_events(file)
+
+        signal.signal(signum, handler)
+
     def load_config(self, sensors):
         """Initialize controller with sensor configuration."""
         self.controller.set_sensors(sensors)
@@ -40,29 +153,94 @@ class MetronetBridge:
         # sslkeylog.set_keylog("/home/tuni/sslkey.log")
         _LOGGER.debug("Connect")
 
+        if self.controller.resume():
+            _LOGGER.debug("Resumed cached session")
+            return True
+
         self.controller.init_session()
 
         _LOGGER.debug("Logging in")
-        return self.controller.login()
+        logged_in = self.controller.login()
+        if logged_in:
+            self.controller.save_session()
+        return logged_in
 
     def get_sensors(self):
-        """Get sensor list and initial value."""
-        self.controller.get_strings()
+        """Get sensor list and initial value.
+
+        With a catalog cache the sensor list is read from the cache and
+        refreshed when the main loop starts.
+        """
+        if not self.controller.load_catalog():
+            self.controller.get_strings()
 
         self.controller.get_inputs()
 
-        return self.controller.sensors
+        return self.controller.get_sensors()
+
+    def snapshot(self):
+        """Return the SensorSnapshot of the last poll.
+
+        Does not block nor send requests, the snapshot is immutable and has
+        the version, time and input Id of the poll.
+        """
+        return self.controller.snapshot
+
+    def wait_for_change(self, sensor_ids=None, predicate=None, timeout=None):
+        """Block until a poll changes one of the sensors.
+
+        sensor_ids is a sensor id or a collection of them, None for any
+        sensor. predicate, called on the polling thread with the
+        SensorSnapshot and the ChangeSet of the poll, must also return True
+        to end the wait; with sensor_ids None it is evaluated on every poll
+        that changed a sensor. Returns that snapshot, None on timeout or
+        when the bridge stops.
+        """
+        waiter = ThreadWaiter(sensor_ids, predicate)
+        self.controller.add_waiter(waiter)
+        try:
+            return waiter.wait(timeout)
+        finally:
+            self.controller.remove_waiter(waiter)
 
     def main_loop(self):
         """Start main loop in a separate thread."""
+        if self.controller.dispatcher is not None:
+            self.controller.dispatcher.start()
         self.controller.run = True
-        self._thread = threading.Thread(
-            target=self.controller.message_loop, name="Metronet", daemon=True
-        )
+        self.shutdown.clear()
+        self._thread = threading.Thread(target=self._loop, name="Metronet", daemon=True)
         self._thread.start()
 
+    def _loop(self):
+        """Run the message loop, setting shutdown when it ends."""
+        try:
+            self.controller.message_loop()
+        finally:
+            self.shutdown.set()
+
+    def request_stop(self):
+        """Ask the waiters of the main loop to stop it.
+
+        Only sets the shutdown event, so it is safe in a signal handler.
+        """
+        self.shutdown.set()
+
+    def wait(self, timeout=None):
+        """Block until the main loop ends or a stop is requested.
+
+        Returns False when timeout expires first.
+        """
+        return self.shutdown.wait(timeout)
+
     def stop(self):
-        """Stop main loop."""
+        """Stop main loop and close the journal."""
+        self.controller.cancel_waiters()
         if self.controller.run:
             self.controller.stop_loop()
             self._thread.join()
+            if self.controller.dispatcher is not None:
+                self.controller.dispatcher.stop()
+            self.controller.save_session()
+        self.close_journal()
+        self.shutdown.set()
@@ -0,0 +1,199 @@
+"""The Metronet IESS Online bridge."""
+import hashlib
+import json
+import logging
+import marshal
+import os
+
+_LOGGER = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "metronetpy")
+SESSION_VERSION = 1
+CATALOG_VERSION = 1
+CONFIG_MAGIC = b"MNC1"
+
+
+def account_key(username, base_url):
+    """Return the file name key of an account."""
+    return hashlib.sha256(f"{base_url}|{username}".encode()).hexdigest()[:24]
+
+
+def write_private(path, data):
+    """Atomically write json data to a file readable only by the owner."""
+    write_private_bytes(path, json.dumps(data).encode())
+
+
+def write_private_bytes(path, content):
+    """Atomically write bytes to a file readable only by the owner."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(content)
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    """Read a json file, None when missing or unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+class SessionCache:
+    """On-disk cache of login sessions, one private file per account.
+
+    A session holds the cookies, the session id and the last input cursor.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        """Init for data."""
+        self.directory = directory
+
+    def path(self, username, base_url):
+        """Return the cache file of an account."""
+        key = account_key(username, base_url)
+        return os.path.join(self.directory, f"{key}.session.json")
+
+    def load(self, username, base_url):
+        """Return the cached session of an account, None if missing."""
+        data = read_json(self.path(username, base_url))
+        if data is None or data.get("version") != SESSION_VERSION:
+            return None
+        return data
+
+    def save(self, username, base_url, session):
+        """Store the session of an account."""
+        data = dict(session, version=SESSION_VERSION)
+        try:
+            write_private(self.path(username, base_url), data)
+        except OSError:
+            _LOGGER.warning("Could not save session cache", exc_info=True)
+
+    def remove(self, username, base_url):
+        """Remove the cached session of an account."""
+        try:
+            os.remove(self.path(username, base_url))
+        except FileNotFoundError:
+            pass
+
+
+class CatalogCache:
+    """On-disk cache of the sensor catalogs, one file per account.
+
+    A catalog is the list of (idx, description) of every input of the
+    panel, stored with its digest so that unchanged catalogs are not
+    written again.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        """Init for data."""
+        self.directory = directory
+
+    def path(self, username, base_url):
+        """Return the cache file of an account."""
+        key = account_key(username, base_url)
+        return os.path.join(self.directory, f"{key}.catalog.json")
+
+    @staticmethod
+    def digest(catalog):
+        """Return the digest of a catalog."""
+        data = json.dumps(catalog, separators=(",", ":")).encode()
+        return hashlib.sha256(data).hexdigest()
+
+    def load(self, username, base_url):
+        """Return the cached catalog of an account, None if missing."""
+        data = read_json(self.path(username, base_url))
+        if data is None or data.get("version") != CATALOG_VERSION:
+            return None
+        return [tuple(item) for item in data["catalog"]]
+
+    def save(self, username, base_url, catalog):
+        """Store the catalog of an account, returns True if it changed."""
+        path = self.path(username, base_url)
+        digest = self.digest(catalog)
+        data = read_json(path)
+        if (
+            data is not None
+            and data.get("version") == CATALOG_VERSION
+            and data.get("digest") == digest
+        ):
+            return False
+        data = {"version": CATALOG_VERSION, "digest": digest, "catalog": catalog}
+        try:
+            write_private(path, data)
+        except OSError:
+            _LOGGER.warning("Could not save catalog cache", exc_info=True)
+        return True
+
+
+class ConfigCache:
+    """On-disk cache of parsed configuration files, one file per config.
+
+    The parsed data is stored with marshal, together with the mtime, size
+    and digest of the configuration file. An unchanged mtime and size
+    returns the data without reading the file, an unchanged digest without
+    parsing it again.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        """Init for data."""
+        self.directory = directory
+
+    def path(self, config):
+        """Return the cache file of a configuration file."""
+        key = hashlib.sha256(os.path.abspath(config).encode()).hexdigest()[:24]
+        return os.path.join(self.directory, f"{key}.config.bin")
+
+    def read(self, path):
+        """Read a cache file, None when missing, unreadable or stale."""
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+        except OSError:
+            return None
+        if not content.startswith(CONFIG_MAGIC):
+            return None
+        try:
+            return marshal.loads(content[len(CONFIG_MAGIC) :])
+        except (EOFError, TypeError, ValueError):
+            return None
+
+    def write(self, path, entry):
+        """Write a cache file, data that marshal can not store is skipped."""
+        try:
+            content = CONFIG_MAGIC + marshal.dumps(entry)
+        except ValueError:
+            _LOGGER.debug("Configuration not cached, unsupported values")
+            return
+        try:
+            write_private_bytes(path, content)
+        except OSError:
+            _LOGGER.warning("Could not save config cache", exc_info=True)
+
+    def load(self, config, parse):
+        """Return the data of a configuration file.
+
+        parse is called with the content of the file when the cache is
+        missing or stale.
+        """
+        path = self.path(config)
+        stat = os.stat(config)
+        entry = self.read(path)
+        if (
+            entry is not None
+            and entry["mtime"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            return entry["data"]
+        with open(config, "rb") as file:
+            content = file.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if entry is None or entry["digest"] != digest:
+            entry = {"digest": digest, "data": parse(content)}
+        entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        self.write(path, entry)
+        return entry["data"]
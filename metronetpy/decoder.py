@@ -0,0 +1,347 @@
+"""The Metronet IESS Online bridge.
+
+Incremental decoders of the inputs and strings api responses.
+Both responses are json arrays of objects, the decoders keep only the
+fields read by the Controller and drop the flat objects of sensors that are
+not configured before decoding them. The Status page decoder reads the
+javascript variables of the page and stops at the last one needed.
+"""
+from collections import namedtuple
+import codecs
+import json
+import re
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+
+msgspec: Optional[ModuleType]
+orjson: Optional[ModuleType]
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+BACKEND_STREAM = "stream"
+BACKEND_MSGSPEC = "msgspec"
+BACKEND_ORJSON = "orjson"
+
+CHUNK_SIZE = 16384
+INPUT_CLASS = 10
+
+# A flat object, optionally preceded by the array separators. The pattern is
+# unrolled so that an unfinished object at the end of a chunk fails fast.
+_OBJECT = re.compile(r'[\s,\[]*(\{[^{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^{}"]*)*\})')
+_INDEX = re.compile(r'"Index"\s*:\s*(-?\d+)')
+_CLASS = re.compile(r'"Class"\s*:\s*(-?\d+)')
+# The array brackets and separators around the objects.
+_SEPARATORS = re.compile(r"[\s,\[\]]*")
+_JSON = json.JSONDecoder()
+_VARIABLE = re.compile(r"var\s+(\w+)\s+=\s+'([0-9a-f-]+)';")
+# Characters kept between chunks, enough for a split variable declaration.
+VARIABLE_TAIL = 256
+
+STATUS_VARIABLES = ("sessionId", "lastInputId")
+
+StatusPage = namedtuple("StatusPage", ["values", "missing"])
+StatusPage.__doc__ = """The variables found in the Status page and the missing ones."""
+
+# The msgspec types of the inputs and strings pages, see msgspec_types.
+_MSGSPEC_TYPES: Dict[str, Any] = {}
+
+
+def msgspec_types():
+    """Return the msgspec types of the inputs and strings pages.
+
+    The Structs are defined on the first decoder using the msgspec backend.
+    """
+    if not _MSGSPEC_TYPES:
+
+        class InputStruct(msgspec.Struct):
+            """The fields of an input read by the Controller."""
+
+            Index: int
+            Alarm: object = False
+            Id: object = None
+
+        class StringStruct(msgspec.Struct):
+            """The fields of a string read by the Controller."""
+
+            Class: int
+            Index: int
+            Description: object = None
+
+        _MSGSPEC_TYPES.update(inputs=List[InputStruct], strings=List[StringStruct])
+    return _MSGSPEC_TYPES
+
+
+def default_backend():
+    """Return the fastest available json backend.
+
+    msgspec decodes only the needed fields, orjson is not used by default
+    since it builds every object of the response.
+    """
+    if msgspec is not None:
+        return BACKEND_MSGSPEC
+    return BACKEND_STREAM
+
+
+class ArrayDecoder:
+    """Incremental decoder of a json array of flat objects.
+
+    Chunks of the response body are given to feed, which returns the
+    records completed so far, close returns the remaining ones. The
+    stream backend matches flat objects with a regular expression and
+    decodes any other object, like one with nested values, with the json
+    module; a body that is not a complete array raises ValueError.
+    """
+
+    def __init__(self, wanted=None, backend=None):
+        """Init for data.
+
+        wanted is a container of the indices to keep, None to keep all.
+        A backend that is not installed raises ValueError.
+        """
+        self.wanted = wanted
+        self.backend = backend or default_backend()
+        if self.backend == BACKEND_MSGSPEC and msgspec is None:
+            raise ValueError("The msgspec backend needs the msgspec package")
+        if self.backend == BACKEND_ORJSON and orjson is None:
+            raise ValueError("The orjson backend needs the orjson package")
+        if self.backend not in (BACKEND_STREAM, BACKEND_MSGSPEC, BACKEND_ORJSON):
+            raise ValueError(f"Unknown json backend: {self.backend}")
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._chunks = []
+
+    def feed(self, chunk):
+        """Decode a chunk of the body and return the completed records."""
+        if self.backend != BACKEND_STREAM:
+            self._chunks.append(chunk)
+            return []
+        return self._scan(self._text.decode(chunk))
+
+    def close(self):
+        """Return the remaining records at the end of the body."""
+        if self.backend == BACKEND_STREAM:
+            records = self._scan(self._text.decode(b"", final=True))
+            if _SEPARATORS.fullmatch(self._buf) is None:
+                raise ValueError(f"Incomplete json array: {self._buf[:80]!r}")
+            self._buf = ""
+            return records
+        body = b"".join(self._chunks)
+        self._chunks = []
+        return self._decode(body)
+
+    def _scan(self, text):
+        """Find the complete objects of the buffered text."""
+        buf = self._buf + text
+        records = []
+        pos = 0
+        while True:
+            match = _OBJECT.match(buf, pos)
+            if match is not None:
+                record = self._record(match.group(1))
+                pos = match.end()
+            else:
+                start = _SEPARATORS.match(buf, pos).end()
+                if start == len(buf) or buf[start] != "{":
+                    break
+                try:
+                    obj, pos = _JSON.raw_decode(buf, start)
+                except ValueError:
+                    # Unfinished, or invalid: then close raises.
+                    break
+                record = self._record_object(obj)
+            if record is not None:
+                records.append(record)
+        # Keep only the unfinished object.
+        self._buf = buf[pos:]
+        return records
+
+    def _record(self, text):
+        """Return the record of the text of a flat object, None to drop it."""
+        raise NotImplementedError
+
+    def _record_object(self, obj):
+        """Return the record of a decoded object, None to drop it."""
+        raise NotImplementedError
+
+    def _decode(self, body):
+        """Return the records of a whole body with a fast backend."""
+        raise NotImplementedError
+
+
+class InputsDecoder(ArrayDecoder):
+    """Incremental decoder of the inputs api response.
+
+    Records are (idx, alarm) tuples, last_id is the Id of the last input.
+    """
+
+    def __init__(self, wanted=None, backend=None):
+        """Init for data."""
+        super().__init__(wanted, backend)
+        self.last_id = None
+        self._last = None
+
+    def close(self):
+        """Return the remaining records and read the last input Id."""
+        records = super().close()
+        if isinstance(self._last, str):
+            self._last = json.loads(self._last)
+        if self._last is not None:
+            self.last_id = self._last.get("Id")
+            self._last = None
+        return records
+
+    def _record(self, text):
+        """Return the (idx, alarm) tuple of a wanted input."""
+        match = _INDEX.search(text)
+        if match is None:
+            return self._record_object(json.loads(text))
+        self._last = text
+        idx = int(match.group(1))
+        if self.wanted is not None and idx not in self.wanted:
+            return None
+        return idx, json.loads(text)["Alarm"]
+
+    def _record_object(self, obj):
+        """Return the (idx, alarm) tuple of a wanted decoded input."""
+        self._last = obj
+        idx = int(obj["Index"])
+        if self.wanted is not None and idx not in self.wanted:
+            return None
+        return idx, obj["Alarm"]
+
+    def _decode(self, body):
+        """Return the (idx, alarm) tuples of a whole body."""
+        wanted = self.wanted
+        if self.backend == BACKEND_MSGSPEC:
+            page = msgspec.json.decode(body, type=msgspec_types()["inputs"])
+            if page:
+                self.last_id = page[-1].Id
+            return [
+                (obj.Index, obj.Alarm)
+                for obj in page
+                if wanted is None or obj.Index in wanted
+            ]
+        page = (
+            orjson.loads(body) if self.backend == BACKEND_ORJSON else json.loads(body)
+        )
+        if page:
+            self.last_id = page[-1]["Id"]
+        return [
+            (obj["Index"], obj["Alarm"])
+            for obj in page
+            if wanted is None or obj["Index"] in wanted
+        ]
+
+
+class StringsDecoder(ArrayDecoder):
+    """Incremental decoder of the strings api response.
+
+    Records are (idx, description) tuples of the inputs.
+    """
+
+    def _record(self, text):
+        """Return the (idx, description) tuple of a wanted input."""
+        input_class = _CLASS.search(text)
+        index = _INDEX.search(text)
+        if input_class is None or index is None:
+            return self._record_object(json.loads(text))
+        if int(input_class.group(1)) != INPUT_CLASS:
+            return None
+        idx = int(index.group(1))
+        if self.wanted is not None and idx not in self.wanted:
+            return None
+        return idx, json.loads(text)["Description"]
+
+    def _record_object(self, obj):
+        """Return the (idx, description) tuple of a wanted decoded input."""
+        if int(obj["Class"]) != INPUT_CLASS:
+            return None
+        idx = int(obj["Index"])
+        if self.wanted is not None and idx not in self.wanted:
+            return None
+        return idx, obj["Description"]
+
+    def _decode(self, body):
+        """Return the (idx, description) tuples of a whole body."""
+        wanted = self.wanted
+        if self.backend == BACKEND_MSGSPEC:
+            page = msgspec.json.decode(body, type=msgspec_types()["strings"])
+            return [
+                (obj.Index, obj.Description)
+                for obj in page
+                if obj.Class == INPUT_CLASS and (wanted is None or obj.Index in wanted)
+            ]
+        page = (
+            orjson.loads(body) if self.backend == BACKEND_ORJSON else json.loads(body)
+        )
+        return [
+            (obj["Index"], obj["Description"])
+            for obj in page
+            if obj["Class"] == INPUT_CLASS
+            and (wanted is None or obj["Index"] in wanted)
+        ]
+
+
+def decode(decoder, chunks):
+    """Feed every chunk to a decoder and return all the records."""
+    records = []
+    for chunk in chunks:
+        records.extend(decoder.feed(chunk))
+    records.extend(decoder.close())
+    return records
+
+
+class StatusPageDecoder:
+    """Incremental decoder of the variables of the Status page.
+
+    feed returns True once every variable has been found, so that the
+    rest of the page does not need to be read.
+    """
+
+    def __init__(self, names=STATUS_VARIABLES):
+        """Init for data."""
+        self.names = tuple(names)
+        self.values = {}
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+
+    def feed(self, chunk):
+        """Scan a chunk of the page, returns True when done."""
+        return self._scan(self._text.decode(chunk))
+
+    def close(self):
+        """Scan the end of the page and return the StatusPage."""
+        self._scan(self._text.decode(b"", final=True))
+        missing = tuple(name for name in self.names if name not in self.values)
+        return StatusPage(dict(self.values), missing)
+
+    def _scan(self, text):
+        """Find the variables of the buffered text."""
+        buf = self._buf + text
+        end = 0
+        for match in _VARIABLE.finditer(buf):
+            name = match.group(1)
+            if name in self.names and name not in self.values:
+                self.values[name] = match.group(2)
+            end = match.end()
+        # Keep a tail that may hold a declaration split between chunks.
+        self._buf = buf[max(end, len(buf) - VARIABLE_TAIL) :]
+        return len(self.values) == len(self.names)
+
+
+def read_status_page(chunks, names=STATUS_VARIABLES):
+    """Read the variables from the chunks of a Status page.
+
+    Stops reading at the last variable needed.
+    """
+    decoder = StatusPageDecoder(names)
+    for chunk in chunks:
+        if decoder.feed(chunk):
+            break
+    return decoder.close()
@@ -0,0 +1,264 @@
+"""The Metronet IESS Online bridge.
+
+Dispatchers run the callbacks out of the polling loop. Events are split
+in partitions by key (the sensor index), each partition is consumed in
+order by a single worker, so the events of a sensor are never reordered.
+"""
+import asyncio
+from collections import deque
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOWS = (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK, OVERFLOW_COALESCE)
+
+
+class BaseDispatcher:
+    """Bounded partitioned queue of callback events.
+
+    An event is a [key, funcs, args, enqueue time] list, every function of
+    funcs is called with args. maxsize is the bound of each partition,
+    overflow tells what to do when a partition is full:
+    drop-oldest discards the oldest event, block makes the producer wait
+    and coalesce replaces the pending event of the same key, when there
+    is one, discarding the oldest otherwise. Events with a None key are
+    never coalesced.
+    """
+
+    def __init__(self, workers=1, maxsize=1000, overflow=OVERFLOW_DROP_OLDEST):
+        """Init for data."""
+        if overflow not in OVERFLOWS:
+            raise ValueError(f"Unknown overflow policy {overflow}")
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.running = False
+        self._queues = [deque() for _ in range(workers)]
+        self._pending = [{} for _ in range(workers)]
+        self.max_depth = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self._lag_total = 0.0
+        self.metrics = None
+
+    def partition(self, key):
+        """Return the partition of a key."""
+        return hash(key) % self.workers
+
+    def depth(self):
+        """Return the number of queued events."""
+        return sum(len(queue) for queue in self._queues)
+
+    def stats(self):
+        """Return queue depth and dispatch lag statistics."""
+        dispatched = self.dispatched
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "dispatched": dispatched,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "lag_last": self.lag_last,
+            "lag_avg": self._lag_total / dispatched if dispatched else 0.0,
+            "lag_max": self.lag_max,
+        }
+
+    def _push(self, part, key, funcs, args, since=None):
+        """Queue an event, applying the overflow policy."""
+        queue = self._queues[part]
+        pending = self._pending[part]
+        coalesce = self.overflow == OVERFLOW_COALESCE and key is not None
+        if coalesce:
+            event = pending.get(key)
+            if event is not None:
+                event[1] = funcs
+                event[2] = args
+                self.coalesced += 1
+                return
+        if len(queue) >= self.maxsize and self.overflow != OVERFLOW_BLOCK:
+            oldest = queue.popleft()
+            if pending.get(oldest[0]) is oldest:
+                del pending[oldest[0]]
+            self.dropped += 1
+        event = [key, funcs, args, since or time.monotonic()]
+        queue.append(event)
+        if coalesce:
+            pending[key] = event
+        self.max_depth = max(self.max_depth, len(queue))
+
+    def _pop(self, part):
+        """Return the next event of a partition and account its lag."""
+        event = self._queues[part].popleft()
+        pending = self._pending[part]
+        if pending.get(event[0]) is event:
+            del pending[event[0]]
+        lag = time.monotonic() - event[3]
+        self.dispatched += 1
+        self.lag_last = lag
+        self.lag_max = max(self.lag_max, lag)
+        self._lag_total += lag
+        return event
+
+    def _observe(self, key, since, start):
+        """Account the lag and the execution time of a callback."""
+        metrics = self.metrics
+        end = time.monotonic()
+        metrics.notify_lag.observe(start - since)
+        metrics.callbacks.labels("batch" if key is None else key).observe(end - start)
+
+
+class Dispatcher(BaseDispatcher):
+    """Dispatcher running callbacks in a pool of worker threads."""
+
+    def __init__(self, workers=1, maxsize=1000, overflow=OVERFLOW_DROP_OLDEST):
+        """Init for data."""
+        super().__init__(workers, maxsize, overflow)
+        self._conds = [threading.Condition() for _ in range(workers)]
+        self._threads = []
+
+    def submit(self, key, funcs, *args, since=None):
+        """Queue the call of funcs with args.
+
+        since is the monotonic time the event comes from, the lag is
+        measured from it. With the block policy waits for room in the
+        partition.
+        """
+        part = self.partition(key)
+        cond = self._conds[part]
+        with cond:
+            if self.overflow == OVERFLOW_BLOCK:
+                cond.wait_for(
+                    lambda: len(self._queues[part]) < self.maxsize or not self.running
+                )
+            self._push(part, key, funcs, args, since)
+            cond.notify_all()
+
+    def start(self):
+        """Start the worker threads."""
+        self.running = True
+        for part in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(part,),
+                name=f"MetronetDispatch-{part}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop the workers once the queued events are dispatched."""
+        self.running = False
+        for cond in self._conds:
+            with cond:
+                cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self, part):
+        """Dispatch the events of a partition."""
+        queue = self._queues[part]
+        cond = self._conds[part]
+        while True:
+            with cond:
+                cond.wait_for(lambda: queue or not self.running)
+                if not queue:
+                    return
+                key, funcs, args, since = self._pop(part)
+                cond.notify_all()
+            for func in funcs:
+                try:
+                    start = time.monotonic()
+                    func(*args)
+                    if self.metrics is not None:
+                        self._observe(key, since, start)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception("Could not notify callback for %s", key)
+
+
+class AsyncDispatcher(BaseDispatcher):
+    """Dispatcher running callbacks in asyncio tasks.
+
+    Callbacks can be plain functions or coroutine functions.
+    """
+
+    def __init__(self, workers=1, maxsize=1000, overflow=OVERFLOW_DROP_OLDEST):
+        """Init for data."""
+        super().__init__(workers, maxsize, overflow)
+        self._wakeups = None
+        self._space = None
+        self._tasks = []
+
+    def submit(self, key, funcs, *args, since=None):
+        """Queue the call of funcs with args.
+
+        since is the monotonic time the event comes from. Never waits,
+        with the block policy the producer should await wait_space before
+        submitting again.
+        """
+        part = self.partition(key)
+        self._push(part, key, funcs, args, since)
+        if self._wakeups is not None:
+            self._wakeups[part].set()
+
+    async def wait_space(self):
+        """Wait for room in every partition, with the block policy."""
+        if self.overflow != OVERFLOW_BLOCK:
+            return
+        while self.running and any(
+            len(queue) >= self.maxsize for queue in self._queues
+        ):
+            self._space.clear()
+            await self._space.wait()
+
+    def start(self):
+        """Start the worker tasks in the running event loop."""
+        self.running = True
+        self._wakeups = [asyncio.Event() for _ in range(self.workers)]
+        self._space = asyncio.Event()
+        self._tasks = [
+            asyncio.ensure_future(self._worker(part)) for part in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Stop the workers once the queued events are dispatched."""
+        self.running = False
+        for wakeup in self._wakeups or ():
+            wakeup.set()
+        if self._space is not None:
+            self._space.set()
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+
+    async def _worker(self, part):
+        """Dispatch the events of a partition."""
+        queue = self._queues[part]
+        wakeup = self._wakeups[part]
+        while True:
+            if not queue:
+                if not self.running:
+                    return
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            key, funcs, args, since = self._pop(part)
+            self._space.set()
+            for func in funcs:
+                try:
+                    start = time.monotonic()
+                    result = func(*args)
+                    if asyncio.iscoroutine(result):
+                        await result
+                    if self.metrics is not None:
+                        self._observe(key, since, start)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.exception("Could not notify callback for %s", key)
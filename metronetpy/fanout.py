@@ -0,0 +1,357 @@
+"""The Metronet IESS Online bridge.
+
+Fan-out of one metronet session to many local consumers. FanoutServer
+publishes the sensors and the transitions of a bridge on a unix or tcp
+socket, FanoutClient gives the callback API of a bridge on top of it.
+
+The protocol is json lines. A client sends one request line:
+{"op": "sensors"} is answered with a sensors line and the connection is
+closed, {"op": "subscribe"} with a sensors line followed by a changes
+line per poll, until either side closes. The sensors line is
+{"type": "sensors", "input": ..., "sensors": [...]}, a changes line
+{"type": "changes", "time": ..., "input": ..., "changes": [[idx, active]]}.
+Changes right after the sensors line may repeat states it already holds.
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from .scheduler import PollScheduler
+from .sensors import ChangeBatch
+
+_LOGGER = logging.getLogger(__name__)
+
+ADDRESS_UNIX = "unix:"
+DEFAULT_ADDRESS = "127.0.0.1:9465"
+# The failures in a row counted by a client, its backoff is long at this point.
+MAX_FAILURES = 32
+
+
+def parse_address(address):
+    """Return the socket family and address of unix:PATH or HOST:PORT."""
+    if address.startswith(ADDRESS_UNIX):
+        return socket.AF_UNIX, address[len(ADDRESS_UNIX) :]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def encode(message):
+    """Return the json line of a message."""
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class Subscriber:
+    """The queue of the lines to send to a subscribed client.
+
+    A client that falls maxsize lines behind is disconnected, it gets a
+    fresh sensors line when it subscribes again.
+    """
+
+    def __init__(self, maxsize):
+        """Init for data."""
+        self.lines = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, line):
+        """Queue a line, marks the subscriber overflowed when full."""
+        try:
+            self.lines.put_nowait(line)
+        except queue.Full:
+            self.overflowed = True
+
+    def close(self):
+        """Wake the sender to end the connection."""
+        self.overflowed = True
+        try:
+            self.lines.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class FanoutHandler(socketserver.StreamRequestHandler):
+    """Handler of a client connection."""
+
+    def handle(self):
+        """Answer a request line."""
+        try:
+            request = json.loads(self.rfile.readline())
+            operation = request["op"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if operation == "sensors":
+            self.wfile.write(self.server.sensors_line())
+        elif operation == "subscribe":
+            self.stream()
+
+    def stream(self):
+        """Send the sensors and then the changes until disconnected."""
+        subscriber, line = self.server.subscribe()
+        try:
+            while line is not None and not subscriber.overflowed:
+                self.wfile.write(line)
+                line = subscriber.lines.get()
+        except OSError:
+            pass
+        finally:
+            self.server.unsubscribe(subscriber)
+
+
+class FanoutServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Server publishing the sensors and transitions of a bridge.
+
+    address is unix:PATH or HOST:PORT, maxsize the number of changes lines
+    a client may fall behind. The server registers a batch callback, so
+    that it must be created before the main loop of the bridge starts.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, bridge, address=DEFAULT_ADDRESS, maxsize=1000):
+        """Init for data, binding the socket."""
+        self.address_family, server_address = parse_address(address)
+        if self.address_family == socket.AF_UNIX and os.path.exists(server_address):
+            os.remove(server_address)
+        super().__init__(server_address, FanoutHandler)
+        self.bridge = bridge
+        self.maxsize = maxsize
+        self.published = 0
+        self.disconnected = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        bridge.register_batch_callback(self.publish)
+
+    def sensors_line(self):
+        """Return the sensors line, from the last snapshot of the sensors."""
+        snapshot = self.bridge.snapshot()
+        return encode(
+            {
+                "type": "sensors",
+                "input": snapshot.last_input,
+                "sensors": snapshot.as_dicts(),
+            }
+        )
+
+    def subscribe(self):
+        """Add a subscriber, returns it with its sensors line."""
+        subscriber = Subscriber(self.maxsize)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            return subscriber, self.sensors_line()
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber."""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        if subscriber.overflowed:
+            self.disconnected += 1
+
+    def publish(self, batch):
+        """Send the changes of a poll to every subscriber."""
+        line = encode(
+            {
+                "type": "changes",
+                "time": batch.timestamp,
+                "input": batch.last_input,
+                "changes": batch.changes,
+            }
+        )
+        with self._lock:
+            self.published += 1
+            for subscriber in self._subscribers:
+                subscriber.put(line)
+
+    def stats(self):
+        """Return the subscriber and publication counters."""
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "disconnected": self.disconnected,
+        }
+
+    def start(self):
+        """Start serving."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="MetronetFanout", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and disconnect the subscribers."""
+        self.shutdown()
+        with self._lock:
+            for subscriber in self._subscribers:
+                subscriber.close()
+        self.server_close()
+        self._thread.join()
+
+    def server_close(self):
+        """Close the listening socket, removing a unix socket file."""
+        super().server_close()
+        if self.address_family == socket.AF_UNIX:
+            try:
+                os.remove(self.server_address)
+            except OSError:
+                pass
+
+
+class FanoutClient:
+    """Client of a FanoutServer with the callback API of a bridge.
+
+    The main loop subscribes in a separate thread and connects again
+    after the backoff of scheduler when the connection is lost. The
+    sensors that changed meanwhile are notified from the new sensors line.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=10.0, scheduler=None):
+        """Init for data."""
+        self.address = address
+        self.timeout = timeout
+        self.scheduler = scheduler or PollScheduler()
+        self.callbacks = {}
+        self.batch_callbacks = []
+        self.states = {}
+        self.last_input = None
+        self.failures = 0
+        self.run = False
+        self._sock = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def register_callback(self, sensor_id, func):
+        """Store a callback called with (idx, active) on the sensor changes."""
+        self.callbacks.setdefault(sensor_id, []).append(func)
+
+    def register_batch_callback(self, func):
+        """Store a callback called with a ChangeBatch per poll."""
+        self.batch_callbacks.append(func)
+
+    def open(self, operation):
+        """Connect and send a request line, returns the socket."""
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(address)
+            sock.sendall(encode({"op": operation}))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def get_sensors(self):
+        """Return the sensors of the server as a list of dicts."""
+        with self.open("sensors") as sock, sock.makefile("rb") as file:
+            message = json.loads(file.readline())
+        self.last_input = message["input"]
+        return message["sensors"]
+
+    def connect(self):
+        """Tell if the server answers."""
+        try:
+            self.get_sensors()
+        except (OSError, ValueError, KeyError, TypeError):
+            _LOGGER.error("Fanout server %s not available", self.address)
+            return False
+        return True
+
+    def notify(self, batch):
+        """Call the callbacks of a ChangeBatch."""
+        for idx, active in batch.changes:
+            self.states[idx] = active
+            for func in self.callbacks.get(idx, ()):
+                self._call(func, idx, active)
+        for func in self.batch_callbacks:
+            self._call(func, batch)
+
+    @staticmethod
+    def _call(func, *args):
+        """Call a callback, logging its exceptions."""
+        try:
+            func(*args)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Could not notify callback")
+
+    def resync(self, message):
+        """Notify the sensors whose state differs from the sensors line.
+
+        Sensors of unknown state, without an active key, are skipped.
+        """
+        states = {
+            sensor["id"]: sensor["active"]
+            for sensor in message["sensors"]
+            if sensor.get("active") is not None
+        }
+        changes = tuple(
+            (idx, active)
+            for idx, active in states.items()
+            if idx in self.states and self.states[idx] != active
+        )
+        for idx, active in states.items():
+            self.states.setdefault(idx, active)
+        self.last_input = message["input"]
+        if changes:
+            self.notify(ChangeBatch(time.time(), self.last_input, changes))
+
+    def receive(self):
+        """Subscribe and notify the changes until disconnected."""
+        sock = self.open("subscribe")
+        sock.settimeout(None)
+        self._sock = sock
+        try:
+            with sock.makefile("rb") as file:
+                for line in file:
+                    message = json.loads(line)
+                    if message["type"] == "sensors":
+                        self.resync(message)
+                        self.failures = 0
+                        continue
+                    self.last_input = message["input"]
+                    changes = tuple(tuple(change) for change in message["changes"])
+                    self.notify(ChangeBatch(message["time"], self.last_input, changes))
+        finally:
+            self._sock = None
+            sock.close()
+
+    def message_loop(self):
+        """Receive the changes, connecting again until stopped."""
+        self.failures = 0
+        while self.run:
+            try:
+                self.receive()
+            except (OSError, ValueError, KeyError, TypeError) as err:
+                if not self.run:
+                    break
+                _LOGGER.warning("Fanout connection lost: %r", err)
+            self.failures = min(self.failures + 1, MAX_FAILURES)
+            if self._stopped.wait(self.scheduler.backoff(self.failures)):
+                break
+
+    def main_loop(self):
+        """Start the message loop in a separate thread."""
+        self.run = True
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self.message_loop, name="MetronetFanoutClient", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the message loop."""
+        if self.run:
+            self.run = False
+            self._stopped.set()
+            sock = self._sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._thread.join()
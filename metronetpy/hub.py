@@ -0,0 +1,224 @@
+"""The Metronet IESS Online bridge."""
+import asyncio
+import logging
+import threading
+
+import aiohttp
+
+from .aioiess import AsyncController
+from .iess import METRONET_URL
+from .throttle import RequestBudget, TokenBucket
+from .transport import KEEPALIVE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MetronetHub:
+    """The Metronet Hub class.
+
+    Drives many Metronet accounts from a single thread and event loop.
+    Every account keeps its own cookie jar, while all of them share one
+    connection pool. The message loop of every account runs in its own
+    task, restarted after the backoff when it fails, so that an account
+    never stops the others.
+    """
+
+    def __init__(
+        self,
+        accounts,
+        limit=100,
+        base_url=METRONET_URL,
+        session_cache=None,
+        catalog_cache=None,
+        journal=None,
+        account_budget=None,
+        global_budget=None,
+    ):
+        """Init for data.
+
+        accounts is a list of dicts with username, password and optional
+        sensors, name and url keys. The name (username when missing) is the
+        key used to address the account. account_budget and global_budget
+        are the (rate, burst) request budgets of each account and of all
+        the accounts together.
+        """
+        self.limit = limit
+        self.controllers = {}
+        shared = TokenBucket(*global_budget) if global_budget else None
+        for account in accounts:
+            name = account.get("name") or account["username"]
+            controller = AsyncController(
+                account["username"],
+                account["password"],
+                base_url=account.get("url", base_url),
+            )
+            if account.get("sensors"):
+                controller.set_sensors(account["sensors"])
+            controller.session_cache = session_cache
+            controller.catalog_cache = catalog_cache
+            controller.journal = journal
+            buckets = [TokenBucket(*account_budget)] if account_budget else []
+            if shared is not None:
+                buckets.append(shared)
+            if buckets:
+                controller.budget = RequestBudget(*buckets)
+            self.controllers[name] = controller
+        self.logged_in = {}
+        self._loop = None
+        self._tasks = []
+        self._stopping = False
+        self._thread = None
+        self._ready = threading.Event()
+
+    def register_callback(self, account, sensor_id, func):
+        """Store callback for a sensor of an account.
+
+        The callback is called with the same arguments of the
+        MetronetBridge callbacks.
+        """
+        callbacks = self.controllers[account].callbacks
+        if sensor_id not in callbacks:
+            callbacks[sensor_id] = []
+        callbacks[sensor_id].append(func)
+
+    def register_batch_callback(self, account, func):
+        """Store a batch callback for an account."""
+        self.controllers[account].batch_callbacks.append(func)
+
+    def get_sensors(self, account):
+        """Get sensor list of an account."""
+        return self.controllers[account].get_sensors()
+
+    def snapshot(self, account):
+        """Return the SensorSnapshot of the last poll of an account."""
+        return self.controllers[account].snapshot
+
+    def stats(self):
+        """Return the metrics, login breaker and request budget of the accounts.
+
+        Keyed by account name.
+        """
+        stats = {}
+        for name, controller in self.controllers.items():
+            stats[name] = controller.metrics.collect()
+            stats[name]["breaker"] = controller.breaker.stats()
+            if controller.budget is not None:
+                stats[name]["budget"] = controller.budget.stats()
+        return stats
+
+    def start(self, timeout=None):
+        """Start the hub thread.
+
+        Waits until every account has tried to connect and read its sensors,
+        then returns a dict with the login result of each account.
+        """
+        self._ready.clear()
+        self._thread = threading.Thread(
+            target=self._thread_main, name="Metronet", daemon=True
+        )
+        self._thread.start()
+        self._ready.wait(timeout)
+        return dict(self.logged_in)
+
+    def stop(self):
+        """Stop every account and the hub thread.
+
+        Also stops an async_run awaited directly, from any thread.
+        """
+        self._stopping = True
+        for controller in self.controllers.values():
+            controller.stop_loop()
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._cancel_tasks)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _thread_main(self):
+        """Run the hub event loop."""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.async_run())
+        finally:
+            loop.close()
+            self._ready.set()
+
+    def _cancel_tasks(self):
+        """Cancel the running account tasks."""
+        for task in self._tasks:
+            task.cancel()
+
+    async def async_run(self):
+        """Connect every account and run the message loops.
+
+        Can be awaited directly by asyncio hosts instead of calling start,
+        stop ends it.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=KEEPALIVE)
+        try:
+            for controller in self.controllers.values():
+                controller.transport.set_connector(connector)
+            names = list(self.controllers)
+            self._tasks = [
+                asyncio.ensure_future(self._async_setup(self.controllers[name]))
+                for name in names
+            ]
+            results = await asyncio.gather(*self._tasks)
+            self.logged_in = dict(zip(names, results))
+            self._ready.set()
+
+            self._tasks = []
+            for name, controller in self.controllers.items():
+                if self.logged_in[name] and not self._stopping:
+                    controller.run = True
+                    self._tasks.append(
+                        asyncio.ensure_future(self._supervise(name, controller))
+                    )
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+            self._loop = None
+            for controller in self.controllers.values():
+                controller.save_session()
+                await controller.close()
+            await connector.close()
+        _LOGGER.info("Hub: ended")
+
+    async def _supervise(self, name, controller):
+        """Run the message loop of an account, restarting it when it fails."""
+        while controller.run:
+            try:
+                await controller.message_loop()
+            except asyncio.CancelledError:  # pylint: disable=try-except-raise
+                # An Exception before Python 3.8.
+                raise
+            except Exception:  # pylint: disable=broad-except
+                controller.metrics.exceptions.inc()
+                _LOGGER.exception("Hub -> Message loop of %s failed", name)
+                if controller.run:
+                    await controller.failed()
+
+    async def _async_setup(self, controller):
+        """Login an account and read its sensors."""
+        try:
+            if not await controller.resume():
+                await controller.init_session()
+                if not await controller.login():
+                    _LOGGER.error("Hub -> Failed to login %s", controller.username)
+                    return False
+                controller.save_session()
+            if not controller.load_catalog():
+                await controller.get_strings()
+            await controller.get_inputs()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Hub -> Could not setup %s", controller.username)
+            return False
+        return True
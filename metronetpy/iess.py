@@ -1,9 +1,21 @@
 """The Metronet IESS Online bridge."""
 import logging
-import re
+import threading
 import time
 
-import requests
+from .decoder import (
+    InputsDecoder,
+    StatusPageDecoder,
+    StringsDecoder,
+    decode,
+    read_status_page,
+)
+from .metrics import PollMetrics
+from .recorder import FlightRecorder
+from .scheduler import PollScheduler
+from .sensors import EMPTY_SNAPSHOT, ChangeBatch, SensorTable
+from .throttle import CircuitBreaker
+from .transport import RequestsTransport, TransportConnectTimeout, TransportTimeout
 
 # import sslkeylog
 
@@ -16,16 +28,35 @@ METRONET_API_STRINGS = f"https://{METRONET}/api/strings"
 METRONET_API_INPUTS = f"https://{METRONET}/api/inputs"
 METRONET_API_UPDATES = f"https://{METRONET}/api/updates"
 
+# Seconds to wait for the reply validating a cached session.
+VALIDATE_TIMEOUT = 3
+
+
+def session_headers(base_url):
+    """Return the headers of the api requests."""
+    return {
+        "x-requested-with": "XMLHttpReques",
+        "sec-fetch-mode": "cors",
+        "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
+        "origin": base_url,
+        "sec-fetch-site": "same-origin",
+        "referer": f"{base_url}Status",
+    }
+
+
+def login_headers(base_url):
+    """Return the headers of the login request."""
+    return {
+        "sec-fetch-mode": "navigate",
+        "sec-fetch-user": "?1",
+        "sec-fetch-site": "same-origin",
+        "referer": base_url,
+    }
+
 
 def get_variable(page, name):
     """Read a variable value from the status response page."""
-    regex = f"var\\s+{name!s}\\s+=\\s+'[0-9a-f-]+';"
-    match = re.search(regex, page)
-    if match is not None:
-        line = match.group()
-        index = line.find("'")
-        return line[index + 1 : -2]
-    return None
+    return read_status_page([page.encode()], (name,)).values.get(name)
 
 
 class Controller:
@@ -35,72 +66,221 @@ class Controller:
     with Metronet IESS cloud platform.
     """
 
-    def __init__(self, username, password):
-        """Init for data."""
+    def __init__(self, username, password, base_url=METRONET_URL, transport=None):
+        """Init for data.
+
+        base_url allows to point the controller to a metronet stand-in,
+        transport defaults to a pooled RequestsTransport.
+        """
+        self.base_url = base_url.rstrip("/") + "/"
+        self.status_url = f"{self.base_url}Status"
         self.username = username
         self.password = password
-        self.sensors = []
-        self.lookup = {}
+        self.sensors = SensorTable()
+        self.snapshot = EMPTY_SNAPSHOT
+        self.waiters = []
+        self._waiters_lock = threading.Lock()
         self.callbacks = {}
+        self.batch_callbacks = []
+        self.dispatcher = None
+        self.scheduler = PollScheduler()
+        self.failures = 0
+        self.metrics = PollMetrics()
+        self.recorder = FlightRecorder()
+        self.received = 0.0
+        self.session_cache = None
+        self.catalog_cache = None
+        self.journal = None
+        self.refresh_pending = False
+        self.budget = None
+        self.breaker = CircuitBreaker()
         self.run = False
-        self.session = None
+        self._stopped = threading.Event()
+        self.transport = transport or RequestsTransport()
         self.session_id = None
         self.last_input = None
 
     def set_sensors(self, sensors):
         """Initialize sensors."""
-        self.sensors = sensors
-        self.__create_lookup()
+        self.sensors = SensorTable(sensors)
+        self.publish()
+
+    def get_sensors(self):
+        """Return the sensors of the last snapshot as a list of dicts."""
+        return self.snapshot.as_dicts()
+
+    def publish(self, timestamp=None):
+        """Replace the snapshot with one of the current sensor states.
+
+        Only the polling thread changes the sensor table, the other threads
+        read the snapshot, which is never changed once published.
+        """
+        self.snapshot = self.sensors.snapshot(
+            self.snapshot.version + 1, timestamp, self.last_input
+        )
 
-    def __create_lookup(self):
-        """Create lookup dict based on sensor."""
-        self.lookup = {}
-        for sensor in self.sensors:
-            self.lookup[sensor["id"]] = sensor
+    def api_url(self, name):
+        """Return the url of a metronet api."""
+        return f"{self.base_url}api/{name}"
 
     def notify(self, data):
-        """Call callbacks with event data."""
+        """Call callbacks with event data.
+
+        With a dispatcher the calls are queued instead of run inline.
+        """
+        dispatcher = self.dispatcher
         try:
             for idx, active in data:
                 if idx in self.callbacks:
+                    if dispatcher is not None:
+                        dispatcher.submit(
+                            idx, self.callbacks[idx], idx, active, since=self.received
+                        )
+                        continue
                     for func in self.callbacks[idx]:
-                        _LOGGER.debug("Notify sensor %d  with data: %s", idx, active)
-                        func(idx, active)
+                        self.run_callback(idx, func, idx, active)
         except Exception:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
             _LOGGER.exception("Could not notify callback")
 
+    def notify_batch(self, batch):
+        """Call batch callbacks with all the changes of a poll."""
+        if self.dispatcher is not None:
+            # A None key is never coalesced.
+            self.dispatcher.submit(
+                None, self.batch_callbacks, batch, since=self.received
+            )
+            return
+        for func in self.batch_callbacks:
+            try:
+                self.run_callback("batch", func, batch)
+            except Exception:  # pylint: disable=broad-except
+                self.metrics.exceptions.inc()
+                _LOGGER.exception("Could not notify batch callback")
+
+    def run_callback(self, label, func, *args):
+        """Call a callback, measuring its lag and execution time."""
+        start = time.monotonic()
+        self.metrics.notify_lag.observe(start - self.received)
+        func(*args)
+        self.metrics.callbacks.labels(label).observe(time.monotonic() - start)
+
     def init_session(self):
         """Initialize the metronet session."""
-        self.session = requests.Session()
-
-        resp = self.session.get(METRONET_URL)
-        _LOGGER.debug("Init Session Cookie -> response code: %d", resp.status_code)
-
-        self.session.headers.update(
-            {
-                "x-requested-with": "XMLHttpReques",
-                "sec-fetch-mode": "cors",
-                "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
-                "origin": METRONET_URL,
-                "sec-fetch-site": "same-origin",
-                "referer": f"{METRONET_URL}Status",
-            }
-        )
+        self.transport.open()
+
+        self.throttle("home")
+        with self.transport.request("GET", "home", self.base_url) as resp:
+            _LOGGER.debug("Init Session Cookie -> response code: %d", resp.status)
+
+        self.transport.update_headers(session_headers(self.base_url))
+
+    def resume(self):
+        """Resume the cached session, returns False if it is not valid."""
+        if self.session_cache is None:
+            return False
+        state = self.session_cache.load(self.username, self.base_url)
+        if state is None:
+            return False
+        self.restore_session(state)
+        try:
+            valid = self.validate_session()
+        except Exception:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            _LOGGER.error("Resume -> Exception!")
+            valid = False
+        _LOGGER.debug("Resume -> valid: %s", valid)
+        return valid
+
+    def restore_session(self, state):
+        """Create the metronet session from a cached one."""
+        self.transport.open()
+        self.transport.update_headers(session_headers(self.base_url))
+        self.transport.update_headers(login_headers(self.base_url))
+        self.transport.set_cookies(state["cookies"], self.base_url)
+        self.session_id = state["session_id"]
+        self.last_input = state["last_input"]
+
+    def validate_session(self):
+        """Check the session with a single updates request.
+
+        Asks for the changes since the first input, so that the server
+        replies at once; a request still held by the long-poll means
+        anyway that the session has been accepted. A connect timeout
+        tells nothing of the session, it is reported as not valid so
+        that a full login follows.
+        """
+        data = dict(self.updates_data(), Inputs=0)
+        self.throttle("updates")
+        try:
+            with self.transport.request(
+                "POST",
+                "updates",
+                self.api_url("updates"),
+                data=data,
+                read=VALIDATE_TIMEOUT,
+            ) as resp:
+                _LOGGER.debug("Validate -> response code: %d", resp.status)
+                return resp.status == 200
+        except TransportConnectTimeout:
+            _LOGGER.debug("Validate -> connect timeout")
+            return False
+        except TransportTimeout:
+            return True
+
+    def export_session(self):
+        """Return the session state to cache."""
+        return {
+            "cookies": self.transport.get_cookies(),
+            "session_id": self.session_id,
+            "last_input": self.last_input,
+        }
 
-        _LOGGER.debug("Init Session Cookie -> Headers: %d", self.session.headers)
+    def save_session(self):
+        """Store the session in the cache, if any."""
+        if self.session_cache is not None and self.session_id is not None:
+            self.session_cache.save(self.username, self.base_url, self.export_session())
 
     def login(self):
-        """Login to metronet."""
-        self.session.headers.update(
-            {
-                "sec-fetch-mode": "navigate",
-                "sec-fetch-user": "?1",
-                "sec-fetch-site": "same-origin",
-                "referer": METRONET_URL,
-            }
-        )
-        _LOGGER.debug("Init Login -> Headers: %d", self.session.headers)
-        data = {
+        """Login to metronet, unless the login circuit breaker is open."""
+        if not self.allow_login():
+            return False
+        logged_in = False
+        try:
+            logged_in = self.send_login()
+        finally:
+            self.breaker.record(logged_in)
+        return logged_in
+
+    def allow_login(self):
+        """Ask the circuit breaker if a login may be sent."""
+        if self.breaker.allow():
+            return True
+        self.metrics.rejected_logins.inc()
+        self.recorder.record("login.rejected", retry_in=self.breaker.retry_in())
+        return False
+
+    def send_login(self):
+        """Send the login form, returns True when logged in."""
+        self.transport.update_headers(login_headers(self.base_url))
+
+        self.throttle("login")
+        with self.transport.request(
+            "POST", "login", self.base_url, data=self.login_data(), stream=True
+        ) as resp:
+            _LOGGER.debug("Login -> response code: %d", resp.status)
+
+            logged_in = resp.url == self.status_url
+            if logged_in:
+                logged_in = self.set_status(read_status_page(resp.iter_chunks()))
+            _LOGGER.debug("Login -> logged in: %s", logged_in)
+        if not logged_in:
+            self.metrics.failed_logins.inc()
+        return logged_in
+
+    def login_data(self):
+        """Return the login form data."""
+        return {
             "IsDisableAccountCreation": "False",
             "IsAllowThemeChange": "False",
             "UserName": self.username,
@@ -108,103 +288,210 @@ class Controller:
             "RememberMe": "false",
         }
 
-        resp = self.session.post(METRONET_URL, data=data)
-        _LOGGER.debug("Init Login -> Cookies: %s", self.session.cookies)
-
-        _LOGGER.debug("Login -> response code: %d", resp.status_code)
-
-        logged_in = resp.url == METRONET_STATUS
-        _LOGGER.debug("Login -> logged in: %s", logged_in)
-        if logged_in:
-            self.parse_status_page(resp.text)
-        return logged_in
-
     def parse_status_page(self, page):
         """Parse response status page."""
-        self.session_id = get_variable(page, "sessionId")
+        decoder = StatusPageDecoder()
+        decoder.feed(page.encode())
+        return self.set_status(decoder.close())
+
+    def set_status(self, status):
+        """Read the session from a StatusPage.
+
+        Returns False when the session id is missing.
+        """
+        if status.missing:
+            _LOGGER.warning("Status Page -> missing %s", ", ".join(status.missing))
+        self.session_id = status.values.get("sessionId")
         _LOGGER.debug("Parse Status Page -> sessionId %s", self.session_id)
-        self.last_input = get_variable(page, "lastInputId")
-        _LOGGER.debug("Parse Status Page -> LastInput %d", self.last_input)
+        self.last_input = status.values.get("lastInputId")
+        _LOGGER.debug("Parse Status Page -> LastInput %s", self.last_input)
+        return self.session_id is not None
 
-    def get_strings(self):
-        """Read sensor list from metronet."""
+    def read_strings(self, wanted=None):
+        """Read the (idx, description) of the inputs from metronet.
+
+        wanted is a container of the indices to keep, None to keep all.
+        """
         data = {"sessionId": self.session_id}
 
-        resp = self.session.post(METRONET_API_STRINGS, data=data)
-
-        _LOGGER.debug("Strings-> response code: %d", resp.status_code)
-
-        page = resp.json()
-
-        for data in page:
-            if data["Class"] == 10:
-                # Found an input
-                idx = data["Index"]
-                if not self.lookup:
-                    # No configuration provided. Get all sensors.
-                    self.sensors.append(
-                        {"id": idx, "type": None, "name": data["Description"]}
-                    )
-                elif idx in self.lookup:
-                    # Consider only configured sensors.
-                    sensor = self.lookup[idx]
-                    if not sensor["name"]:
-                        # Configured without name... get it from metronet.
-                        sensor["name"] = data["Description"]
-        if not self.lookup:
-            self.__create_lookup()
+        self.throttle("strings")
+        with self.transport.request(
+            "POST", "strings", self.api_url("strings"), data=data, stream=True
+        ) as resp:
+            _LOGGER.debug("Strings-> response code: %d", resp.status)
+
+            return decode(StringsDecoder(wanted), resp.iter_chunks())
+
+    def get_strings(self):
+        """Read sensor list from metronet.
+
+        With a catalog cache the whole catalog is read and stored.
+        """
+        if self.catalog_cache is None:
+            self.process_strings(self.read_strings(self.sensors or None))
+            return
+        catalog = self.read_strings()
+        self.catalog_cache.save(self.username, self.base_url, catalog)
+        self.process_strings(catalog)
+
+    def load_catalog(self):
+        """Read the sensor list from the catalog cache.
+
+        The catalog is refreshed later by the message loop. Returns False
+        when there is no cached catalog.
+        """
+        if self.catalog_cache is None:
+            return False
+        catalog = self.catalog_cache.load(self.username, self.base_url)
+        if catalog is None:
+            return False
+        self.process_strings(catalog)
+        self.refresh_pending = True
+        return True
+
+    def refresh_catalog(self):
+        """Read the catalog from metronet and update the cache if changed.
+
+        Sensors without a name get it now, new inputs are added to the
+        sensor list at the next start.
+        """
+        self.refresh_pending = False
+        try:
+            catalog = self.read_strings()
+        except Exception:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            _LOGGER.error("Refresh Catalog -> Exception!")
+            return
+        if self.catalog_cache.save(self.username, self.base_url, catalog):
+            _LOGGER.info("Refresh Catalog -> sensor catalog changed")
+            self.process_strings(catalog)
+
+    def process_strings(self, strings):
+        """Update the sensor list with the (idx, description) of the inputs."""
+        # No configuration provided. Get all sensors.
+        get_all = not self.sensors
+        for idx, description in strings:
+            if get_all:
+                self.sensors.add(idx, None, description)
+            else:
+                # Consider only configured sensors.
+                sensor = self.sensors.get(idx)
+                if sensor is not None and not sensor.name:
+                    # Configured without name... get it from metronet.
+                    self.sensors.set_name(idx, description)
+        self.publish(self.snapshot.timestamp)
         _LOGGER.debug("Init Session Data -> sensors %s", self.sensors)
 
-    def get_inputs(self, is_retry=False):
-        """Read sensor values from metronet."""
+    def read_inputs(self):
+        """Read sensor values from metronet, return False on errors."""
         data = {"sessionId": self.session_id}
-        _LOGGER.debug("Get Inputs -> data %s", data)
 
+        decoder = InputsDecoder(self.sensors)
+        self.throttle("inputs")
+        start = time.monotonic()
+        self.recorder.record("inputs.start")
         try:
-            resp = self.session.post(METRONET_API_INPUTS, data=data, timeout=10)
-        except Exception:  # pylint: disable=broad-except
+            with self.transport.request(
+                "POST", "inputs", self.api_url("inputs"), data=data, stream=True
+            ) as resp:
+                if resp.status != 200:
+                    self.recorder.record("inputs.end", status=resp.status)
+                    return False
+                states = decode(decoder, resp.iter_chunks())
+        except Exception as err:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            self.recorder.record("inputs.error", error=repr(err))
             _LOGGER.error("Get Inputs -> Exception!")
-        if resp is not None:
-            _LOGGER.debug("Get Inputs -> response code: %d", resp.status_code)
-        if resp is not None and resp.status_code == 200:
-            page = resp.json()
-
-            is_changed = False
-            notify_data = []
-            for obj in page:
-                idx = obj["Index"]
-                if idx in self.lookup:
-                    # The input is in the list of configured sensors.
-                    sensor = self.lookup[idx]
-                    if "active" not in sensor:
-                        sensor["active"] = obj["Alarm"]
-                    elif sensor["active"] != obj["Alarm"]:
-                        is_changed = True
-                        sensor["active"] = obj["Alarm"]
-                        notify_data.append((idx, obj["Alarm"]))
-                self.last_input = obj["Id"]
-            _LOGGER.debug("Get Inputs -> sensors: %s", self.sensors)
-            if is_changed:
-                _LOGGER.debug("Get Inputs -> notify : %s", notify_data)
-                self.notify(notify_data)
-        elif is_retry:
-            _LOGGER.warning("Get Inputs -> Error after relogin")
-            _LOGGER.debug("Get Inputs -> Wait 15 seconds")
-            # Wait 15 seconds and retry
-            time.sleep(15)
-            _LOGGER.info("Get Inputs -> Relogin")
-            self.login()
-            # Try again.
-            self.get_inputs(is_retry=True)
-        else:
+            return False
+        changes = self.process_inputs(states, decoder.last_id)
+        elapsed = time.monotonic() - start
+        self.metrics.inputs.observe(elapsed)
+        self.recorder.record(
+            "inputs.end", status=200, changes=len(changes), elapsed=elapsed
+        )
+        return True
+
+    def get_inputs(self):
+        """Read sensor values from metronet.
+
+        On errors relogins and tries again, waiting the scheduler backoff
+        after the first retry, until the retry budget is spent.
+        Returns False when giving up.
+        """
+        retries = 0
+        while not self.read_inputs():
+            if retries >= self.scheduler.retry_budget:
+                _LOGGER.error("Get Inputs -> Retry budget exhausted")
+                return False
+            retries += 1
+            if retries > 1:
+                _LOGGER.warning("Get Inputs -> Error after relogin")
+                if self.wait(self.scheduler.backoff(retries - 1)):
+                    return False
             _LOGGER.info("Get Inputs -> Relogin")
-            self.login()
-            # Try again.
-            self.get_inputs(is_retry=True)
+            self.relogin("inputs failed")
+        return True
 
-    def get_updates(self):
-        """Ask metronet for updaes."""
-        data = {
+    def process_inputs(self, states, last_id=None):
+        """Update sensor values and notify the changed ones.
+
+        states are the (idx, alarm) tuples of the configured inputs.
+        Returns the ChangeSet of the changed sensors.
+        """
+        self.received = time.monotonic()
+        changes = self.sensors.update(states)
+        if last_id is not None:
+            self.last_input = last_id
+        now = time.time()
+        self.publish(now)
+        if changes:
+            if self.waiters:
+                self.wake_waiters(changes)
+            if self.journal is not None:
+                self.write_journal(changes, now)
+            self.notify(changes)
+            if self.batch_callbacks:
+                self.notify_batch(ChangeBatch(now, self.last_input, tuple(changes)))
+        return changes
+
+    def add_waiter(self, waiter):
+        """Add a ChangeWaiter, woken by the next polls."""
+        with self._waiters_lock:
+            self.waiters.append(waiter)
+
+    def remove_waiter(self, waiter):
+        """Remove a ChangeWaiter, if still waiting."""
+        with self._waiters_lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def wake_waiters(self, changes):
+        """Wake the waiters of a poll, keeping those still waiting."""
+        with self._waiters_lock:
+            self.waiters = [
+                waiter
+                for waiter in self.waiters
+                if not waiter.wake(self.snapshot, changes)
+            ]
+
+    def cancel_waiters(self):
+        """End every wait without a snapshot."""
+        with self._waiters_lock:
+            waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            waiter.cancel()
+
+    def write_journal(self, changes, timestamp):
+        """Append the changes of a poll to the journal."""
+        try:
+            self.journal.append(self.username, changes, self.last_input, timestamp)
+        except Exception:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            _LOGGER.exception("Could not write the journal")
+
+    def updates_data(self):
+        """Return the form data of the updates request."""
+        return {
             "sessionId": self.session_id,
             "CanElevate": "1",
             "ConnectionStatus": "1",
@@ -214,31 +501,120 @@ class Controller:
             "ReadStringsInProgress": "0",
             "Strings": "1",
         }
-        _LOGGER.debug("Updates -> data %s", data)
 
+    def get_updates(self):
+        """Ask metronet for updaes.
+
+        The long-poll timeout is given by the scheduler, which learns the
+        hold time of the server from the replies without changes.
+        """
+        data = self.updates_data()
+        timeout = self.scheduler.updates_timeout()
+        self.throttle("updates")
+        start = time.monotonic()
+        self.recorder.record(
+            "updates.start", last_input=self.last_input, timeout=timeout
+        )
         try:
-            resp = self.session.post(METRONET_API_UPDATES, data=data, timeout=30)
-        except Exception:  # pylint: disable=broad-except
+            with self.transport.request(
+                "POST", "updates", self.api_url("updates"), data=data, read=timeout
+            ) as resp:
+                status = resp.status
+                page = resp.json() if resp.status == 200 else None
+        except TransportTimeout:
+            self.recorder.record("updates.timeout", timeout=timeout)
+            self.metrics.timeouts.inc()
+            self.scheduler.observe_timeout()
+            return False
+        except Exception as err:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            self.recorder.record("updates.error", error=repr(err))
             _LOGGER.error("Updates -> Exception!")
+            self.failed()
             return False
-        _LOGGER.debug("Updates -> response code: %d", resp.status_code)
-        if resp.status_code == 200:
-            page = resp.json()
-
-            changes = page["HasChanges"]
-            # if changes:
-            _LOGGER.debug(
-                "Updates -> Last Input: %d -> Changes: %s", self.last_input, changes
+        # A reply without HasChanges is an error reply, like a bad status.
+        changes = page.get("HasChanges") if isinstance(page, dict) else None
+        if changes is not None:
+            elapsed = time.monotonic() - start
+            self.observe_updates(changes, elapsed)
+            self.recorder.record(
+                "updates.end", status=status, changes=changes, elapsed=elapsed
             )
-
+            self.failures = 0
             return changes
+        reason = f"updates status {status}"
+        if page is not None:
+            reason = "updates reply without HasChanges"
         _LOGGER.info("Updates -> Relogin")
-        logged_in = self.login()
+        self.recorder.record("updates.end", status=status)
+        logged_in = self.relogin(reason)
         if not logged_in:
             _LOGGER.error("Updates -> Failed to login")
+            self.failed()
             return False
+        self.failures = 0
         return True
 
+    def observe_updates(self, changes, elapsed):
+        """Account an updates reply received after elapsed seconds."""
+        self.metrics.updates.inc()
+        self.metrics.hold.observe(elapsed)
+        if changes:
+            self.metrics.changes.inc()
+        else:
+            self.scheduler.observe_hold(elapsed)
+
+    def relogin(self, reason=None):
+        """Login again, returns False also on connection errors.
+
+        reason tells why, for the flight recorder.
+        """
+        self.metrics.relogins.inc()
+        self.recorder.record("relogin", reason=reason)
+        try:
+            logged_in = self.login()
+        except Exception as err:  # pylint: disable=broad-except
+            self.metrics.exceptions.inc()
+            self.metrics.failed_logins.inc()
+            self.recorder.record("relogin.error", error=repr(err))
+            _LOGGER.error("Relogin -> Exception!")
+            return False
+        self.recorder.record("relogin.end", logged_in=logged_in)
+        if logged_in:
+            self.save_session()
+        return logged_in
+
+    def failed(self):
+        """Wait the scheduler backoff after a failure of the loop.
+
+        While the login breaker is open waits at least until its next probe.
+        """
+        self.failures += 1
+        delay = max(self.scheduler.backoff(self.failures), self.breaker.retry_in())
+        self.recorder.record("failure", failures=self.failures, delay=delay)
+        self.wait(delay)
+
+    def reserve(self, endpoint):
+        """Reserve a request of the budget, returns how long to wait for it."""
+        if self.budget is None:
+            return 0.0
+        delay = self.budget.reserve()
+        if delay > 0:
+            self.metrics.throttled.inc()
+            self.metrics.throttle_wait.observe(delay)
+            self.recorder.record("throttle", endpoint=endpoint, delay=delay)
+        return delay
+
+    def throttle(self, endpoint):
+        """Wait for the request budget before a request to endpoint."""
+        delay = self.reserve(endpoint)
+        if delay:
+            self.wait(delay)
+
+    def wait(self, delay):
+        """Wait for delay seconds, returns True if the loop has been stopped."""
+        return self._stopped.wait(delay)
+
     def message_loop(self):
         """Message loop.
 
@@ -247,20 +623,20 @@ class Controller:
         asks or updated sensor values and repeat the process.
         """
         _LOGGER.info("Mainloop: Started")
+        self._stopped.clear()
+        if self.refresh_pending:
+            self.refresh_catalog()
         while self.run:
             # Loop forever
-            _LOGGER.debug("Mainloop: Getting Updates")
             update = self.get_updates()
-            _LOGGER.debug("Mainloop: End Getting Updates")
             # Ask for update
             if update:
                 # Get inputs
-                _LOGGER.debug("Mainloop: Getting Inputs")
                 self.get_inputs()
-                _LOGGER.debug("Mainloop: End Getting Inputs")
         _LOGGER.info("Mainloop: ended")
 
     def stop_loop(self):
         """Tell main loop to stop."""
         _LOGGER.debug("Ending Main Loop")
         self.run = False
+        self._stopped.set()
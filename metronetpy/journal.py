@@ -0,0 +1,230 @@
+"""The Metronet IESS Online bridge.
+
+An append-only journal of the sensor transitions. Records have a fixed
+width and are written to memory-mapped segment files of a directory, a
+new segment is started when the current one is full. Records are in
+time order, so that a query looks up its start with a binary search and
+reads only the records after it.
+"""
+from collections import namedtuple
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+MAGIC = b"MNJ1"
+JOURNAL_VERSION = 1
+SEGMENT_RECORDS = 65536
+
+# timestamp, account id, sensor index, active, input Id.
+RECORD = struct.Struct("<d8sI?3xq")
+# magic, version, record size, number of records, padded to a record.
+HEADER = struct.Struct("<4sHHQ")
+HEADER_SIZE = RECORD.size
+
+# Input Ids that are not integers are stored as NO_ID.
+NO_ID = -1
+
+_SEGMENT = re.compile(r"^(\d{8})\.mnj$")
+
+Transition = namedtuple(
+    "Transition", ["timestamp", "account", "sensor", "active", "input_id"]
+)
+Transition.__doc__ = """A sensor transition read from the journal."""
+
+
+def account_id(account):
+    """Return the 8 bytes id of an account name stored in the records."""
+    return hashlib.sha256(account.encode()).digest()[:8]
+
+
+def input_id(value):
+    """Return an input Id as an integer, NO_ID if it is not one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NO_ID
+
+
+class Segment:
+    """A memory-mapped segment file of the journal."""
+
+    def __init__(self, path, capacity, writable):
+        """Init for data, creating the file when writable and missing."""
+        self.path = path
+        flags = os.O_RDWR | os.O_CREAT if writable else os.O_RDONLY
+        self.fd = os.open(path, flags, 0o600)
+        size = os.fstat(self.fd).st_size
+        if size == 0 and writable:
+            size = HEADER_SIZE + capacity * RECORD.size
+            os.ftruncate(self.fd, size)
+            self.map = mmap.mmap(self.fd, size)
+            HEADER.pack_into(self.map, 0, MAGIC, JOURNAL_VERSION, RECORD.size, 0)
+        else:
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self.map = mmap.mmap(self.fd, size, access=access)
+        magic, version, record_size, self.count = HEADER.unpack_from(self.map, 0)
+        if (magic, version, record_size) != (MAGIC, JOURNAL_VERSION, RECORD.size):
+            self.close()
+            raise ValueError(f"{path} is not a journal segment")
+        self.capacity = (size - HEADER_SIZE) // RECORD.size
+
+    def is_full(self):
+        """Tell if there is no room for another record."""
+        return self.count >= self.capacity
+
+    def append(self, timestamp, account, sensor, active, cursor):
+        """Write a record and then the new count.
+
+        cursor is the input Id of the poll, as an integer.
+        """
+        offset = HEADER_SIZE + self.count * RECORD.size
+        RECORD.pack_into(self.map, offset, timestamp, account, sensor, active, cursor)
+        self.count += 1
+        HEADER.pack_into(self.map, 0, MAGIC, JOURNAL_VERSION, RECORD.size, self.count)
+
+    def timestamp(self, index):
+        """Return the timestamp of a record."""
+        return struct.unpack_from("<d", self.map, HEADER_SIZE + index * RECORD.size)[0]
+
+    def bisect(self, since):
+        """Return the index of the first record at or after since."""
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.timestamp(mid) < since:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def records(self, start):
+        """Iterate on the raw records from start."""
+        end = HEADER_SIZE + self.count * RECORD.size
+        view = memoryview(self.map)[HEADER_SIZE + start * RECORD.size : end]
+        try:
+            yield from RECORD.iter_unpack(view)
+        finally:
+            view.release()
+
+    def flush(self):
+        """Write the dirty pages to the file."""
+        self.map.flush()
+
+    def close(self):
+        """Unmap and close the file."""
+        self.map.close()
+        os.close(self.fd)
+
+
+class Journal:
+    """Append-only journal of sensor transitions in a directory.
+
+    segment_records is the number of records of a new segment file.
+    """
+
+    def __init__(self, directory, segment_records=SEGMENT_RECORDS):
+        """Init for data, opening the last segment of the directory."""
+        self.directory = directory
+        self.segment_records = segment_records
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        numbers = self.segments()
+        self._number = numbers[-1] if numbers else 0
+        self._current = Segment(self.path(self._number), segment_records, True)
+
+    def path(self, number):
+        """Return the file of a segment."""
+        return os.path.join(self.directory, f"{number:08d}.mnj")
+
+    def segments(self):
+        """Return the numbers of the segment files, in order."""
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT.match(name)
+            if match is not None:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def append(self, account, changes, last_input=None, timestamp=None):
+        """Append the (idx, active) changes of an account.
+
+        account is the account name, last_input the input Id of the poll.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        ident = account_id(account)
+        cursor = input_id(last_input)
+        with self._lock:
+            for idx, active in changes:
+                if self._current.is_full():
+                    self._rotate()
+                self._current.append(timestamp, ident, idx, active, cursor)
+
+    def _rotate(self):
+        """Start a new segment."""
+        self._current.close()
+        self._number += 1
+        self._current = Segment(self.path(self._number), self.segment_records, True)
+
+    def history(self, sensor, since=0.0, account=None):
+        """Return the transitions of a sensor since a timestamp.
+
+        account restricts the history to an account name. Only the
+        segments overlapping the time range are read.
+        """
+        ident = None if account is None else account_id(account)
+        transitions = []
+        with self._lock:
+            numbers = self.segments()
+            for pos, number in enumerate(numbers):
+                if number == self._number:
+                    transitions.extend(self._scan(self._current, sensor, since, ident))
+                    continue
+                if pos + 1 < len(numbers) and self._starts_before(
+                    numbers[pos + 1], since
+                ):
+                    # The whole segment is older than since.
+                    continue
+                segment = Segment(self.path(number), 0, False)
+                try:
+                    transitions.extend(self._scan(segment, sensor, since, ident))
+                finally:
+                    segment.close()
+        return transitions
+
+    def _starts_before(self, number, since):
+        """Tell if a segment starts before since."""
+        if number == self._number:
+            segment = self._current
+            return segment.count > 0 and segment.timestamp(0) < since
+        segment = Segment(self.path(number), 0, False)
+        try:
+            return segment.count > 0 and segment.timestamp(0) < since
+        finally:
+            segment.close()
+
+    @staticmethod
+    def _scan(segment, sensor, since, ident):
+        """Return the matching transitions of a segment."""
+        return [
+            Transition(timestamp, account, idx, active, cursor)
+            for timestamp, account, idx, active, cursor in segment.records(
+                segment.bisect(since)
+            )
+            if idx == sensor and (ident is None or account == ident)
+        ]
+
+    def flush(self):
+        """Write the current segment to disk."""
+        with self._lock:
+            self._current.flush()
+
+    def close(self):
+        """Flush and close the current segment."""
+        with self._lock:
+            self._current.flush()
+            self._current.close()
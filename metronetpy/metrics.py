@@ -0,0 +1,306 @@
+"""The Metronet IESS Online bridge.
+
+A small metrics registry of counters and histograms, rendered as a dict
+or as Prometheus text.
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the histogram buckets, from callbacks to the
+# long-poll hold time.
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labels):
+    """Return the Prometheus text of a dict of labels."""
+    if not labels:
+        return ""
+    items = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return f"{{{items}}}"
+
+
+class Counter:
+    """A monotonic counter."""
+
+    kind = "counter"
+
+    def __init__(self, name, doc):
+        """Init for data."""
+        self.name = name
+        self.doc = doc
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increment the counter."""
+        self.value += amount
+
+    def collect(self):
+        """Return the value of the counter."""
+        return self.value
+
+    def samples(self, labels):
+        """Return the Prometheus samples of the counter."""
+        return [f"{self.name}{format_labels(labels)} {self.value}"]
+
+
+class Histogram:
+    """A histogram of durations in seconds, with fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets=BUCKETS):
+        """Init for data."""
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def collect(self):
+        """Return count, sum, average, maximum and the cumulative buckets."""
+        with self._lock:
+            counts = list(self.counts)
+            count, total, maximum = self.count, self.sum, self.max
+        buckets = {}
+        cumulative = 0
+        for bound, value in zip(self.buckets, counts):
+            cumulative += value
+            buckets[bound] = cumulative
+        return {
+            "count": count,
+            "sum": total,
+            "avg": total / count if count else 0.0,
+            "max": maximum,
+            "buckets": buckets,
+        }
+
+    def samples(self, labels):
+        """Return the Prometheus samples of the histogram."""
+        data = self.collect()
+        lines = []
+        for bound, value in data["buckets"].items():
+            bucket_labels = format_labels(dict(labels, le=bound))
+            lines.append(f"{self.name}_bucket{bucket_labels} {value}")
+        inf_labels = format_labels(dict(labels, le="+Inf"))
+        lines.append(f"{self.name}_bucket{inf_labels} {data['count']}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {data['sum']}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {data['count']}")
+        return lines
+
+
+class HistogramFamily:
+    """Histograms of the same measure, one per value of a label."""
+
+    kind = "histogram"
+
+    def __init__(self, name, doc, label, buckets=BUCKETS):
+        """Init for data."""
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.buckets = buckets
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        """Return the histogram of a label value."""
+        child = self.children.get(value)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(
+                    value, Histogram(self.name, self.doc, self.buckets)
+                )
+        return child
+
+    def collect(self):
+        """Return the histograms by label value."""
+        return {value: child.collect() for value, child in self.children.items()}
+
+    def samples(self, labels):
+        """Return the Prometheus samples of every histogram."""
+        lines = []
+        for value, child in list(self.children.items()):
+            lines.extend(child.samples(dict(labels, **{self.label: value})))
+        return lines
+
+
+class MetricsRegistry:
+    """A set of named metrics."""
+
+    def __init__(self):
+        """Init for data."""
+        self.metrics = {}
+
+    def counter(self, name, doc):
+        """Register and return a counter."""
+        return self._register(Counter(name, doc))
+
+    def histogram(self, name, doc, label=None, buckets=BUCKETS):
+        """Register and return a histogram.
+
+        With a label returns a family of histograms, one per label value.
+        """
+        if label is None:
+            return self._register(Histogram(name, doc, buckets))
+        return self._register(HistogramFamily(name, doc, label, buckets))
+
+    def _register(self, metric):
+        """Add a metric to the registry."""
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def collect(self):
+        """Return the values of every metric, keyed by name."""
+        return {name: metric.collect() for name, metric in self.metrics.items()}
+
+    def prometheus(self, labels=None, gauges=None):
+        """Return the metrics in the Prometheus text format.
+
+        labels are added to every sample, gauges maps a name prefix to a
+        dict of numbers exported as gauges, like the stats of a transport.
+        """
+        labels = labels or {}
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(labels))
+        for prefix, values in (gauges or {}).items():
+            for key, value in values.items():
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class PollMetrics(MetricsRegistry):
+    """The metrics of the polling loop of a Controller."""
+
+    def __init__(self):
+        """Init for data."""
+        super().__init__()
+        self.updates = self.counter(
+            "metronet_updates_total", "Updates long-polls answered by metronet"
+        )
+        self.changes = self.counter(
+            "metronet_updates_changes_total", "Updates replies with HasChanges set"
+        )
+        self.timeouts = self.counter(
+            "metronet_updates_timeouts_total", "Updates long-polls timed out"
+        )
+        self.relogins = self.counter("metronet_relogins_total", "Relogin attempts")
+        self.failed_logins = self.counter(
+            "metronet_failed_logins_total", "Logins refused or failed"
+        )
+        self.rejected_logins = self.counter(
+            "metronet_rejected_logins_total", "Logins rejected by the circuit breaker"
+        )
+        self.throttled = self.counter(
+            "metronet_throttled_total", "Requests delayed by the request budget"
+        )
+        self.exceptions = self.counter(
+            "metronet_exceptions_total", "Exceptions caught by the polling loop"
+        )
+        self.hold = self.histogram(
+            "metronet_updates_hold_seconds", "Time an updates long-poll is held"
+        )
+        self.throttle_wait = self.histogram(
+            "metronet_throttle_seconds", "Time requests waited for the request budget"
+        )
+        self.inputs = self.histogram(
+            "metronet_inputs_seconds", "Latency of reading and processing the inputs"
+        )
+        self.notify_lag = self.histogram(
+            "metronet_notify_lag_seconds", "Time from the inputs response to a callback"
+        )
+        self.callbacks = self.histogram(
+            "metronet_callback_seconds", "Execution time of the callbacks", "sensor"
+        )
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Request handler serving the Prometheus text of the server source."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle a GET request."""
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.source().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests at debug level."""
+        _LOGGER.debug(format, *args)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Http server of the /metrics endpoint, in a separate thread.
+
+    source is a function returning the Prometheus text.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, source, host="127.0.0.1", port=9464):
+        """Init for data."""
+        super().__init__((host, port), MetricsHandler)
+        self.source = source
+        self._thread = None
+
+    def start(self):
+        """Start serving."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="MetronetMetrics", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
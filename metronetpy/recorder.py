@@ -0,0 +1,42 @@
+"""The Metronet IESS Online bridge."""
+from collections import deque
+import json
+import time
+
+
+class FlightRecorder:
+    """Ring buffer of the recent events of the polling loop.
+
+    Events are (timestamp, name, fields) tuples appended in place of the
+    debug logging of the loop, the oldest are discarded once size events
+    are stored. Recording costs an append, formatting happens only when
+    the events are dumped.
+    """
+
+    def __init__(self, size=1024):
+        """Init for data."""
+        self.events = deque(maxlen=size)
+
+    def record(self, event, **fields):
+        """Store an event with its fields."""
+        self.events.append((time.time(), event, fields))
+
+    def dump(self):
+        """Return the stored events as dicts, oldest first."""
+        return [
+            {"time": timestamp, "event": event, **fields}
+            for timestamp, event, fields in tuple(self.events)
+        ]
+
+    def write(self, file):
+        """Write the stored events to a text file, one json per line."""
+        for event in self.dump():
+            file.write(json.dumps(event, default=str) + "\n")
+
+    def clear(self):
+        """Discard the stored events."""
+        self.events.clear()
+
+    def __len__(self):
+        """Return the number of stored events."""
+        return len(self.events)
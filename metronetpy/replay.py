@@ -0,0 +1,274 @@
+"""The Metronet IESS Online bridge.
+
+Record and replay of the http sessions of a Controller. A capture is a
+gzip file of json lines: a header, then one entry per request with its
+endpoint, the status, url path and body of the response and how long the
+response took. Request forms, and so the credentials, are not recorded.
+"""
+from collections import deque
+import gzip
+import json
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from .transport import MemoryResponse, Transport, TransportTimeout
+
+CAPTURE_VERSION = 1
+
+
+class ReplayFinished(Exception):
+    """Every request of the capture has been replayed."""
+
+
+def read_capture(path):
+    """Return the header and the list of entries of a capture file."""
+    with gzip.open(path, "rt") as file:
+        header = json.loads(file.readline())
+        if header.get("version") != CAPTURE_VERSION:
+            raise ValueError(f"{path} is not a metronet capture")
+        entries = [json.loads(line) for line in file if line.strip()]
+    return header, entries
+
+
+def encode_body(body):
+    """Return the json fields storing a body."""
+    try:
+        return {"body": body.decode()}
+    except UnicodeDecodeError:
+        return {"body_hex": body.hex()}
+
+
+def decode_body(entry):
+    """Return the body stored in an entry."""
+    if "body_hex" in entry:
+        return bytes.fromhex(entry["body_hex"])
+    return entry.get("body", "").encode()
+
+
+class Capture:
+    """Writer of a capture file, shared by the responses being recorded."""
+
+    def __init__(self, path):
+        """Init for data, writing the header."""
+        self.path = path
+        self.start = time.monotonic()
+        self._file = gzip.open(path, "wt")
+        self._lock = threading.Lock()
+        self._write({"version": CAPTURE_VERSION, "started": time.time()})
+
+    def add(self, start, method, endpoint, status=None, url=None, body=b""):
+        """Write the entry of a request started at start.
+
+        A None status records a timeout.
+        """
+        entry = {
+            "t": start - self.start,
+            "elapsed": time.monotonic() - start,
+            "method": method,
+            "endpoint": endpoint,
+        }
+        if status is None:
+            entry["timeout"] = True
+        else:
+            entry["status"] = status
+            entry["path"] = urlsplit(url).path
+            entry.update(encode_body(body))
+        self._write(entry)
+
+    def _write(self, data):
+        """Write a line and flush it, so that a crash keeps the capture."""
+        with self._lock:
+            self._file.write(json.dumps(data, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        with self._lock:
+            self._file.close()
+
+
+class RecordingResponse:
+    """Response recording the body read from the response it wraps."""
+
+    def __init__(self, response, capture, start, method, endpoint):
+        """Init for data."""
+        self.response = response
+        self.capture = capture
+        self.start = start
+        self.method = method
+        self.endpoint = endpoint
+        self.status = response.status
+        self.url = response.url
+        self._body = []
+        self._recorded = False
+
+    def text(self):
+        """Return the body as text."""
+        text = self.response.text()
+        self._body.append(text.encode())
+        return text
+
+    def json(self):
+        """Return the body decoded from json."""
+        return json.loads(self.text())
+
+    def iter_chunks(self):
+        """Iterate on the chunks of the body."""
+        for chunk in self.response.iter_chunks():
+            self._body.append(chunk)
+            yield chunk
+
+    def record(self):
+        """Write the entry of the response, once."""
+        if not self._recorded:
+            self._recorded = True
+            self.capture.add(
+                self.start,
+                self.method,
+                self.endpoint,
+                self.status,
+                self.url,
+                b"".join(self._body),
+            )
+
+    def close(self):
+        """Record the response and close the wrapped one."""
+        self.record()
+        self.response.close()
+
+    def __enter__(self):
+        """Return the response in a with block."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close the response at the end of a with block."""
+        self.close()
+
+
+class RecordingTransport(Transport):
+    """Transport recording the responses of another transport to a capture."""
+
+    def __init__(self, transport, path):
+        """Init for data."""
+        super().__init__(transport.timeouts)
+        self.transport = transport
+        self.capture = Capture(path)
+
+    def connections(self):
+        """Return the number of connections opened so far."""
+        return self.transport.connections()
+
+    def stats(self):
+        """Return the statistics of the wrapped transport."""
+        return self.transport.stats()
+
+    def open(self):
+        """Start a new session, with no cookies and the default headers."""
+        self.transport.open()
+
+    def update_headers(self, headers):
+        """Add headers to every request of the session."""
+        self.transport.update_headers(headers)
+
+    def get_cookies(self):
+        """Return the cookies of the session as a list of dicts."""
+        return self.transport.get_cookies()
+
+    def set_cookies(self, cookies, url):
+        """Add cookies, as returned by get_cookies, to the session."""
+        self.transport.set_cookies(cookies, url)
+
+    def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Send a request through the wrapped transport and record it."""
+        start = time.monotonic()
+        try:
+            resp = self.transport.request(method, endpoint, url, data, stream, read)
+        except TransportTimeout:
+            self.capture.add(start, method, endpoint)
+            raise
+        return RecordingResponse(resp, self.capture, start, method, endpoint)
+
+    def close(self):
+        """Close the wrapped transport and the capture."""
+        self.transport.close()
+        self.capture.close()
+
+
+class ReplayTransport(Transport):
+    """Transport answering the requests with the responses of a capture.
+
+    A request gets the next recorded response of the same endpoint, after
+    the recorded duration divided by speed; a speed of 0 replays without
+    waiting. Once the capture is over done is set and the requests raise
+    ReplayFinished.
+    """
+
+    def __init__(self, path, speed=1.0, timeouts=None):
+        """Init for data."""
+        super().__init__(timeouts)
+        self.path = path
+        self.speed = speed
+        self.header, entries = read_capture(path)
+        self.entries = deque(entries)
+        self.replayed = 0
+        self.skipped = 0
+        self.done = threading.Event()
+        self._closed = threading.Event()
+
+    def connections(self):
+        """Return the number of connections opened so far."""
+        return 0
+
+    def open(self):
+        """Nothing to do, the capture has no session."""
+
+    def update_headers(self, headers):
+        """Headers are not replayed."""
+
+    def get_cookies(self):
+        """Return no cookies."""
+        return []
+
+    def set_cookies(self, cookies, url):
+        """Cookies are not replayed."""
+
+    def next_entry(self, endpoint):
+        """Return the next entry of an endpoint, skipping the others."""
+        while self.entries:
+            entry = self.entries.popleft()
+            if entry["endpoint"] == endpoint:
+                self.replayed += 1
+                return entry
+            self.skipped += 1
+        self.done.set()
+        raise ReplayFinished(self.path)
+
+    def delay(self, entry, read):
+        """Return how long to wait and if the request times out."""
+        elapsed = entry["elapsed"]
+        timeout = entry.get("timeout", False)
+        if read is not None and elapsed > read:
+            elapsed, timeout = read, True
+        return (elapsed / self.speed if self.speed else 0.0), timeout
+
+    def response(self, entry, url, response_class=MemoryResponse):
+        """Return the recorded response of an entry."""
+        return response_class(
+            entry["status"], urljoin(url, entry["path"]), decode_body(entry)
+        )
+
+    def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Return the next recorded response of the endpoint."""
+        self.requests += 1
+        entry = self.next_entry(endpoint)
+        delay, timeout = self.delay(entry, self.timeout(endpoint, read)[1])
+        if delay:
+            self._closed.wait(delay)
+        if timeout:
+            raise TransportTimeout(f"{endpoint} timed out")
+        return self.response(entry, url)
+
+    def close(self):
+        """Stop waiting."""
+        self._closed.set()
@@ -0,0 +1,79 @@
+"""The Metronet IESS Online bridge."""
+import math
+import random
+
+
+class PollScheduler:
+    """The scheduler of the polling loop.
+
+    Gives the delays of the retries, an exponential backoff with jitter,
+    the retry budget of get_inputs and the timeout of the updates
+    long-poll, learned from the hold time of the server.
+    Subclass and assign to Controller.scheduler to change the policy.
+    """
+
+    def __init__(
+        self,
+        base=1.0,
+        factor=2.0,
+        maximum=60.0,
+        jitter=0.2,
+        retry_budget=8,
+        timeout=30.0,
+        min_timeout=10.0,
+        max_timeout=120.0,
+        margin=1.25,
+        smoothing=0.2,
+    ):
+        """Init for data.
+
+        jitter is the fraction of the delay randomly added or removed,
+        margin multiplies the learned hold time to get the timeout and
+        smoothing is the weight of a new hold time in the moving average.
+        """
+        self.base = base
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+        self.retry_budget = retry_budget
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.margin = margin
+        self.smoothing = smoothing
+        self.hold = None
+
+    def backoff(self, attempt):
+        """Return the delay before a retry, attempt starts from 1.
+
+        attempt may count the failures of an outage of days, the exponent
+        stops growing once the delay reaches maximum.
+        """
+        exponent = attempt - 1
+        if self.factor > 1 and self.base > 0 and self.maximum > 0:
+            exponent = min(
+                exponent, math.ceil(math.log(self.maximum / self.base, self.factor))
+            )
+        delay = min(self.maximum, self.base * self.factor**exponent)
+        return max(0.0, delay * (1 + self.jitter * random.uniform(-1, 1)))
+
+    def updates_timeout(self):
+        """Return the timeout of the updates long-poll."""
+        if self.hold is None:
+            return self.timeout
+        timeout = self.hold * self.margin
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def observe_hold(self, seconds):
+        """Learn from an updates request answered without changes.
+
+        Without changes the server replies at the end of its hold time.
+        """
+        if self.hold is None:
+            self.hold = seconds
+        else:
+            self.hold += self.smoothing * (seconds - self.hold)
+
+    def observe_timeout(self):
+        """Learn from an updates request that timed out."""
+        self.hold = self.updates_timeout()
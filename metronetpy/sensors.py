@@ -0,0 +1,265 @@
+"""The Metronet IESS Online bridge."""
+from collections import namedtuple
+from types import MappingProxyType, ModuleType
+from typing import Optional
+
+numpy: Optional[ModuleType]
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def changed_indices(bits, size):
+    """Return the indices of the bits set in an integer bitset of size bytes."""
+    if not bits:
+        return ()
+    if numpy is not None:
+        array = numpy.frombuffer(bits.to_bytes(size, "little"), numpy.uint8)
+        return tuple(
+            numpy.flatnonzero(numpy.unpackbits(array, bitorder="little")).tolist()
+        )
+    indices = []
+    while bits:
+        low = bits & -bits
+        indices.append(low.bit_length() - 1)
+        bits ^= low
+    return tuple(indices)
+
+
+class ChangeSet:
+    """The sensors changed by a poll.
+
+    Iterating yields (idx, active) tuples.
+    """
+
+    __slots__ = ("indices", "active")
+
+    def __init__(self, indices=(), active=0):
+        """Init for data, active is the bitset of active sensors."""
+        self.indices = indices
+        self.active = active
+
+    def __iter__(self):
+        """Iterate on (idx, active) tuples."""
+        active = self.active
+        for idx in self.indices:
+            yield idx, bool(active >> idx & 1)
+
+    def __len__(self):
+        """Return the number of changed sensors."""
+        return len(self.indices)
+
+    def __repr__(self):
+        """Return the changes representation."""
+        return repr(list(self))
+
+
+ChangeBatch = namedtuple("ChangeBatch", ["timestamp", "last_input", "changes"])
+ChangeBatch.__doc__ = """All the changes of a poll, a tuple of (idx, active) tuples."""
+
+
+class SensorSnapshot(
+    namedtuple(
+        "SensorSnapshot",
+        ["version", "timestamp", "last_input", "catalog", "known", "active"],
+    )
+):
+    """An immutable view of the sensors after a poll.
+
+    catalog is a read-only mapping of the sensor index to its (type, name),
+    shared by the snapshots until the sensor list changes; known and active
+    are the state bitsets. A new snapshot, with a greater version, replaces
+    the previous one after every poll, so that reading it needs no lock.
+    """
+
+    __slots__ = ()
+
+    def is_known(self, idx):
+        """Tell if the state of a sensor has been read."""
+        return bool(self.known >> idx & 1)
+
+    def is_active(self, idx):
+        """Tell if a sensor is active."""
+        return bool(self.active >> idx & 1)
+
+    def get(self, idx):
+        """Return a sensor as a dict, None if not configured."""
+        info = self.catalog.get(idx)
+        if info is None:
+            return None
+        return self._as_dict(idx, info)
+
+    def _as_dict(self, idx, info):
+        """Return the dict of a sensor, with active when its state is known."""
+        sensor = {"id": idx, "type": info[0], "name": info[1]}
+        if self.known >> idx & 1:
+            sensor["active"] = bool(self.active >> idx & 1)
+        return sensor
+
+    def as_dicts(self):
+        """Return the sensors as a list of dicts, like SensorTable.as_dicts."""
+        return [self._as_dict(idx, info) for idx, info in self.catalog.items()]
+
+    def __contains__(self, idx):
+        """Tell if a sensor is configured."""
+        return idx in self.catalog
+
+    def __len__(self):
+        """Return the number of configured sensors."""
+        return len(self.catalog)
+
+
+EMPTY_SNAPSHOT = SensorSnapshot(0, None, None, MappingProxyType({}), 0, 0)
+
+
+class SensorRecord:
+    """A configured sensor."""
+
+    __slots__ = ("id", "type", "name")
+
+    def __init__(self, idx, sensor_type=None, name=None):
+        """Init for data."""
+        self.id = idx  # pylint: disable=invalid-name
+        self.type = sensor_type
+        self.name = name
+
+    def as_dict(self):
+        """Return the sensor as a configuration dict."""
+        return {"id": self.id, "type": self.type, "name": self.name}
+
+
+class SensorTable:
+    """The sensors of a panel, keyed by the metronet input Index.
+
+    Sensor states are kept in integer bitsets: mask tells which indices are
+    configured, known which sensors have been read at least once and active
+    which of them are in alarm.
+    """
+
+    __slots__ = ("records", "size", "mask", "known", "active", "_catalog")
+
+    def __init__(self, sensors=None):
+        """Init for data, optionally loading a sensor configuration."""
+        self._catalog = None
+        self.records = {}
+        self.size = 0
+        self.mask = 0
+        self.known = 0
+        self.active = 0
+        if sensors:
+            self.load(sensors)
+
+    def load(self, sensors):
+        """Add the sensors of a configuration list of dicts."""
+        for sensor in sensors:
+            self.add(sensor["id"], sensor.get("type"), sensor.get("name"))
+
+    def add(self, idx, sensor_type=None, name=None):
+        """Add a sensor and return its record."""
+        record = SensorRecord(idx, sensor_type, name)
+        self.records[idx] = record
+        self._catalog = None
+        self.mask |= 1 << idx
+        self.size = max(self.size, (idx >> 3) + 1)
+        return record
+
+    def get(self, idx):
+        """Return the record of a sensor, None if not configured."""
+        return self.records.get(idx)
+
+    def set_name(self, idx, name):
+        """Change the name of a configured sensor."""
+        self.records[idx].name = name
+        self._catalog = None
+
+    def catalog(self):
+        """Return the read-only (type, name) mapping of the snapshots.
+
+        Built again only after the sensor list changed.
+        """
+        if self._catalog is None:
+            self._catalog = MappingProxyType(
+                {
+                    idx: (record.type, record.name)
+                    for idx, record in self.records.items()
+                }
+            )
+        return self._catalog
+
+    def snapshot(self, version, timestamp=None, last_input=None):
+        """Return a SensorSnapshot of the current states."""
+        return SensorSnapshot(
+            version, timestamp, last_input, self.catalog(), self.known, self.active
+        )
+
+    def is_known(self, idx):
+        """Tell if the state of a sensor has been read."""
+        return bool(self.known >> idx & 1)
+
+    def is_active(self, idx):
+        """Tell if a sensor is active."""
+        return bool(self.active >> idx & 1)
+
+    def set_active(self, idx, active):
+        """Store the state of a sensor."""
+        bit = 1 << idx
+        self.known |= bit
+        if active:
+            self.active |= bit
+        else:
+            self.active &= ~bit
+
+    def update(self, states):
+        """Apply the (idx, alarm) states read by a poll.
+
+        The states are decoded into bitmaps and XORed with the previous
+        ones, returns the ChangeSet of the sensors that changed.
+        Sensors read for the first time are not reported as changed.
+        """
+        size = self.size
+        limit = size << 3
+        seen = bytearray(size)
+        alarm = bytearray(size)
+        for idx, value in states:
+            if 0 <= idx < limit:
+                bit = 1 << (idx & 7)
+                seen[idx >> 3] |= bit
+                if value:
+                    alarm[idx >> 3] |= bit
+        polled = int.from_bytes(seen, "little") & self.mask
+        active = int.from_bytes(alarm, "little") & polled
+
+        changed = (active ^ self.active) & polled & self.known
+        self.active = (self.active & ~polled) | active
+        self.known |= polled
+        return ChangeSet(changed_indices(changed, size), self.active)
+
+    def as_dicts(self):
+        """Return the sensors as a list of dicts.
+
+        The active key is present only for sensors with a known state.
+        """
+        sensors = []
+        for idx, record in self.records.items():
+            sensor = record.as_dict()
+            if self.is_known(idx):
+                sensor["active"] = self.is_active(idx)
+            sensors.append(sensor)
+        return sensors
+
+    def __contains__(self, idx):
+        """Tell if a sensor is configured."""
+        return idx in self.records
+
+    def __iter__(self):
+        """Iterate on sensor records."""
+        return iter(self.records.values())
+
+    def __len__(self):
+        """Return the number of configured sensors."""
+        return len(self.records)
+
+    def __repr__(self):
+        """Return the sensors representation."""
+        return repr(self.as_dicts())
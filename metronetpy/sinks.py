@@ -0,0 +1,204 @@
+"""The Metronet IESS Online bridge.
+
+Sinks writing the sensor transitions as json lines. A sink is a batch
+callback: the polling loop only encodes the lines and appends them to a
+buffer, a writer thread writes the buffer once no event arrived for idle
+seconds, or once it holds max_buffer bytes.
+"""
+import json
+import logging
+import socket
+import sys
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+SINK_STDOUT = "-"
+SINK_UNIX = "unix:"
+
+
+class JsonLinesSink:
+    """Buffered json lines sink of the transitions of a bridge.
+
+    Every (idx, active) change of a ChangeBatch becomes a line with time,
+    sensor, active and input fields, plus account when given. Lines beyond
+    limit pending bytes are dropped, so that a stuck output never grows
+    the memory of the polling process.
+    """
+
+    def __init__(self, account=None, idle=0.05, max_buffer=65536, limit=16777216):
+        """Init for data, starting the writer thread."""
+        prefix = "{"
+        if account is not None:
+            prefix = '{"account":%s,' % json.dumps(account)
+        self._format = prefix + '"time":%r,"sensor":%d,"active":%s,"input":%s}\n'
+        self.idle = idle
+        self.max_buffer = max_buffer
+        self.limit = limit
+        self.events = 0
+        self.dropped = 0
+        self.writes = 0
+        self.errors = 0
+        self._buffer = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._writer, name="MetronetSink", daemon=True
+        )
+        self._thread.start()
+
+    def __call__(self, batch):
+        """Queue the lines of a ChangeBatch."""
+        last_input = json.dumps(batch.last_input)
+        data = "".join(
+            self._format
+            % (batch.timestamp, idx, "true" if active else "false", last_input)
+            for idx, active in batch.changes
+        ).encode()
+        count = len(batch.changes)
+        with self._cond:
+            if self._closed or self._size + len(data) > self.limit:
+                self.dropped += count
+                return
+            self._buffer.append(data)
+            self._size += len(data)
+            self.events += count
+            self._cond.notify()
+
+    def stats(self):
+        """Return the event, drop, write and error counters."""
+        return {
+            "events": self.events,
+            "dropped": self.dropped,
+            "writes": self.writes,
+            "errors": self.errors,
+            "pending": self._size,
+        }
+
+    def _take(self):
+        """Wait for the buffer to be idle or full and return its content.
+
+        Returns None once closed and empty.
+        """
+        with self._cond:
+            while not self._buffer and not self._closed:
+                self._cond.wait()
+            while not self._closed and self._size < self.max_buffer:
+                size = self._size
+                self._cond.wait(self.idle)
+                if self._size == size:
+                    break
+            if not self._buffer:
+                return None
+            data = b"".join(self._buffer)
+            self._buffer.clear()
+            self._size = 0
+            return data
+
+    def _writer(self):
+        """Write the buffer to the output until closed."""
+        while True:
+            data = self._take()
+            if data is None:
+                break
+            try:
+                self.write(data)
+                self.writes += 1
+            except OSError:
+                self.errors += 1
+                _LOGGER.warning("Could not write to %s", self, exc_info=True)
+        self.close_output()
+
+    def write(self, data):
+        """Write bytes to the output."""
+        raise NotImplementedError
+
+    def close_output(self):
+        """Close the output."""
+
+    def close(self):
+        """Write the pending lines and close the output."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+class StreamSink(JsonLinesSink):
+    """Sink writing to a binary stream, like sys.stdout.buffer."""
+
+    def __init__(self, stream, **kwargs):
+        """Init for data."""
+        self.stream = stream
+        super().__init__(**kwargs)
+
+    def write(self, data):
+        """Write and flush bytes."""
+        self.stream.write(data)
+        self.stream.flush()
+
+    def __str__(self):
+        """Return the sink name."""
+        return getattr(self.stream, "name", "stream")
+
+
+class FileSink(StreamSink):
+    """Sink appending to a file."""
+
+    def __init__(self, path, **kwargs):
+        """Init for data, opening the file, closed by close_output."""
+        # pylint: disable-next=consider-using-with
+        super().__init__(open(path, "ab"), **kwargs)
+
+    def close_output(self):
+        """Close the file."""
+        self.stream.close()
+
+
+class UnixSocketSink(JsonLinesSink):
+    """Sink writing to a listening unix stream socket.
+
+    The socket is connected on the first write and connected again after
+    an error, the lines of a failed write are lost.
+    """
+
+    def __init__(self, path, **kwargs):
+        """Init for data."""
+        self.path = path
+        self.sock = None
+        super().__init__(**kwargs)
+
+    def write(self, data):
+        """Send bytes, connecting when needed."""
+        try:
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.path)
+            self.sock.sendall(data)
+        except OSError:
+            self.close_output()
+            raise
+
+    def close_output(self):
+        """Close the socket."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __str__(self):
+        """Return the sink name."""
+        return f"{SINK_UNIX}{self.path}"
+
+
+def open_sink(spec, **kwargs):
+    """Return the sink of a spec.
+
+    - is the standard output, unix:PATH a unix socket and anything else
+    a file path.
+    """
+    if spec == SINK_STDOUT:
+        return StreamSink(sys.stdout.buffer, **kwargs)
+    if spec.startswith(SINK_UNIX):
+        return UnixSocketSink(spec[len(SINK_UNIX) :], **kwargs)
+    return FileSink(spec, **kwargs)
@@ -0,0 +1,295 @@
+"""The Metronet IESS Online bridge.
+
+A local stand-in of the metronet cloud, for load and latency testing.
+It implements the endpoints used by the Controller: the login page,
+the Status page and the strings, inputs and updates apis.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import parse_qs
+import uuid
+
+_LOGGER = logging.getLogger(__name__)
+
+INPUT_CLASS = 10
+AREA_CLASS = 9
+
+LOGIN_PAGE = b"<html><body><form method='post'></form></body></html>"
+STATUS_PAGE = """<html><head><script>
+var sessionId = '{session_id}';
+var lastInputId = '{last_input}';
+</script></head><body>Status</body></html>"""
+
+
+class StandInApp:
+    """The metronet stand-in application.
+
+    Holds the state of a simulated panel and answers the requests,
+    independently of the http server.
+    """
+
+    cookie_name = "auth"
+
+    def __init__(
+        self, inputs=32, accounts=None, latency=0.0, hold=25.0, session_ttl=None
+    ):
+        """Init for data.
+
+        accounts is a dict username -> password, when missing any
+        credential is accepted. latency is added to every response,
+        hold is the maximum duration of an updates long-poll and
+        session_ttl the lifetime in seconds of a login session.
+        """
+        self.inputs = [False] * inputs
+        self.accounts = accounts
+        self.latency = latency
+        self.hold = hold
+        self.session_ttl = session_ttl
+        self.cursor = 1
+        self.sessions = {}
+        self.cookies = {}
+        self.requests = 0
+        self._changed = threading.Condition()
+
+    def flip(self, index, alarm=None):
+        """Change the alarm state of an input and wake up the long-polls.
+
+        When alarm is None the state is toggled.
+        """
+        with self._changed:
+            if alarm is None:
+                alarm = not self.inputs[index]
+            self.inputs[index] = bool(alarm)
+            self.cursor += 1
+            self._changed.notify_all()
+
+    def expire_sessions(self):
+        """Invalidate every login session."""
+        with self._changed:
+            self.sessions.clear()
+            self.cookies.clear()
+            self._changed.notify_all()
+
+    def play(self, script, stop):
+        """Apply a list of (delay, index, alarm) changes until stop is set."""
+        for delay, index, alarm in script:
+            if stop.wait(delay):
+                return
+            self.flip(index, alarm)
+
+    def churn(self, rate, stop):
+        """Toggle random inputs, rate times per second, until stop is set."""
+        while not stop.wait(random.expovariate(rate)):
+            self.flip(random.randrange(len(self.inputs)))
+
+    def handle(self, method, path, form, cookie):
+        """Handle a request.
+
+        Returns a tuple with status, headers and body.
+        """
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if path == "/" and method == "GET":
+            return 200, {}, LOGIN_PAGE
+        if path == "/" and method == "POST":
+            return self._login(form)
+        if path == "/Status" and method == "GET":
+            session_id = self.cookies.get(cookie)
+            if not self._is_valid(session_id):
+                return 302, {"Location": "/"}, b""
+            page = STATUS_PAGE.format(session_id=session_id, last_input=self.cursor)
+            return 200, {"Content-Type": "text/html"}, page.encode()
+        if method != "POST" or not path.startswith("/api/"):
+            return 404, {}, b""
+        if not self._is_valid(form.get("sessionId")):
+            return 401, {}, b""
+        if path == "/api/strings":
+            return self._json(self._strings())
+        if path == "/api/inputs":
+            return self._json(self._inputs())
+        if path == "/api/updates":
+            changes = self._wait(form["sessionId"], form.get("Inputs"))
+            return self._json({"HasChanges": changes})
+        return 404, {}, b""
+
+    def _login(self, form):
+        """Create a session when credentials are valid."""
+        username = form.get("UserName")
+        if self.accounts is not None and (
+            username not in self.accounts
+            or self.accounts[username] != form.get("Password")
+        ):
+            return 200, {}, LOGIN_PAGE
+        session_id = str(uuid.uuid4())
+        cookie = uuid.uuid4().hex
+        with self._changed:
+            self.sessions[session_id] = time.monotonic()
+            self.cookies[cookie] = session_id
+        headers = {
+            "Location": "/Status",
+            "Set-Cookie": f"{self.cookie_name}={cookie}; Path=/",
+        }
+        return 302, headers, b""
+
+    def _is_valid(self, session_id):
+        """Tell if a session is still alive."""
+        created = self.sessions.get(session_id)
+        if created is None:
+            return False
+        if self.session_ttl is not None:
+            return time.monotonic() - created < self.session_ttl
+        return True
+
+    def _strings(self):
+        """Return the strings table."""
+        strings = [
+            {"Class": AREA_CLASS, "Index": idx, "Description": f"Area {idx + 1}"}
+            for idx in range(4)
+        ]
+        strings.extend(
+            {"Class": INPUT_CLASS, "Index": idx, "Description": f"Input {idx + 1}"}
+            for idx in range(len(self.inputs))
+        )
+        return strings
+
+    def _inputs(self):
+        """Return the inputs table."""
+        cursor = self.cursor
+        return [
+            {
+                "Index": idx,
+                "Alarm": alarm,
+                "Bypass": False,
+                "Fault": False,
+                "Id": cursor,
+            }
+            for idx, alarm in enumerate(self.inputs)
+        ]
+
+    def _wait(self, session_id, last_input):
+        """Long-poll until the cursor moves past last_input.
+
+        Returns early, without changes, if the session expires.
+        """
+        try:
+            last_input = int(last_input)
+        except (TypeError, ValueError):
+            return True
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.cursor > last_input or not self._is_valid(session_id),
+                self.hold,
+            )
+            return self.cursor > last_input
+
+    @staticmethod
+    def _json(data):
+        """Return a json response."""
+        return 200, {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Request handler forwarding to the StandInApp of the server."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle a GET request."""
+        self._handle("GET", {})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handle a POST request."""
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode()
+        form = {key: value[0] for key, value in parse_qs(body).items()}
+        self._handle("POST", form)
+
+    def _handle(self, method, form):
+        """Send the response of the app."""
+        cookie = None
+        for item in self.headers.get("Cookie", "").split(";"):
+            name, _, value = item.strip().partition("=")
+            if name == self.server.app.cookie_name:
+                cookie = value
+        path = self.path.split("?", 1)[0]
+        status, headers, body = self.server.app.handle(method, path, form, cookie)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests at debug level."""
+        _LOGGER.debug(format, *args)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """The metronet stand-in http server.
+
+    Runs in a separate thread, url is the base url for the Controller.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, app=None, host="127.0.0.1", port=0, churn=0.0, script=None):
+        """Init for data.
+
+        churn is the number of random input changes per second,
+        script a list of (delay, index, alarm) changes.
+        """
+        super().__init__((host, port), StandInHandler)
+        self.app = app or StandInApp()
+        self.churn = churn
+        self.script = script
+        self._stop = threading.Event()
+        self._workers = []
+
+    @property
+    def url(self):
+        """Return the base url of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """Start serving in separate threads."""
+        self._stop.clear()
+        targets = [(self.serve_forever, ())]
+        if self.churn:
+            targets.append((self.app.churn, (self.churn, self._stop)))
+        if self.script:
+            targets.append((self.app.play, (self.script, self._stop)))
+        for target, args in targets:
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            self._workers.append(thread)
+        _LOGGER.info("Stand-in listening on %s", self.url)
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self._stop.set()
+        self.shutdown()
+        self.server_close()
+        for thread in self._workers:
+            thread.join()
+        self._workers = []
+
+    def handle_error(self, request, client_address):
+        """Log errors, clients dropping a long-poll are expected."""
+        _LOGGER.debug("Stand-in request error from %s", client_address, exc_info=True)
+
+    def __enter__(self):
+        """Start the server in a with block."""
+        return self.start()
+
+    def __exit__(self, *exc):
+        """Stop the server at the end of a with block."""
+        self.stop()
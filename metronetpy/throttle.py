@@ -0,0 +1,153 @@
+"""The Metronet IESS Online bridge.
+
+Request budgets and the login circuit breaker, which keep the requests
+to metronet bounded while it is failing.
+"""
+import threading
+import time
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half-open"
+
+
+class TokenBucket:
+    """Token bucket of rate requests per second, up to burst at once.
+
+    Requests reserve a token and wait for it: the bucket may go in debt,
+    so that waiting callers are served in order of reservation. A bucket
+    can be shared by the budgets of many accounts.
+    """
+
+    def __init__(self, rate, burst=1.0):
+        """Init for data, the bucket starts full."""
+        if rate <= 0:
+            raise ValueError("The rate of a token bucket must be positive")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1.0):
+        """Take tokens, returns the seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RequestBudget:
+    """The request budget of an account, a token from every bucket.
+
+    Usually a bucket of the account and one shared by all the accounts.
+    """
+
+    def __init__(self, *buckets):
+        """Init for data."""
+        self.buckets = buckets
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def reserve(self):
+        """Reserve a request, returns the seconds to wait before sending it."""
+        delay = max((bucket.reserve() for bucket in self.buckets), default=0.0)
+        self.requests += 1
+        if delay > 0:
+            self.throttled += 1
+            self.waited += delay
+        return delay
+
+    def stats(self):
+        """Return the request, throttled and waited seconds counters."""
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "waited": self.waited,
+        }
+
+
+class CircuitBreaker:
+    """Circuit breaker of the logins.
+
+    After threshold failed logins in a row the breaker opens and logins
+    are rejected without a request. Once reset seconds have passed one
+    probe login is let through (half-open): a success closes the breaker,
+    a failure opens it again for twice the time, up to max_reset.
+    """
+
+    def __init__(self, threshold=5, reset=30.0, max_reset=900.0):
+        """Init for data."""
+        self.threshold = threshold
+        self.reset = reset
+        self.max_reset = max_reset
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self.probes = 0
+        self._timeout = reset
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def retry_in(self):
+        """Return the seconds until the next probe, 0 when not open."""
+        if self.state != BREAKER_OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self._timeout - time.monotonic())
+
+    def allow(self):
+        """Tell if a login may be attempted now."""
+        with self._lock:
+            if self.state == BREAKER_OPEN and self.retry_in() == 0:
+                self.state = BREAKER_HALF_OPEN
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_HALF_OPEN and not self._probing:
+                self._probing = True
+                self.probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success):
+        """Account the result of an allowed login."""
+        with self._lock:
+            probe, self._probing = self._probing, False
+            if success:
+                self.state = BREAKER_CLOSED
+                self.failures = 0
+                self._timeout = self.reset
+                return
+            self.failures += 1
+            if probe:
+                self._timeout = min(self.max_reset, self._timeout * 2)
+                self._open()
+            elif self.state == BREAKER_CLOSED and self.failures >= self.threshold:
+                self._open()
+
+    def _open(self):
+        """Open the breaker."""
+        self.state = BREAKER_OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+
+    def stats(self):
+        """Return the breaker state and counters, as numbers."""
+        return {
+            "open": int(self.state == BREAKER_OPEN),
+            "half_open": int(self.state == BREAKER_HALF_OPEN),
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "probes": self.probes,
+            "retry_in": self.retry_in(),
+        }
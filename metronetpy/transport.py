@@ -0,0 +1,370 @@
+"""The Metronet IESS Online bridge.
+
+Transports carry the http requests of the Controller. A transport keeps
+the cookies and headers of a metronet session and a pool of keep-alive
+connections, which survives new sessions (a relogin) so that the
+updates/inputs cycle runs on the same connection.
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import json
+import socket
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import ReadTimeoutError
+
+from .decoder import CHUNK_SIZE
+
+# (connect, read) timeouts in seconds of each endpoint. The read timeout
+# of the updates long-poll is given by the scheduler.
+ENDPOINT_TIMEOUTS = {
+    "home": (5.0, 15.0),
+    "login": (5.0, 30.0),
+    "strings": (5.0, 30.0),
+    "inputs": (5.0, 10.0),
+    "updates": (5.0, 30.0),
+}
+
+# Seconds an idle pooled connection is kept open.
+KEEPALIVE = 60
+
+# Probe idle connections, so that the ones dropped by a NAT during a
+# long-poll are detected.
+SOCKET_OPTIONS = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+for _name, _value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+    if hasattr(socket, _name):
+        SOCKET_OPTIONS.append((socket.IPPROTO_TCP, getattr(socket, _name), _value))
+
+
+class TransportTimeout(Exception):
+    """A request did not complete in time."""
+
+
+class TransportConnectTimeout(TransportTimeout):
+    """The connection of a request was not established in time.
+
+    Unlike a read timeout, the request never reached the server.
+    """
+
+
+class Transport:
+    """Base class of the transports.
+
+    A transport sends the requests of a Controller and returns response
+    objects with status, url, text(), json(), iter_chunks() and close().
+    Responses are context managers closing the response at the end.
+    """
+
+    def __init__(self, timeouts=None):
+        """Init for data.
+
+        timeouts overrides the (connect, read) timeouts of some endpoints.
+        """
+        self.timeouts = dict(ENDPOINT_TIMEOUTS, **(timeouts or {}))
+        self.requests = 0
+
+    def timeout(self, endpoint, read=None):
+        """Return the (connect, read) timeout of an endpoint.
+
+        read overrides the read timeout of the endpoint.
+        """
+        connect, default = self.timeouts.get(endpoint, ENDPOINT_TIMEOUTS["home"])
+        return connect, default if read is None else read
+
+    def connections(self):
+        """Return the number of connections opened so far."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return requests and connection reuse statistics."""
+        connections = self.connections()
+        return {
+            "requests": self.requests,
+            "connections": connections,
+            "reused": max(0, self.requests - connections),
+        }
+
+    def open(self):
+        """Start a new session, with no cookies and the default headers."""
+        raise NotImplementedError
+
+    def update_headers(self, headers):
+        """Add headers to every request of the session."""
+        raise NotImplementedError
+
+    def get_cookies(self):
+        """Return the cookies of the session as a list of dicts."""
+        raise NotImplementedError
+
+    def set_cookies(self, cookies, url):
+        """Add cookies, as returned by get_cookies, to the session.
+
+        url is the base url the cookies are sent to.
+        """
+        raise NotImplementedError
+
+    def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Send a request and return the response.
+
+        endpoint selects the timeouts, read overrides the read timeout and
+        stream leaves the body to be read by iter_chunks. Raises
+        TransportTimeout when a timeout expires, TransportConnectTimeout
+        when it is the connect timeout.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Close the session and the pooled connections."""
+        raise NotImplementedError
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """Http adapter enabling tcp keep-alive probes on its connections."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager with the keep-alive socket options."""
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + list(
+            SOCKET_OPTIONS
+        )
+        super().init_poolmanager(*args, **kwargs)
+
+
+class RequestsResponse:
+    """Response of the requests transport."""
+
+    __slots__ = ("response",)
+
+    def __init__(self, response):
+        """Init for data."""
+        self.response = response
+
+    @property
+    def status(self):
+        """Return the status code."""
+        return self.response.status_code
+
+    @property
+    def url(self):
+        """Return the url, after the redirects."""
+        return self.response.url
+
+    def text(self):
+        """Return the body as text."""
+        return self.response.text
+
+    def json(self):
+        """Return the body decoded from json."""
+        return self.response.json()
+
+    def iter_chunks(self):
+        """Iterate on the chunks of the body."""
+        try:
+            yield from self.response.iter_content(CHUNK_SIZE)
+        except requests.exceptions.ConnectionError as err:
+            # requests reports a read timeout of a streamed body this way.
+            if err.args and isinstance(err.args[0], ReadTimeoutError):
+                raise TransportTimeout(str(err)) from err
+            raise
+
+    def close(self):
+        """Release the connection to the pool."""
+        self.response.close()
+
+    def __enter__(self):
+        """Return the response in a with block."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close the response at the end of a with block."""
+        self.close()
+
+
+class RequestsTransport(Transport):
+    """Transport on a requests session with a tuned connection pool.
+
+    The pool keeps pool_size connections per host, enough for the updates
+    long-poll and the inputs request of a Controller. Requests are not
+    retried by the pool, the Controller has its own retry policy.
+    """
+
+    def __init__(self, timeouts=None, pool_size=2):
+        """Init for data."""
+        super().__init__(timeouts)
+        self.adapter = KeepAliveAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=0
+        )
+        self.session = None
+
+    def connections(self):
+        """Return the number of connections opened so far."""
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def open(self):
+        """Start a new session, with no cookies and the default headers."""
+        if self.session is None:
+            self.session = requests.Session()
+            self.session.mount("http://", self.adapter)
+            self.session.mount("https://", self.adapter)
+        self.session.cookies.clear()
+        self.session.headers = requests.utils.default_headers()
+
+    def update_headers(self, headers):
+        """Add headers to every request of the session."""
+        self.session.headers.update(headers)
+
+    def get_cookies(self):
+        """Return the cookies of the session as a list of dicts."""
+        if self.session is None:
+            return []
+        return [
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+            }
+            for cookie in self.session.cookies
+        ]
+
+    def set_cookies(self, cookies, url):
+        """Add cookies, as returned by get_cookies, to the session."""
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie["domain"],
+                path=cookie["path"],
+            )
+
+    def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Send a request and return the response."""
+        self.requests += 1
+        try:
+            resp = self.session.request(
+                method,
+                url,
+                data=data,
+                stream=stream,
+                timeout=self.timeout(endpoint, read),
+            )
+        except requests.exceptions.ConnectTimeout as err:
+            raise TransportConnectTimeout(str(err)) from err
+        except requests.exceptions.Timeout as err:
+            raise TransportTimeout(str(err)) from err
+        return RequestsResponse(resp)
+
+    def close(self):
+        """Close the session and the pooled connections."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+class MemoryResponse:
+    """Response of the in-memory transport."""
+
+    __slots__ = ("status", "url", "body")
+
+    def __init__(self, status, url, body):
+        """Init for data."""
+        self.status = status
+        self.url = url
+        self.body = body
+
+    def text(self):
+        """Return the body as text."""
+        return self.body.decode()
+
+    def json(self):
+        """Return the body decoded from json."""
+        return json.loads(self.body)
+
+    def iter_chunks(self):
+        """Iterate on the chunks of the body."""
+        for start in range(0, len(self.body), CHUNK_SIZE):
+            yield self.body[start : start + CHUNK_SIZE]
+
+    def close(self):
+        """Nothing to release."""
+
+    def __enter__(self):
+        """Return the response in a with block."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close the response at the end of a with block."""
+
+
+class MemoryTransport(Transport):
+    """Transport calling a metronet application in the same process.
+
+    app is a StandInApp, or any object with the same handle method and
+    cookie_name attribute. No connection is opened, redirects are
+    followed as requests does and the read timeouts are honoured.
+    """
+
+    def __init__(self, app, timeouts=None, workers=4):
+        """Init for data."""
+        super().__init__(timeouts)
+        self.app = app
+        self.headers = {}
+        self.cookies = {}
+        self._domain = None
+        self._executor = ThreadPoolExecutor(workers, "MetronetMemory")
+
+    def connections(self):
+        """Return the number of connections opened so far."""
+        return 0
+
+    def open(self):
+        """Start a new session, with no cookies and the default headers."""
+        self.headers = {}
+        self.cookies = {}
+
+    def update_headers(self, headers):
+        """Add headers to every request of the session."""
+        self.headers.update(headers)
+
+    def get_cookies(self):
+        """Return the cookies of the session as a list of dicts."""
+        return [
+            {"name": name, "value": value, "domain": self._domain, "path": "/"}
+            for name, value in self.cookies.items()
+        ]
+
+    def set_cookies(self, cookies, url):
+        """Add cookies, as returned by get_cookies, to the session."""
+        self._domain = urlsplit(url).hostname
+        for cookie in cookies:
+            self.cookies[cookie["name"]] = cookie["value"]
+
+    def call(self, method, url, data):
+        """Run a request, following the redirects, and return the response."""
+        self._domain = urlsplit(url).hostname
+        while True:
+            cookie = self.cookies.get(self.app.cookie_name)
+            path = urlsplit(url).path or "/"
+            status, headers, body = self.app.handle(method, path, data or {}, cookie)
+            if "Set-Cookie" in headers:
+                name, _, value = headers["Set-Cookie"].split(";", 1)[0].partition("=")
+                self.cookies[name.strip()] = value
+            if status not in (301, 302, 303) or "Location" not in headers:
+                return MemoryResponse(status, url, body)
+            method, data = "GET", None
+            url = urljoin(url, headers["Location"])
+
+    def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Send a request and return the response."""
+        self.requests += 1
+        future = self._executor.submit(self.call, method, url, data)
+        try:
+            return future.result(self.timeout(endpoint, read)[1])
+        except FutureTimeout as err:
+            raise TransportTimeout(f"{endpoint} timed out") from err
+
+    def close(self):
+        """Forget the session, a request still waiting is abandoned."""
+        self.open()
@@ -0,0 +1,95 @@
+"""The Metronet IESS Online bridge.
+
+Waits for sensor changes. The polling loop wakes the waiters right after
+publishing the snapshot of a poll, so that a waiting thread or task uses
+no cpu until one of its sensors changes.
+"""
+import logging
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ChangeWaiter:
+    """A wait for a change of some sensors.
+
+    sensor_ids is a sensor index or a collection of them, None for any
+    sensor. predicate, when given, is called on the polling thread as
+    predicate(snapshot, changes) with the SensorSnapshot and the ChangeSet
+    of a poll that changed one of the sensors, and ends the wait when it
+    returns True; it must be quick. With sensor_ids None it is evaluated
+    on every poll that changed any sensor.
+    """
+
+    def __init__(self, sensor_ids=None, predicate=None):
+        """Init for data."""
+        if isinstance(sensor_ids, int):
+            sensor_ids = (sensor_ids,)
+        self.sensor_ids = None if sensor_ids is None else frozenset(sensor_ids)
+        self.predicate = predicate
+        self.snapshot = None
+        self.error = None
+
+    def wake(self, snapshot, changes):
+        """Check the ChangeSet of a poll, returns True when the wait ends."""
+        if self.sensor_ids is not None and self.sensor_ids.isdisjoint(changes.indices):
+            return False
+        if self.predicate is not None:
+            try:
+                if not self.predicate(snapshot, changes):
+                    return False
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.exception("Could not evaluate the wait predicate")
+                self.error = err
+        self.snapshot = snapshot
+        self.done()
+        return True
+
+    def cancel(self):
+        """End the wait without a snapshot."""
+        self.done()
+
+    def done(self):
+        """Wake the waiting thread or task."""
+        raise NotImplementedError
+
+
+class ThreadWaiter(ChangeWaiter):
+    """Waiter blocking a thread."""
+
+    def __init__(self, sensor_ids=None, predicate=None):
+        """Init for data."""
+        super().__init__(sensor_ids, predicate)
+        self._event = threading.Event()
+
+    def done(self):
+        """Wake the waiting thread."""
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """Return the snapshot ending the wait, None on timeout or cancel.
+
+        Raises the exception of the predicate, if any.
+        """
+        self._event.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.snapshot
+
+
+class FutureWaiter(ChangeWaiter):
+    """Waiter of an asyncio task, woken from the event loop of the future."""
+
+    def __init__(self, loop, sensor_ids=None, predicate=None):
+        """Init for data."""
+        super().__init__(sensor_ids, predicate)
+        self.future = loop.create_future()
+
+    def done(self):
+        """Resolve the future."""
+        if self.future.done():
+            return
+        if self.error is not None:
+            self.future.set_exception(self.error)
+        else:
+            self.future.set_result(self.snapshot)
@@ -25,6 +25,7 @@ setuptools.setup(
         "Development Status :: 3 - Alpha",
     ],
     python_requires=">=3.7",
-    install_requires=["requests", "pyyaml", "sslkeylog"],
+    install_requires=["aiohttp", "requests", "pyyaml", "sslkeylog"],
+    extras_require={"speedups": ["msgspec", "numpy", "orjson"]},
     scripts=["metronet"],
 )
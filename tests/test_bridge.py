@@ -0,0 +1,208 @@
+"""Tests of the bridges, on the in-memory stand-in."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from metronetpy.aiobridge import AsyncMetronetBridge
+from metronetpy.aiotransport import AsyncMemoryTransport
+from metronetpy.bridge import MetronetBridge
+from metronetpy.journal import Journal
+from metronetpy.standin import StandInApp
+from metronetpy.transport import MemoryTransport
+
+URL = "http://standin/"
+
+
+def start_bridge(app):
+    """Return a connected bridge running its main loop."""
+    bridge = MetronetBridge("u", "p", base_url=URL, transport=MemoryTransport(app))
+    assert bridge.connect()
+    bridge.get_sensors()
+    bridge.main_loop()
+    return bridge
+
+
+async def start_async_bridge(app):
+    """Return a connected async bridge running its main loop."""
+    bridge = AsyncMetronetBridge(
+        "u", "p", base_url=URL, transport=AsyncMemoryTransport(app)
+    )
+    assert await bridge.connect()
+    await bridge.get_sensors()
+    bridge.main_loop()
+    return bridge
+
+
+def test_wait_request_stop():
+    """wait returns once a stop is requested."""
+    bridge = start_bridge(StandInApp(inputs=4, hold=0.2))
+    try:
+        assert not bridge.wait(0.1)
+        threading.Timer(0.1, bridge.request_stop).start()
+        assert bridge.wait(5)
+    finally:
+        bridge.stop()
+    assert bridge.wait(0)
+
+
+def test_async_wait():
+    """The async wait does not block the event loop."""
+
+    async def main():
+        bridge = await start_async_bridge(StandInApp(inputs=4, hold=0.2))
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        assert not await bridge.wait(0.1)
+        threading.Timer(0.2, bridge.request_stop).start()
+        start = time.monotonic()
+        assert await bridge.wait(5)
+        assert time.monotonic() - start < 2
+        ticker.cancel()
+        await bridge.stop()
+        assert await bridge.wait(0)
+        return ticks
+
+    assert asyncio.run(main()) > 10
+
+
+def test_async_wait_loop_end():
+    """The async wait returns when the main loop task ends."""
+
+    async def main():
+        bridge = await start_async_bridge(StandInApp(inputs=4, hold=0.2))
+        waiting = asyncio.ensure_future(bridge.wait())
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        await bridge.stop()
+        return await asyncio.wait_for(waiting, 5)
+
+    assert asyncio.run(main())
+
+
+def test_wait_for_change():
+    """wait_for_change returns the snapshot of a change of its sensors."""
+    app = StandInApp(inputs=4, hold=0.2)
+    bridge = start_bridge(app)
+    try:
+        assert bridge.wait_for_change(2, timeout=0.1) is None
+        threading.Timer(0.1, app.flip, (1, True)).start()
+        threading.Timer(0.3, app.flip, (2, True)).start()
+        snapshot = bridge.wait_for_change([2, 3], timeout=5)
+        assert snapshot.is_active(1) and snapshot.is_active(2)
+        assert bridge.snapshot().version >= snapshot.version
+        assert not bridge.controller.waiters
+    finally:
+        bridge.stop()
+
+
+def test_wait_for_change_predicate():
+    """The predicate gets the snapshot and the changes of every poll."""
+    app = StandInApp(inputs=4, hold=0.2)
+    bridge = start_bridge(app)
+    seen = []
+
+    def predicate(snapshot, changes):
+        seen.append(list(changes))
+        return snapshot.is_active(0) and snapshot.is_active(3)
+
+    try:
+        threading.Timer(0.1, app.flip, (0, True)).start()
+        threading.Timer(0.3, app.flip, (3, True)).start()
+        snapshot = bridge.wait_for_change(predicate=predicate, timeout=5)
+        assert snapshot.is_active(3)
+        assert seen == [[(0, True)], [(3, True)]]
+    finally:
+        bridge.stop()
+
+
+def test_wait_for_change_error():
+    """The exception of the predicate is raised to the waiting thread."""
+    app = StandInApp(inputs=4, hold=0.2)
+    bridge = start_bridge(app)
+
+    def predicate(snapshot, changes):
+        raise KeyError(snapshot.version)
+
+    try:
+        threading.Timer(0.1, app.flip, (1, True)).start()
+        with pytest.raises(KeyError):
+            bridge.wait_for_change(1, predicate, timeout=5)
+    finally:
+        bridge.stop()
+
+
+def test_wait_for_change_stop():
+    """The waits without timeout end when the bridge stops."""
+    bridge = start_bridge(StandInApp(inputs=4, hold=0.2))
+    result = []
+    waiting = threading.Thread(target=lambda: result.append(bridge.wait_for_change()))
+    waiting.start()
+    time.sleep(0.1)
+    bridge.stop()
+    waiting.join(5)
+    assert result == [None]
+
+
+def test_async_wait_for_change():
+    """The async wait_for_change is resolved by the main loop task."""
+    app = StandInApp(inputs=4, hold=0.2)
+
+    async def main():
+        bridge = await start_async_bridge(app)
+        loop = asyncio.get_running_loop()
+        try:
+            assert await bridge.wait_for_change(2, timeout=0.1) is None
+            loop.call_later(0.1, app.flip, 1, True)
+            loop.call_later(0.3, app.flip, 2, True)
+            snapshot = await bridge.wait_for_change({2}, timeout=5)
+            assert snapshot.is_active(1) and snapshot.is_active(2)
+            loop.call_later(0.1, app.flip, 0, True)
+            with pytest.raises(ZeroDivisionError):
+                await bridge.wait_for_change(predicate=lambda s, c: 1 / 0, timeout=5)
+            assert not bridge.controller.waiters
+            waiting = asyncio.ensure_future(bridge.wait_for_change())
+            await asyncio.sleep(0.1)
+        finally:
+            await bridge.stop()
+        return await asyncio.wait_for(waiting, 5)
+
+    assert asyncio.run(main()) is None
+
+
+def test_stop_closes_journal(tmp_path):
+    """stop closes the journal, the transitions are on disk."""
+    app = StandInApp(inputs=4, hold=0.2)
+    bridge = start_bridge(app)
+    bridge.set_journal(Journal(str(tmp_path)))
+    try:
+        threading.Timer(0.1, app.flip, (2, True)).start()
+        assert bridge.wait_for_change(2, timeout=5)
+    finally:
+        bridge.stop()
+    assert bridge.controller.journal is None
+    journal = Journal(str(tmp_path))
+    try:
+        assert [item.active for item in journal.history(2)] == [True]
+    finally:
+        journal.close()
+
+
+def test_async_stop_closes_journal(tmp_path):
+    """The async stop closes the journal too."""
+
+    async def main():
+        bridge = await start_async_bridge(StandInApp(inputs=4, hold=0.2))
+        bridge.set_journal(Journal(str(tmp_path)))
+        await bridge.stop()
+        return bridge
+
+    assert asyncio.run(main()).controller.journal is None
@@ -0,0 +1,205 @@
+"""Tests of the on-disk caches."""
+import os
+import stat
+
+from metronetpy.cache import CatalogCache, ConfigCache, SessionCache
+from metronetpy.iess import Controller
+from metronetpy.standin import StandInApp
+from metronetpy.transport import (
+    MemoryTransport,
+    TransportConnectTimeout,
+    TransportTimeout,
+)
+
+URL = "http://standin/"
+SESSION = {
+    "cookies": [{"name": "auth", "value": "c", "domain": "standin", "path": "/"}],
+    "session_id": "s",
+    "last_input": "7",
+}
+
+
+def test_session_round_trip(tmp_path):
+    """A saved session is loaded back, in a file private to the owner."""
+    cache = SessionCache(str(tmp_path))
+    assert cache.load("u", URL) is None
+    cache.save("u", URL, SESSION)
+    assert cache.load("u", URL) == dict(SESSION, version=1)
+    assert cache.load("other", URL) is None
+    assert cache.load("u", "http://elsewhere/") is None
+    assert stat.S_IMODE(os.stat(cache.path("u", URL)).st_mode) == 0o600
+
+
+def test_session_invalidation(tmp_path):
+    """Removed, corrupt and old version sessions are not loaded."""
+    cache = SessionCache(str(tmp_path))
+    cache.save("u", URL, SESSION)
+    cache.remove("u", URL)
+    cache.remove("u", URL)
+    assert cache.load("u", URL) is None
+    path = cache.path("u", URL)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("{not json")
+    assert cache.load("u", URL) is None
+    with open(path, "w", encoding="utf-8") as file:
+        file.write('{"version": 0, "session_id": "s"}')
+    assert cache.load("u", URL) is None
+
+
+def controller(app, directory):
+    """Return a controller of the stand-in with a session cache."""
+    controller = Controller("u", "p", URL, MemoryTransport(app))
+    controller.session_cache = SessionCache(directory)
+    return controller
+
+
+def test_resume(tmp_path):
+    """A new controller resumes the cached session without a login."""
+    app = StandInApp(inputs=4, hold=1)
+    first = controller(app, str(tmp_path))
+    assert not first.resume()
+    first.init_session()
+    assert first.login()
+    first.save_session()
+    second = controller(app, str(tmp_path))
+    assert second.resume()
+    assert second.session_id == first.session_id
+    assert second.metrics.relogins.value == 0
+
+
+def test_resume_expired(tmp_path):
+    """An expired cached session is not resumed."""
+    app = StandInApp(inputs=4, hold=1)
+    first = controller(app, str(tmp_path))
+    first.init_session()
+    assert first.login()
+    first.save_session()
+    app.expire_sessions()
+    assert not controller(app, str(tmp_path)).resume()
+
+
+class TimeoutTransport(MemoryTransport):
+    """In-memory transport whose updates requests time out."""
+
+    def __init__(self, app, error):
+        """Init for data."""
+        super().__init__(app)
+        self.error = error
+
+    def request(self, method, endpoint, url, data=None, stream=False, read=None):
+        """Raise the error on the updates requests."""
+        if endpoint == "updates":
+            raise self.error(f"{endpoint} timed out")
+        return super().request(method, endpoint, url, data, stream, read)
+
+
+def test_resume_timeouts(tmp_path):
+    """A read timeout keeps the cached session, a connect timeout does not."""
+    app = StandInApp(inputs=4, hold=1)
+    first = controller(app, str(tmp_path))
+    first.init_session()
+    assert first.login()
+    first.save_session()
+    for error, valid in ((TransportTimeout, True), (TransportConnectTimeout, False)):
+        second = controller(app, str(tmp_path))
+        second.transport = TimeoutTransport(app, error)
+        assert second.resume() is valid
+
+
+CATALOG = [[0, "Door"], [1, "Window"]]
+
+
+def test_catalog_round_trip(tmp_path):
+    """A saved catalog is loaded back, written again only when changed."""
+    cache = CatalogCache(str(tmp_path))
+    assert cache.load("u", URL) is None
+    assert cache.save("u", URL, CATALOG)
+    assert cache.load("u", URL) == [(0, "Door"), (1, "Window")]
+    mtime = os.stat(cache.path("u", URL)).st_mtime_ns
+    assert not cache.save("u", URL, CATALOG)
+    assert os.stat(cache.path("u", URL)).st_mtime_ns == mtime
+    assert cache.save("u", URL, CATALOG + [[2, "Hall"]])
+    assert len(cache.load("u", URL)) == 3
+
+
+def test_catalog_invalidation(tmp_path):
+    """Corrupt and old version catalogs are not loaded."""
+    cache = CatalogCache(str(tmp_path))
+    cache.save("u", URL, CATALOG)
+    path = cache.path("u", URL)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write('{"version": 0, "catalog": []}')
+    assert cache.load("u", URL) is None
+    assert cache.save("u", URL, CATALOG)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("[")
+    assert cache.load("u", URL) is None
+
+
+def test_catalog_refresh(tmp_path):
+    """A cached catalog is used at start and refreshed from metronet."""
+    app = StandInApp(inputs=3, hold=1)
+    cache = CatalogCache(str(tmp_path))
+    cache.save("u", URL, [[0, "Old name"]])
+    controller = Controller("u", "p", URL, MemoryTransport(app))
+    controller.catalog_cache = cache
+    assert controller.load_catalog()
+    assert controller.refresh_pending
+    assert [sensor["name"] for sensor in controller.get_sensors()] == ["Old name"]
+    controller.init_session()
+    assert controller.login()
+    controller.refresh_catalog()
+    assert not controller.refresh_pending
+    assert len(cache.load("u", URL)) == 3
+    assert cache.load("u", URL)[0] == (0, "Input 1")
+
+
+class Parser:
+    """Configuration parser counting its calls."""
+
+    def __init__(self):
+        """Init for data."""
+        self.calls = 0
+
+    def __call__(self, content):
+        """Parse lines of key=value."""
+        self.calls += 1
+        return dict(line.split("=") for line in content.decode().split())
+
+
+def test_config_cache(tmp_path):
+    """A configuration is parsed again only when its content changed."""
+    config = tmp_path / "config.txt"
+    config.write_text("a=1\n", encoding="utf-8")
+    cache = ConfigCache(str(tmp_path / "cache"))
+    parse = Parser()
+    assert cache.load(str(config), parse) == {"a": "1"}
+    assert cache.load(str(config), parse) == {"a": "1"}
+    assert parse.calls == 1
+    os.utime(config, ns=(1, 1))
+    assert cache.load(str(config), parse) == {"a": "1"}
+    assert parse.calls == 1
+    config.write_text("a=2\n", encoding="utf-8")
+    assert cache.load(str(config), parse) == {"a": "2"}
+    assert parse.calls == 2
+
+
+def test_config_cache_invalid(tmp_path):
+    """Corrupt cache files are ignored, unsupported data is not cached."""
+    config = tmp_path / "config.txt"
+    config.write_text("a=1\n", encoding="utf-8")
+    cache = ConfigCache(str(tmp_path / "cache"))
+    parse = Parser()
+    cache.load(str(config), parse)
+    with open(cache.path(str(config)), "wb") as file:
+        file.write(b"MNC1garbage")
+    assert cache.load(str(config), parse) == {"a": "1"}
+    assert parse.calls == 2
+
+    def parse_object(content):
+        return {"value": object()}
+
+    other = tmp_path / "other.txt"
+    other.write_text("b=1\n", encoding="utf-8")
+    assert "value" in cache.load(str(other), parse_object)
+    assert not os.path.exists(cache.path(str(other)))
@@ -0,0 +1,62 @@
+"""Tests of the domain index of the config entries."""
+import pytest
+
+pytest.importorskip("homeassistant")
+
+# pylint: disable=wrong-import-position
+from config_entries import ConfigEntries, ConfigEntry  # noqa: E402
+
+
+def make_entry(domain, entry_id):
+    """Return a config entry of a domain."""
+    return ConfigEntry(
+        version=1,
+        domain=domain,
+        title=entry_id,
+        data={},
+        source="user",
+        connection_class="unknown",
+        system_options={},
+        entry_id=entry_id,
+    )
+
+
+@pytest.fixture(name="entries")
+def fixture_entries():
+    """Return the entries of two domains, without a Home Assistant instance."""
+    manager = ConfigEntries.__new__(ConfigEntries)
+    manager._entries = {}  # pylint: disable=protected-access
+    manager._domain_index = {}  # pylint: disable=protected-access
+    for domain, entry_id in [("hue", "a"), ("metronet", "b"), ("hue", "c")]:
+        manager._async_add_entry(  # pylint: disable=protected-access
+            make_entry(domain, entry_id)
+        )
+    return manager
+
+
+def test_add(entries):
+    """The entries are listed by domain in insertion order."""
+    assert entries.async_domains() == ["hue", "metronet"]
+    assert [entry.entry_id for entry in entries.async_entries()] == ["a", "b", "c"]
+    assert [entry.entry_id for entry in entries.async_entries("hue")] == ["a", "c"]
+    assert entries.async_entries("zwave") == []
+    assert entries.async_get_entry("b").domain == "metronet"
+    assert entries.async_get_entry("x") is None
+
+
+def test_remove(entries):
+    """A domain leaves the index with its last entry."""
+    entries._async_remove_entry(  # pylint: disable=protected-access
+        entries.async_get_entry("a")
+    )
+    assert [entry.entry_id for entry in entries.async_entries("hue")] == ["c"]
+    entries._async_remove_entry(  # pylint: disable=protected-access
+        entries.async_get_entry("b")
+    )
+    assert entries.async_domains() == ["hue"]
+    assert entries.async_entries("metronet") == []
+    assert entries.async_get_entry("b") is None
+    entries._async_add_entry(  # pylint: disable=protected-access
+        make_entry("metronet", "d")
+    )
+    assert entries.async_domains() == ["hue", "metronet"]
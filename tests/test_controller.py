@@ -0,0 +1,131 @@
+"""Tests of the polling controllers, on the in-memory stand-in."""
+import asyncio
+
+import pytest
+
+from metronetpy.aioiess import AsyncController
+from metronetpy.aiotransport import AsyncMemoryTransport
+from metronetpy.dispatch import Dispatcher
+from metronetpy.iess import Controller
+from metronetpy.standin import StandInApp
+from metronetpy.transport import MemoryTransport
+
+URL = "http://standin/"
+
+
+class BadUpdatesApp(StandInApp):
+    """Stand-in answering the updates api with a body given by the test."""
+
+    def __init__(self, body, **kwargs):
+        """Init for data."""
+        super().__init__(**kwargs)
+        self.body = body
+
+    def handle(self, method, path, form, cookie):
+        """Answer the updates of a valid session with the body."""
+        if path == "/api/updates" and self._is_valid(form.get("sessionId")):
+            return self._json(self.body)
+        return super().handle(method, path, form, cookie)
+
+
+def connect(controller):
+    """Login a controller and read its sensors."""
+    controller.init_session()
+    assert controller.login()
+    controller.get_strings()
+    controller.get_inputs()
+    return controller
+
+
+@pytest.mark.parametrize("body", [{"Error": "x"}, [], {"HasChanges": None}])
+def test_updates_error_reply(body):
+    """An updates reply without HasChanges logs in again."""
+    app = BadUpdatesApp(body, inputs=4, hold=1)
+    controller = connect(Controller("u", "p", URL, MemoryTransport(app)))
+    assert controller.get_updates() is True
+    assert controller.metrics.relogins.value == 1
+    assert controller.metrics.exceptions.value == 0
+
+
+@pytest.mark.parametrize("body", [{"Error": "x"}, []])
+def test_async_updates_error_reply(body):
+    """The async controller also logs in again."""
+
+    async def main():
+        app = BadUpdatesApp(body, inputs=4, hold=1)
+        controller = AsyncController(
+            "u", "p", base_url=URL, transport=AsyncMemoryTransport(app)
+        )
+        await controller.init_session()
+        assert await controller.login()
+        assert await controller.get_updates() is True
+        await controller.close()
+        return controller
+
+    controller = asyncio.run(main())
+    assert controller.metrics.relogins.value == 1
+
+
+def polled(sensors=4):
+    """Return a controller of sensors whose states have been read once."""
+    controller = Controller("u", "p", URL, MemoryTransport(StandInApp(sensors)))
+    controller.set_sensors([{"id": idx, "name": str(idx)} for idx in range(sensors)])
+    controller.process_inputs([(idx, False) for idx in range(sensors)], 1)
+    return controller
+
+
+def test_batch_callbacks():
+    """A batch callback gets every change of a poll at once."""
+    controller = polled()
+    batches = []
+    controller.batch_callbacks.append(batches.append)
+    controller.process_inputs([(0, True), (1, False), (2, True), (3, False)], 2)
+    controller.process_inputs([(0, True), (1, False), (2, True), (3, False)], 3)
+    assert len(batches) == 1
+    assert batches[0].changes == ((0, True), (2, True))
+    assert batches[0].last_input == 2
+
+
+def test_batch_callback_error():
+    """A failing batch callback does not stop the next ones."""
+    controller = polled()
+    batches = []
+
+    def fail(batch):
+        raise RuntimeError("boom")
+
+    controller.batch_callbacks.extend([fail, batches.append])
+    controller.process_inputs([(1, True)], 2)
+    assert [batch.changes for batch in batches] == [((1, True),)]
+    assert controller.metrics.exceptions.value == 1
+
+
+def test_batch_callbacks_dispatcher():
+    """With a dispatcher the batches are delivered by its workers."""
+    controller = polled()
+    batches = []
+    controller.batch_callbacks.append(batches.append)
+    controller.dispatcher = Dispatcher()
+    controller.dispatcher.start()
+    for value in (True, False, True):
+        controller.process_inputs([(3, value)])
+    controller.dispatcher.stop()
+    assert [batch.changes for batch in batches] == [
+        ((3, True),),
+        ((3, False),),
+        ((3, True),),
+    ]
+
+
+def test_snapshot_versions():
+    """Every poll publishes a new snapshot, the old ones never change."""
+    controller = polled()
+    first = controller.snapshot
+    controller.process_inputs([(1, True)], 2)
+    second = controller.snapshot
+    assert second.version == first.version + 1
+    assert second.last_input == 2 and second.is_active(1)
+    assert first.last_input == 1 and not first.is_active(1)
+    controller.process_inputs([(1, True)], 3)
+    assert controller.snapshot.version == second.version + 1
+    assert controller.get_sensors() == controller.snapshot.as_dicts()
@@ -0,0 +1,152 @@
+"""Tests of the incremental decoders."""
+import json
+
+import pytest
+
+from metronetpy import decoder as decoder_module
+from metronetpy.decoder import (
+    BACKEND_MSGSPEC,
+    BACKEND_ORJSON,
+    BACKEND_STREAM,
+    InputsDecoder,
+    StringsDecoder,
+    decode,
+    default_backend,
+)
+
+INPUTS = [
+    {"Index": 1, "Alarm": False, "Id": 10},
+    {"Index": 2, "Alarm": True, "Id": 11, "Extra": {"a": [1, {"b": "}"}]}},
+    {"Index": 3, "Alarm": True, "Id": 12, "Note": 'brace { and "quote"'},
+    {"Index": 4, "Alarm": False, "Id": 13, "Zones": []},
+]
+
+STRINGS = [
+    {"Class": 10, "Index": 1, "Description": "Door"},
+    {"Class": 10, "Index": 2, "Description": "Window", "Area": {"Id": 1}},
+    {"Class": 11, "Index": 3, "Description": "Area"},
+    {"Class": 10, "Index": 4, "Description": "Hall {1}"},
+]
+
+
+def chunks(body, size):
+    """Split a body in chunks of size bytes."""
+    return [body[pos : pos + size] for pos in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1024])
+def test_inputs_nested(size):
+    """Nested objects are decoded like the whole body backends."""
+    body = json.dumps(INPUTS, indent=1).encode()
+    decoder = InputsDecoder(backend=BACKEND_STREAM)
+    assert decode(decoder, chunks(body, size)) == [
+        (1, False),
+        (2, True),
+        (3, True),
+        (4, False),
+    ]
+    assert decoder.last_id == 13
+
+
+@pytest.mark.parametrize("size", [1, 5, 1024])
+def test_inputs_wanted(size):
+    """Only the wanted inputs are kept, flat or nested."""
+    body = json.dumps(INPUTS).encode()
+    decoder = InputsDecoder(wanted={2, 3}, backend=BACKEND_STREAM)
+    assert decode(decoder, chunks(body, size)) == [(2, True), (3, True)]
+    assert decoder.last_id == 13
+
+
+def test_inputs_last_nested():
+    """The Id of a nested last input is read."""
+    body = json.dumps(INPUTS[:2]).encode()
+    decoder = InputsDecoder(backend=BACKEND_STREAM)
+    decode(decoder, [body])
+    assert decoder.last_id == 11
+
+
+def test_inputs_string_index():
+    """A string Index is converted, an invalid one raises ValueError."""
+    body = b'[{"Index": "5", "Alarm": true, "Id": 1}]'
+    assert decode(InputsDecoder(backend=BACKEND_STREAM), [body]) == [(5, True)]
+    body = b'[{"Index": "five", "Alarm": true, "Id": 1}]'
+    with pytest.raises(ValueError):
+        decode(InputsDecoder(backend=BACKEND_STREAM), [body])
+
+
+@pytest.mark.parametrize("size", [1, 4, 1024])
+def test_strings_nested(size):
+    """Nested strings are decoded, the other classes dropped."""
+    body = json.dumps(STRINGS).encode()
+    decoder = StringsDecoder(backend=BACKEND_STREAM)
+    assert decode(decoder, chunks(body, size)) == [
+        (1, "Door"),
+        (2, "Window"),
+        (4, "Hall {1}"),
+    ]
+
+
+def test_strings_string_class():
+    """A string Class and Index are read from the decoded object."""
+    body = b'[{"Class": "10", "Index": "2", "Description": "Door"}]'
+    assert decode(StringsDecoder(backend=BACKEND_STREAM), [body]) == [(2, "Door")]
+
+
+@pytest.mark.parametrize("body", [b"[]", b" [ ] ", b"[\n]\n"])
+def test_empty(body):
+    """An empty array has no records."""
+    decoder = InputsDecoder(backend=BACKEND_STREAM)
+    assert decode(decoder, chunks(body, 1)) == []
+    assert decoder.last_id is None
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'[{"Index": 1, "Alarm": true, "Id": 1}, {"Index": 2, "Al',
+        b'[{"Index": 1, "Alarm": true, "Extra": {"a": 1}',
+        b'[{"Index": 1, "Alarm": true, "Id": 1}, 7]',
+        b"<html>Error</html>",
+    ],
+)
+def test_invalid(body):
+    """A truncated or invalid body raises ValueError."""
+    with pytest.raises(ValueError):
+        decode(InputsDecoder(backend=BACKEND_STREAM), chunks(body, 4))
+
+
+def test_default_backend():
+    """The default backend decodes nested objects too."""
+    body = json.dumps(INPUTS).encode()
+    decoder = InputsDecoder(backend=default_backend())
+    assert decode(decoder, [body]) == [(1, False), (2, True), (3, True), (4, False)]
+    assert decoder.last_id == 13
+
+
+@pytest.mark.parametrize("backend", [BACKEND_MSGSPEC, BACKEND_ORJSON])
+def test_backends(backend):
+    """The whole body backends keep the same records."""
+    pytest.importorskip(backend)
+    body = json.dumps(STRINGS).encode()
+    assert decode(StringsDecoder(backend=backend), chunks(body, 7)) == [
+        (1, "Door"),
+        (2, "Window"),
+        (4, "Hall {1}"),
+    ]
+    decoder = InputsDecoder(wanted={2}, backend=backend)
+    assert decode(decoder, [json.dumps(INPUTS).encode()]) == [(2, True)]
+    assert decoder.last_id == 13
+
+
+@pytest.mark.parametrize("backend", [BACKEND_MSGSPEC, BACKEND_ORJSON])
+def test_backend_missing(monkeypatch, backend):
+    """A backend that is not installed raises ValueError."""
+    monkeypatch.setattr(decoder_module, backend, None)
+    with pytest.raises(ValueError):
+        InputsDecoder(backend=backend)
+
+
+def test_backend_unknown():
+    """An unknown backend raises ValueError."""
+    with pytest.raises(ValueError):
+        StringsDecoder(backend="simplejson")
@@ -0,0 +1,162 @@
+"""Tests of the callback dispatchers."""
+import asyncio
+import random
+import threading
+import time
+
+import pytest
+
+from metronetpy.dispatch import (
+    OVERFLOW_BLOCK,
+    OVERFLOW_COALESCE,
+    OVERFLOW_DROP_OLDEST,
+    AsyncDispatcher,
+    Dispatcher,
+)
+
+
+def recorder():
+    """Return a list and a callback appending its arguments to it."""
+    calls = []
+    return calls, lambda *args: calls.append(args)
+
+
+def test_unknown_overflow():
+    """An unknown overflow policy is rejected."""
+    with pytest.raises(ValueError):
+        Dispatcher(overflow="spill")
+
+
+def test_drop_oldest():
+    """A full partition discards its oldest event."""
+    calls, func = recorder()
+    dispatcher = Dispatcher(maxsize=2, overflow=OVERFLOW_DROP_OLDEST)
+    for value in range(3):
+        dispatcher.submit(1, [func], 1, value)
+    dispatcher.start()
+    dispatcher.stop()
+    assert calls == [(1, 1), (1, 2)]
+    assert dispatcher.stats()["dropped"] == 1
+    assert dispatcher.stats()["max_depth"] == 2
+
+
+def test_coalesce():
+    """A pending event of the same key is replaced, not queued again."""
+    calls, func = recorder()
+    dispatcher = Dispatcher(maxsize=10, overflow=OVERFLOW_COALESCE)
+    dispatcher.submit(1, [func], 1, True)
+    dispatcher.submit(2, [func], 2, True)
+    dispatcher.submit(1, [func], 1, False)
+    dispatcher.submit(None, [func], "batch")
+    dispatcher.submit(None, [func], "batch")
+    dispatcher.start()
+    dispatcher.stop()
+    assert calls == [(1, False), (2, True), ("batch",), ("batch",)]
+    assert dispatcher.stats()["coalesced"] == 1
+
+
+def test_coalesce_full():
+    """Coalescing drops the oldest event when the key is not pending."""
+    calls, func = recorder()
+    dispatcher = Dispatcher(maxsize=2, overflow=OVERFLOW_COALESCE)
+    for key in range(3):
+        dispatcher.submit(key, [func], key)
+    dispatcher.submit(0, [func], 0)
+    dispatcher.start()
+    dispatcher.stop()
+    assert calls == [(2,), (0,)]
+    assert dispatcher.stats()["dropped"] == 2
+
+
+def test_block():
+    """The producer waits for room in a full partition."""
+    calls, func = recorder()
+    dispatcher = Dispatcher(maxsize=1, overflow=OVERFLOW_BLOCK)
+    dispatcher.running = True
+    dispatcher.submit(1, [func], 1)
+    producer = threading.Thread(target=dispatcher.submit, args=(1, [func], 2))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive()
+    dispatcher.start()
+    producer.join(5)
+    assert not producer.is_alive()
+    dispatcher.stop()
+    assert calls == [(1,), (2,)]
+    assert dispatcher.stats()["dropped"] == 0
+
+
+def test_ordering_per_sensor():
+    """The events of a sensor are dispatched in order by many workers."""
+    seen = {}
+    lock = threading.Lock()
+
+    def func(key, value):
+        time.sleep(random.random() / 1000)
+        with lock:
+            seen.setdefault(key, []).append(value)
+
+    dispatcher = Dispatcher(workers=4, maxsize=1000)
+    dispatcher.start()
+    for value in range(50):
+        for key in range(8):
+            dispatcher.submit(key, [func], key, value)
+    dispatcher.stop()
+    assert seen == {key: list(range(50)) for key in range(8)}
+    assert dispatcher.stats()["dispatched"] == 400
+
+
+def test_callback_error():
+    """A failing callback does not stop the worker."""
+    calls, func = recorder()
+
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    dispatcher = Dispatcher()
+    dispatcher.start()
+    dispatcher.submit(1, [fail, func], 1)
+    dispatcher.submit(1, [func], 2)
+    dispatcher.stop()
+    assert calls == [(1,), (2,)]
+
+
+def test_async_dispatcher():
+    """Plain and coroutine callbacks are awaited in order per key."""
+    seen = []
+
+    async def coro(key, value):
+        await asyncio.sleep(0)
+        seen.append((key, value))
+
+    async def main():
+        dispatcher = AsyncDispatcher(workers=2, maxsize=100)
+        dispatcher.start()
+        for value in range(5):
+            dispatcher.submit(1, [coro], 1, value)
+            dispatcher.submit(2, [lambda *args: seen.append(args)], 2, value)
+        await dispatcher.stop()
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    assert [value for key, value in seen if key == 1] == list(range(5))
+    assert [value for key, value in seen if key == 2] == list(range(5))
+    assert dispatcher.stats()["dispatched"] == 10
+
+
+def test_async_wait_space():
+    """wait_space returns once the workers made room."""
+    calls, func = recorder()
+
+    async def main():
+        dispatcher = AsyncDispatcher(maxsize=2, overflow=OVERFLOW_BLOCK)
+        dispatcher.start()
+        for value in range(6):
+            await dispatcher.wait_space()
+            dispatcher.submit(1, [func], value)
+        await dispatcher.stop()
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    assert calls == [(value,) for value in range(6)]
+    assert dispatcher.stats()["max_depth"] <= 2
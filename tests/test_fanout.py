@@ -0,0 +1,110 @@
+"""Tests of the fan-out server and client."""
+import queue
+import socket
+import time
+
+from metronetpy.fanout import MAX_FAILURES, FanoutClient, FanoutServer
+from metronetpy.scheduler import PollScheduler
+from metronetpy.sensors import ChangeBatch, SensorTable
+
+
+class FakeBridge:
+    """The part of a bridge used by the fan-out server."""
+
+    def __init__(self):
+        """Init for data."""
+        self.table = SensorTable([{"id": idx, "name": str(idx)} for idx in range(4)])
+        self.batch_callbacks = []
+
+    def register_batch_callback(self, func):
+        """Store a batch callback."""
+        self.batch_callbacks.append(func)
+
+    def snapshot(self):
+        """Return the snapshot of the sensors."""
+        return self.table.snapshot(1, last_input=7)
+
+    def poll(self, changes):
+        """Apply (idx, active) changes and call the batch callbacks."""
+        for idx, active in changes:
+            self.table.set_active(idx, active)
+        batch = ChangeBatch(time.time(), 8, tuple(changes))
+        for func in self.batch_callbacks:
+            func(batch)
+
+
+def free_address():
+    """Return a tcp address nobody listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return "127.0.0.1:%d" % sock.getsockname()[1]
+
+
+def test_resync_unknown_state():
+    """Sensors of unknown state are skipped, changed ones notified."""
+    client = FanoutClient()
+    batches = []
+    client.register_batch_callback(batches.append)
+    client.resync(
+        {"input": 1, "sensors": [{"id": 1, "active": True}, {"id": 2}, {"id": 3}]}
+    )
+    assert client.states == {1: True}
+    assert not batches
+    client.resync(
+        {
+            "input": 2,
+            "sensors": [
+                {"id": 1, "active": False},
+                {"id": 2, "active": True},
+                {"id": 3},
+            ],
+        }
+    )
+    assert client.states == {1: False, 2: True}
+    assert [batch.changes for batch in batches] == [((1, False),)]
+    assert client.last_input == 2
+
+
+def test_subscribe():
+    """A subscribed client gets the sensors and then the changes."""
+    bridge = FakeBridge()
+    bridge.table.set_active(0, True)
+    server = FanoutServer(bridge, free_address()).start()
+    host, port = server.server_address
+    client = FanoutClient(f"{host}:{port}")
+    changes = queue.Queue()
+    client.register_callback(2, lambda idx, active: changes.put((idx, active)))
+    try:
+        assert [sensor.get("active") for sensor in client.get_sensors()] == [
+            True,
+            None,
+            None,
+            None,
+        ]
+        client.main_loop()
+        for _ in range(100):
+            if server.stats()["subscribers"]:
+                break
+            time.sleep(0.02)
+        bridge.poll([(2, True)])
+        assert changes.get(timeout=5) == (2, True)
+        assert client.last_input == 8
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_long_outage():
+    """The failure count of a client stays bounded while the server is down."""
+    scheduler = PollScheduler(base=0.001, maximum=0.001, jitter=0)
+    client = FanoutClient(free_address(), timeout=1.0, scheduler=scheduler)
+    client.main_loop()
+    try:
+        deadline = time.monotonic() + 10
+        while client.failures < MAX_FAILURES and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        assert client.failures == MAX_FAILURES
+        assert client._thread.is_alive()  # pylint: disable=protected-access
+    finally:
+        client.stop()
@@ -0,0 +1,68 @@
+"""Tests of the hub driving many accounts."""
+import asyncio
+import queue
+import time
+
+from metronetpy.hub import MetronetHub
+from metronetpy.standin import StandInApp, StandInServer
+
+
+class BrokenUpdatesApp(StandInApp):
+    """Stand-in answering the updates api with a body that is not json."""
+
+    def handle(self, method, path, form, cookie):
+        """Answer the updates with an error page."""
+        if path == "/api/updates":
+            return 200, {"Content-Type": "application/json"}, b"<html>"
+        return super().handle(method, path, form, cookie)
+
+
+def accounts(good, bad):
+    """Return the accounts a on the good server and b on the bad one."""
+    return [
+        {"username": "a", "password": "p", "url": good.url},
+        {"username": "b", "password": "p", "url": bad.url},
+    ]
+
+
+def test_failing_account():
+    """An account failing its updates does not stop the other ones."""
+    app = StandInApp(inputs=4, hold=1)
+    with StandInServer(app) as good, StandInServer(BrokenUpdatesApp(4)) as bad:
+        hub = MetronetHub(accounts(good, bad))
+        changes = queue.Queue()
+        hub.register_callback("a", 2, lambda idx, active: changes.put(active))
+        assert hub.start(timeout=10) == {"a": True, "b": True}
+        try:
+            time.sleep(0.5)
+            app.flip(2, True)
+            assert changes.get(timeout=5) is True
+            time.sleep(1.5)
+            app.flip(2, False)
+            assert changes.get(timeout=5) is False
+            assert hub.controllers["b"].failures > 0
+            assert hub.controllers["b"].run
+        finally:
+            hub.stop()
+        assert hub.controllers["a"].transport.session is None
+
+
+def test_stop_async_run():
+    """stop ends an async_run awaited directly."""
+
+    async def main(hub):
+        run = asyncio.ensure_future(hub.async_run())
+        for _ in range(100):
+            if hub.logged_in:
+                break
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)
+        hub.stop()
+        await asyncio.wait_for(run, 5)
+        return hub.logged_in
+
+    with StandInServer(StandInApp(inputs=4, hold=5)) as good:
+        with StandInServer(StandInApp(inputs=4, hold=5)) as other:
+            hub = MetronetHub(accounts(good, other))
+            assert asyncio.run(main(hub)) == {"a": True, "b": True}
+    assert not any(controller.run for controller in hub.controllers.values())
@@ -0,0 +1,68 @@
+"""Tests of the journal of sensor transitions."""
+import pytest
+
+from metronetpy.journal import NO_ID, Journal, account_id
+
+
+@pytest.fixture(name="journal")
+def fixture_journal(tmp_path):
+    """Return a journal of small segments."""
+    journal = Journal(str(tmp_path), segment_records=4)
+    yield journal
+    journal.close()
+
+
+def test_history(journal):
+    """The transitions of a sensor are returned in order."""
+    journal.append("a", [(1, True), (2, True)], "10", timestamp=100.0)
+    journal.append("a", [(1, False)], "11", timestamp=101.0)
+    history = journal.history(1)
+    assert [(item.timestamp, item.active, item.input_id) for item in history] == [
+        (100.0, True, 10),
+        (101.0, False, 11),
+    ]
+    assert history[0].account == account_id("a")
+    assert journal.history(1, since=100.5)[0].timestamp == 101.0
+    assert journal.history(3) == []
+
+
+def test_history_rotation(journal):
+    """A history spans the segments and skips the older ones."""
+    for step in range(10):
+        journal.append("a", [(1, step % 2 == 0), (2, True)], step, 100.0 + step)
+    assert journal.segments() == [0, 1, 2, 3, 4]
+    history = journal.history(1)
+    assert [item.timestamp for item in history] == [100.0 + step for step in range(10)]
+    assert [item.active for item in history] == [step % 2 == 0 for step in range(10)]
+    history = journal.history(1, since=105.5)
+    assert [item.input_id for item in history] == [6, 7, 8, 9]
+
+
+def test_history_account(journal):
+    """A history can be restricted to an account."""
+    journal.append("a", [(1, True)], timestamp=100.0)
+    journal.append("b", [(1, False)], "x", timestamp=101.0)
+    history = journal.history(1, account="b")
+    assert [(item.active, item.input_id) for item in history] == [(False, NO_ID)]
+    assert len(journal.history(1)) == 2
+
+
+def test_reopen(tmp_path):
+    """A journal opened again appends to its last segment."""
+    journal = Journal(str(tmp_path), segment_records=4)
+    journal.append("a", [(1, True), (1, False), (1, True)], timestamp=100.0)
+    journal.close()
+    journal = Journal(str(tmp_path), segment_records=4)
+    try:
+        journal.append("a", [(1, False), (1, True)], timestamp=101.0)
+        assert journal.segments() == [0, 1]
+        assert len(journal.history(1)) == 5
+    finally:
+        journal.close()
+
+
+def test_not_a_segment(tmp_path):
+    """A segment file with another format is rejected."""
+    (tmp_path / "00000000.mnj").write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        Journal(str(tmp_path))
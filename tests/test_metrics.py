@@ -0,0 +1,75 @@
+"""Tests of the metrics registry."""
+from urllib.request import urlopen
+
+import pytest
+
+from metronetpy.metrics import MetricsRegistry, MetricsServer, PollMetrics
+
+
+def test_counter():
+    """Counters add their increments."""
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests")
+    counter.inc()
+    counter.inc(2)
+    assert registry.collect() == {"requests_total": 3}
+
+
+def test_duplicate():
+    """A metric name is registered once."""
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests")
+    with pytest.raises(ValueError):
+        registry.histogram("requests_total", "Requests")
+
+
+def test_histogram():
+    """Histograms count cumulative buckets, sum, average and maximum."""
+    histogram = MetricsRegistry().histogram("hold", "Hold", buckets=(1.0, 10.0))
+    for value in (0.5, 1.0, 5.0, 50.0):
+        histogram.observe(value)
+    data = histogram.collect()
+    assert data["buckets"] == {1.0: 2, 10.0: 3}
+    assert data["count"] == 4
+    assert data["sum"] == 56.5
+    assert data["avg"] == 14.125
+    assert data["max"] == 50.0
+
+
+def test_prometheus():
+    """The text format has the samples of every metric and the gauges."""
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc()
+    family = registry.histogram("callback", "Callbacks", "sensor", buckets=(1.0,))
+    family.labels(3).observe(0.5)
+    text = registry.prometheus({"account": 'a"b'}, {"pool": {"connections": 2}})
+    lines = text.splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{account="a\\"b"} 1' in lines
+    assert 'callback_bucket{account="a\\"b",sensor="3",le="1.0"} 1' in lines
+    assert 'callback_bucket{account="a\\"b",sensor="3",le="+Inf"} 1' in lines
+    assert 'callback_count{account="a\\"b",sensor="3"} 1' in lines
+    assert 'pool_connections{account="a\\"b"} 2' in lines
+
+
+def test_poll_metrics():
+    """The polling metrics are all collected."""
+    metrics = PollMetrics()
+    metrics.updates.inc()
+    metrics.callbacks.labels(1).observe(0.01)
+    data = metrics.collect()
+    assert data["metronet_updates_total"] == 1
+    assert data["metronet_callback_seconds"][1]["count"] == 1
+    assert data["metronet_updates_hold_seconds"]["count"] == 0
+
+
+def test_metrics_server():
+    """The server answers /metrics with the text of its source."""
+    server = MetricsServer(lambda: "up 1\n", port=0).start()
+    host, port = server.server_address[:2]
+    try:
+        with urlopen(f"http://{host}:{port}/metrics", timeout=5) as resp:
+            assert resp.read() == b"up 1\n"
+            assert resp.headers["Content-Type"].startswith("text/plain")
+    finally:
+        server.stop()
@@ -0,0 +1,14 @@
+"""Tests of the package exports."""
+import pytest
+
+import metronetpy
+
+
+def test_lazy_exports():
+    """The bridges are imported on first access."""
+    from metronetpy.bridge import MetronetBridge
+
+    assert metronetpy.MetronetBridge is MetronetBridge
+    assert set(metronetpy.__all__) <= set(dir(metronetpy))
+    with pytest.raises(AttributeError):
+        metronetpy.Missing  # pylint: disable=pointless-statement
@@ -0,0 +1,74 @@
+"""Tests of the polling scheduler."""
+import pytest
+
+from metronetpy.scheduler import PollScheduler
+
+
+def test_backoff_exponential():
+    """Without jitter the delay doubles up to the maximum."""
+    scheduler = PollScheduler(jitter=0)
+    delays = [scheduler.backoff(attempt) for attempt in range(1, 9)]
+    assert delays == [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 60.0, 60.0]
+
+
+@pytest.mark.parametrize("attempt", [1025, 1100, 10**6, 10**12])
+def test_backoff_long_outage(attempt):
+    """The failures of a long outage do not overflow the delay."""
+    assert PollScheduler(jitter=0).backoff(attempt) == 60.0
+    assert PollScheduler(base=1, factor=2, jitter=0).backoff(attempt) == 60
+
+
+def test_backoff_base_above_maximum():
+    """The maximum caps a base larger than it."""
+    assert PollScheduler(base=90.0, jitter=0).backoff(1) == 60.0
+
+
+@pytest.mark.parametrize("attempt", [1, 3, 7, 5000])
+def test_backoff_jitter_bounds(attempt):
+    """The jitter stays within its fraction of the delay."""
+    scheduler = PollScheduler(jitter=0.2)
+    delay = PollScheduler(jitter=0).backoff(attempt)
+    for _ in range(500):
+        assert delay * 0.8 <= scheduler.backoff(attempt) <= delay * 1.2
+
+
+def test_backoff_jitter_never_negative():
+    """A jitter above 1 does not give negative delays."""
+    scheduler = PollScheduler(jitter=1.5)
+    assert all(scheduler.backoff(2) >= 0 for _ in range(500))
+
+
+def test_updates_timeout_default():
+    """The timeout is the default one until a hold time is observed."""
+    assert PollScheduler(timeout=30.0).updates_timeout() == 30.0
+
+
+def test_updates_timeout_learned():
+    """The timeout follows the moving average of the hold time."""
+    scheduler = PollScheduler(margin=1.25, smoothing=0.5)
+    scheduler.observe_hold(20.0)
+    assert scheduler.updates_timeout() == 25.0
+    scheduler.observe_hold(40.0)
+    assert scheduler.hold == 30.0
+    assert scheduler.updates_timeout() == 37.5
+
+
+def test_updates_timeout_bounds():
+    """The learned timeout stays between its bounds."""
+    scheduler = PollScheduler(min_timeout=10.0, max_timeout=120.0)
+    scheduler.observe_hold(1.0)
+    assert scheduler.updates_timeout() == 10.0
+    scheduler = PollScheduler(min_timeout=10.0, max_timeout=120.0)
+    scheduler.observe_hold(500.0)
+    assert scheduler.updates_timeout() == 120.0
+
+
+def test_observe_timeout():
+    """A timeout grows the hold time to the timeout, up to the bound."""
+    scheduler = PollScheduler(margin=1.25, max_timeout=120.0)
+    scheduler.observe_hold(40.0)
+    scheduler.observe_timeout()
+    assert scheduler.hold == 50.0
+    for _ in range(20):
+        scheduler.observe_timeout()
+    assert scheduler.updates_timeout() == 120.0
@@ -0,0 +1,138 @@
+"""Tests of the sensor table."""
+import pytest
+
+from metronetpy import sensors
+from metronetpy.sensors import SensorTable
+
+SENSORS = [
+    {"id": 0, "type": "door", "name": "Door"},
+    {"id": 3, "type": "window", "name": "Window"},
+    {"id": 17, "type": "pir", "name": "Hall"},
+]
+
+
+def test_load():
+    """The configured sensors are kept by index."""
+    table = SensorTable(SENSORS)
+    assert len(table) == 3
+    assert 3 in table and 4 not in table
+    assert table.get(17).name == "Hall"
+    assert table.get(4) is None
+    assert table.size == 3
+    assert [record.id for record in table] == [0, 3, 17]
+
+
+def test_states():
+    """States are unknown until set."""
+    table = SensorTable(SENSORS)
+    assert not table.is_known(3)
+    table.set_active(3, True)
+    assert table.is_known(3) and table.is_active(3)
+    table.set_active(3, False)
+    assert table.is_known(3) and not table.is_active(3)
+
+
+def test_as_dicts():
+    """The active key is present only for the sensors with a known state."""
+    table = SensorTable(SENSORS)
+    table.set_active(17, True)
+    assert table.as_dicts() == [
+        {"id": 0, "type": "door", "name": "Door"},
+        {"id": 3, "type": "window", "name": "Window"},
+        {"id": 17, "type": "pir", "name": "Hall", "active": True},
+    ]
+
+
+def test_catalog():
+    """The catalog is shared until the sensor list changes."""
+    table = SensorTable(SENSORS)
+    catalog = table.catalog()
+    assert table.catalog() is catalog
+    assert catalog[3] == ("window", "Window")
+    table.set_name(3, "Kitchen")
+    assert table.catalog() is not catalog
+    assert table.catalog()[3] == ("window", "Kitchen")
+    table.add(40, "smoke", "Smoke")
+    assert 40 in table.catalog()
+    assert table.size == 6
+
+
+def test_update_first_read():
+    """Sensors read for the first time are not reported as changed."""
+    table = SensorTable(SENSORS)
+    changes = table.update([(0, True), (3, False), (17, False)])
+    assert list(changes) == []
+    assert table.is_active(0) and not table.is_active(3)
+
+
+def test_update_diff():
+    """Only the sensors whose state changed are reported."""
+    table = SensorTable(SENSORS)
+    table.update([(0, True), (3, False), (17, False)])
+    changes = table.update([(0, False), (3, False), (17, True)])
+    assert list(changes) == [(0, False), (17, True)]
+    assert len(changes) == 2
+    assert list(table.update([(0, False), (3, False), (17, True)])) == []
+
+
+def test_update_partial():
+    """Sensors missing from a poll keep their state."""
+    table = SensorTable(SENSORS)
+    table.update([(0, True), (3, True), (17, True)])
+    changes = table.update([(3, False)])
+    assert list(changes) == [(3, False)]
+    assert table.is_active(0) and table.is_active(17)
+
+
+def test_update_unconfigured():
+    """States of sensors that are not configured are ignored."""
+    table = SensorTable(SENSORS)
+    table.update([(0, False), (1, True), (5000, True), (-1, True)])
+    assert not table.is_known(1)
+    assert list(table.update([(0, True), (1, False)])) == [(0, True)]
+
+
+def test_changed_indices_backends(monkeypatch):
+    """numpy and the pure python loop find the same indices."""
+    bits = 1 | 1 << 9 | 1 << 63 | 1 << 200
+    expected = (0, 9, 63, 200)
+    assert sensors.changed_indices(bits, 26) == expected
+    monkeypatch.setattr(sensors, "numpy", None)
+    assert sensors.changed_indices(bits, 26) == expected
+    assert sensors.changed_indices(0, 26) == ()
+
+
+def test_snapshot():
+    """A snapshot keeps the states of the table when it was taken."""
+    table = SensorTable(SENSORS)
+    table.set_active(3, True)
+    snapshot = table.snapshot(1, 100.0, 7)
+    table.update([(3, False), (17, True)])
+    assert snapshot.version == 1 and snapshot.last_input == 7
+    assert snapshot.is_known(3) and snapshot.is_active(3)
+    assert not snapshot.is_known(17)
+    assert snapshot.get(3) == {
+        "id": 3,
+        "type": "window",
+        "name": "Window",
+        "active": True,
+    }
+    assert snapshot.get(4) is None
+    assert 17 in snapshot and len(snapshot) == 3
+    assert snapshot.as_dicts()[0] == {"id": 0, "type": "door", "name": "Door"}
+    assert not table.snapshot(2).is_active(3)
+
+
+def test_snapshot_catalog():
+    """The snapshots share the catalog until the sensor list changes."""
+    table = SensorTable(SENSORS)
+    first = table.snapshot(1)
+    table.update([(0, True)])
+    assert table.snapshot(2).catalog is first.catalog
+    table.set_name(0, "Front door")
+    renamed = table.snapshot(3)
+    assert renamed.catalog is not first.catalog
+    assert renamed.get(0)["name"] == "Front door"
+    assert first.get(0)["name"] == "Door"
+    with pytest.raises(TypeError):
+        first.catalog[0] = ("door", "Back door")
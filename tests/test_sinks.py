@@ -0,0 +1,103 @@
+"""Tests of the json lines sinks."""
+import io
+import json
+import os
+import socket
+import threading
+
+from metronetpy.sensors import ChangeBatch
+from metronetpy.sinks import FileSink, StreamSink, UnixSocketSink, open_sink
+
+BATCH = ChangeBatch(100.5, "7", ((1, True), (2, False)))
+
+
+def lines(data):
+    """Return the decoded json lines of bytes."""
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def test_stream_sink():
+    """Every change of a batch is a json line."""
+    stream = io.BytesIO()
+    sink = StreamSink(stream, account="home", idle=0.01)
+    sink(BATCH)
+    sink.close()
+    assert lines(stream.getvalue()) == [
+        {"account": "home", "time": 100.5, "sensor": 1, "active": True, "input": "7"},
+        {"account": "home", "time": 100.5, "sensor": 2, "active": False, "input": "7"},
+    ]
+    assert sink.stats()["events"] == 2
+    assert sink.stats()["pending"] == 0
+
+
+def test_buffered_writes():
+    """Events arriving together are written at once."""
+    stream = io.BytesIO()
+    sink = StreamSink(stream, idle=0.5)
+    for _ in range(10):
+        sink(BATCH)
+    sink.close()
+    assert len(lines(stream.getvalue())) == 20
+    assert sink.stats()["writes"] == 1
+
+
+def test_limit():
+    """Lines beyond the limit of pending bytes are dropped."""
+    stream = io.BytesIO()
+    sink = StreamSink(stream, idle=1.0, limit=150)
+    for _ in range(3):
+        sink(BATCH)
+    sink.close()
+    sink(BATCH)
+    assert sink.stats()["dropped"] == 6
+    assert len(lines(stream.getvalue())) == 2
+
+
+def test_file_sink(tmp_path):
+    """A file sink appends to its file."""
+    path = str(tmp_path / "events.jsonl")
+    for _ in range(2):
+        sink = open_sink(path, idle=0.01)
+        assert isinstance(sink, FileSink)
+        sink(BATCH)
+        sink.close()
+    with open(path, "rb") as file:
+        assert len(lines(file.read())) == 4
+
+
+def test_unix_socket_sink(tmp_path):
+    """A unix socket sink connects on the first write."""
+    path = str(tmp_path / "sink.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    received = []
+
+    def accept():
+        conn, _ = server.accept()
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                received.append(data)
+
+    thread = threading.Thread(target=accept)
+    thread.start()
+    sink = open_sink(f"unix:{path}", idle=0.01)
+    assert isinstance(sink, UnixSocketSink)
+    assert str(sink) == f"unix:{path}"
+    sink(BATCH)
+    sink.close()
+    thread.join(5)
+    server.close()
+    assert len(lines(b"".join(received))) == 2
+
+
+def test_unix_socket_error(tmp_path):
+    """Write errors are counted, the lines of the write are lost."""
+    sink = UnixSocketSink(str(tmp_path / "missing.sock"), idle=0.01)
+    sink(BATCH)
+    sink.close()
+    assert sink.stats()["errors"] == 1
+    assert not os.path.exists(tmp_path / "missing.sock")
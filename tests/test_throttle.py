@@ -0,0 +1,116 @@
+"""Tests of the request budgets and the login circuit breaker."""
+import pytest
+
+from metronetpy import throttle
+from metronetpy.throttle import (
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_OPEN,
+    CircuitBreaker,
+    RequestBudget,
+    TokenBucket,
+)
+
+
+class Clock:
+    """A monotonic clock moved by the tests."""
+
+    def __init__(self):
+        """Init for data."""
+        self.now = 1000.0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    """Replace the clock of the throttle module."""
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_rate():
+    """A bucket needs a positive rate."""
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_bucket_burst(clock):
+    """A full bucket serves a burst, then reservations wait in order."""
+    bucket = TokenBucket(2.0, burst=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    clock.now += 1.0
+    assert bucket.reserve() == 0.5
+
+
+def test_bucket_refill(clock):
+    """The tokens refill at the rate, up to the burst."""
+    bucket = TokenBucket(1.0, burst=3)
+    for _ in range(3):
+        bucket.reserve()
+    clock.now += 100.0
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.0, 1.0]
+
+
+def test_budget(clock):
+    """A budget waits for the slowest of its buckets."""
+    shared = TokenBucket(1.0, burst=1)
+    first = RequestBudget(TokenBucket(10.0, burst=5), shared)
+    second = RequestBudget(TokenBucket(10.0, burst=5), shared)
+    assert first.reserve() == 0.0
+    assert second.reserve() == 1.0
+    assert first.reserve() == 2.0
+    assert first.stats() == {"requests": 2, "throttled": 1, "waited": 2.0}
+    assert RequestBudget().reserve() == 0.0
+
+
+def test_breaker_opens(clock):
+    """The breaker opens after threshold failed logins in a row."""
+    breaker = CircuitBreaker(threshold=3, reset=30.0)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.failures == 0
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == BREAKER_OPEN
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30.0
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_probe(clock):
+    """After reset seconds one probe is let through."""
+    breaker = CircuitBreaker(threshold=1, reset=30.0, max_reset=100.0)
+    breaker.allow()
+    breaker.record(False)
+    clock.now += 30.0
+    assert breaker.allow()
+    assert breaker.state == BREAKER_HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.retry_in() == 60.0
+    clock.now += 60.0
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.retry_in() == 100.0
+    clock.now += 100.0
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.retry_in() == 0.0
+    assert breaker.stats()["opened"] == 3
+    assert breaker.stats()["probes"] == 2 + 1
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.retry_in() == 30.0